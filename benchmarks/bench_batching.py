@@ -0,0 +1,110 @@
+"""
+Load generator for the micro-batching serving mode.
+
+Replays the same Poisson arrival pattern of requests twice, once with
+batching off (max_batch=1, every request runs alone) and once with the
+given max_batch, and prints the throughput and the latency percentiles.
+
+Usage:
+    python benchmarks/bench_batching.py --device cuda:0 --requests 32 --rate 2
+"""
+import threading
+from argparse import ArgumentParser
+from functools import partial
+from time import monotonic, sleep
+
+import numpy as np
+from PIL import Image
+
+from style_ai.batching import MicroBatcher, run_transfer_batch
+from style_ai.scheduling import IterationSchedule
+from style_ai.style_transfer import Vgg16Extractor
+
+
+def test_image(size, seed):
+    """
+    Returns a seeded random RGB image.
+    """
+    random = np.random.RandomState(seed)
+    return Image.fromarray((random.rand(size, size, 3) * 255).astype(np.uint8))
+
+
+def replay(batcher, arrivals, size):
+    """
+    Sends one request at every arrival time and returns the latency of
+    every request and the total wall-clock time.
+    """
+    latencies = [None] * len(arrivals)
+    start = monotonic()
+
+    def client(index):
+        sleep(max(arrivals[index] - (monotonic() - start), 0))
+        sent = monotonic()
+        item = {
+            "content": test_image(size, 2 * index),
+            "style": test_image(size, 2 * index + 1),
+        }
+        batcher.submit(item).result()
+        latencies[index] = monotonic() - sent
+
+    threads = [
+        threading.Thread(target=client, args=(index,)) for index in range(len(arrivals))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, monotonic() - start
+
+
+def main():
+    """
+    Runs the load with batching off and on and prints both results.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--device", type=str, default="cuda:0")
+    parser.add_argument("--size", type=int, default=256)
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--rate", type=float, default=2.0, help="requests per second")
+    parser.add_argument("--max-batch", type=int, default=4)
+    parser.add_argument("--max-wait-ms", type=float, default=50.0)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    extractor = Vgg16Extractor(space="uniform").to(args.device)
+    arrivals = np.cumsum(
+        np.random.RandomState(0).exponential(1 / args.rate, args.requests)
+    )
+    run_batch = partial(
+        run_transfer_batch,
+        extractor=extractor,
+        device=args.device,
+        schedule=IterationSchedule(budgets=args.iterations),
+    )
+
+    print(
+        f"device={args.device} size={args.size} requests={args.requests} "
+        f"rate={args.rate}/s iterations={args.iterations}"
+    )
+    for max_batch in (1, args.max_batch):
+        batcher = MicroBatcher(
+            run_batch,
+            max_batch=max_batch,
+            max_wait=args.max_wait_ms / 1000,
+            key=lambda item: item["content"].size,
+        )
+        batcher.start()
+        latencies, elapsed = replay(batcher, arrivals, args.size)
+        stats = batcher.stats()
+        batcher.shutdown()
+
+        print(
+            f"max_batch={max_batch:2d}  throughput {args.requests / elapsed:6.2f} req/s"
+            f"  p50 {np.percentile(latencies, 50):7.2f} s"
+            f"  p95 {np.percentile(latencies, 95):7.2f} s"
+            f"  mean batch {stats['mean_batch_size']:.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
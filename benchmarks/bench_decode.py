@@ -0,0 +1,107 @@
+"""
+Peak memory and latency of decoding a large upload.
+
+Compares the full decode of an upload, which the API did before, with the
+decode close to the size the style transfer needs (DCT-domain scaling for
+JPEG, reduce() for other formats). Both results are resized to RESIZE_TO
+like a job does. Every mode runs in its own process and reports the growth
+of its peak resident set size over the resident set size before the
+decode. The peak is reset through /proc, so the numbers need Linux.
+
+Usage:
+    python benchmarks/bench_decode.py --megapixels 40
+"""
+import subprocess
+import sys
+import tempfile
+from argparse import ArgumentParser
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+from PIL import Image
+
+from style_ai.api import DECODE_SIZE, RESIZE_TO, decode_image
+from style_ai.utils import pil_resize_long_edge_to
+
+MODES = {"full": None, "downscaled": DECODE_SIZE}
+
+
+def write_test_image(path, megapixels, image_format):
+    """
+    Writes a smooth random 4:3 photo-like image of the given size.
+    """
+    height = int((megapixels * 1e6 * 3 / 4) ** 0.5)
+    width = height * 4 // 3
+    random = np.random.RandomState(0)
+    small = random.rand(height // 64, width // 64, 3) * 255
+    image = Image.fromarray(small.astype(np.uint8)).resize(
+        (width, height), Image.BILINEAR
+    )
+    image.save(path, format=image_format)
+    return image.size
+
+
+def rss_mib(field):
+    """
+    Returns VmRSS or the peak VmHWM of the process in MiB.
+    """
+    for line in Path("/proc/self/status").read_text().splitlines():
+        if line.startswith(field + ":"):
+            return int(line.split()[1]) / 1024
+    raise RuntimeError(f"{field} is missing in /proc/self/status")
+
+
+def child(path, mode):
+    """
+    Decodes and resizes the image once and prints the memory growth, the
+    seconds and the decoded size.
+    """
+    data = Path(path).read_bytes()
+    # reset the peak to the current resident set size
+    Path("/proc/self/clear_refs").write_text("5")
+    baseline = rss_mib("VmRSS")
+    start = perf_counter()
+    image = decode_image(data, max_size=MODES[mode])
+    decoded = image.size
+    pil_resize_long_edge_to(image, RESIZE_TO)
+    seconds = perf_counter() - start
+    print(rss_mib("VmHWM") - baseline, seconds, decoded[0], decoded[1])
+
+
+def main():
+    """
+    Runs every mode in a subprocess and prints its memory and latency.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--megapixels", type=float, default=40)
+    parser.add_argument("--format", type=str, default="JPEG", choices=["JPEG", "PNG"])
+    parser.add_argument("--child", nargs=2, metavar=("PATH", "MODE"))
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / f"upload.{args.format.lower()}"
+        size = write_test_image(path, args.megapixels, args.format)
+        print(
+            f"{args.format} {size[0]}x{size[1]} {path.stat().st_size / 2**20:.1f} MiB"
+            f"  decode size={DECODE_SIZE}"
+        )
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, __file__, "--child", str(path), mode],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout.split()
+            memory, seconds, width, height = output[-4:]
+            print(
+                f"{mode:10} peak +{float(memory):7.1f} MiB  "
+                f"{float(seconds):6.3f}s  decoded {width}x{height}"
+            )
+
+
+if __name__ == "__main__":
+    main()
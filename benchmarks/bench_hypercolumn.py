@@ -0,0 +1,105 @@
+"""
+Microbenchmark of the hypercolumn sampling of the style images.
+
+Compares the previous host-side NumPy sampler with the vectorised
+device-side sample_hypercolumns() on the feature pyramid of a random image.
+
+Usage:
+    python benchmarks/bench_hypercolumn.py --device cuda:0 --size 512
+"""
+from argparse import ArgumentParser
+from time import perf_counter
+
+import numpy as np
+import torch
+
+from style_ai.style_transfer import Vgg16Extractor
+from style_ai.utils import sample_hypercolumns
+
+
+def legacy_sample_hypercolumns(feat, samps):
+    """
+    The sampler that forward_samples_hypercolumn used before, kept here as
+    the baseline of the benchmark.
+    """
+    x_indices, y_indices = np.meshgrid(
+        np.arange(feat[0].shape[2]), np.arange(feat[0].shape[3])
+    )
+    x_indices = np.expand_dims(x_indices.flatten(), 1)
+    y_indices = np.expand_dims(y_indices.flatten(), 1)
+    indices = np.concatenate([x_indices, y_indices], 1)
+
+    samples = min(samps, indices.shape[0])
+
+    np.random.shuffle(indices)
+    x_indices = indices[:samples, 0]
+    y_indices_sampled = indices[:samples, 1]
+
+    feat_samples = []
+    for i, layer_feat in enumerate(feat):
+        if i > 0 and layer_feat.size(2) < feat[i - 1].size(2):
+            x_indices = x_indices / 2.0
+            y_indices_sampled = y_indices_sampled / 2.0
+
+        x_indices = np.clip(x_indices, 0, layer_feat.shape[2] - 1).astype(np.int32)
+        y_indices_sampled = np.clip(
+            y_indices_sampled, 0, layer_feat.shape[3] - 1
+        ).astype(np.int32)
+
+        features = layer_feat[
+            :, :, x_indices[range(samples)], y_indices_sampled[range(samples)]
+        ]
+        feat_samples.append(features.clone().detach())
+
+    return torch.cat(feat_samples, 1)
+
+
+def timed(function, repeat, device):
+    """
+    Returns the mean runtime of a function in milliseconds.
+    """
+    function()
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    start = perf_counter()
+    for _ in range(repeat):
+        function()
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    return (perf_counter() - start) / repeat * 1000
+
+
+def main():
+    """
+    Runs the benchmark and prints the mean time per call of both samplers.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--device", type=str, default="cuda:0")
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--samps", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    extractor = Vgg16Extractor(space="uniform").to(args.device)
+    image = torch.rand(1, 3, args.size, args.size, device=args.device) * 2 - 1
+    with torch.no_grad():
+        feat = extractor(image)
+
+        legacy = timed(
+            lambda: legacy_sample_hypercolumns(feat, args.samps),
+            args.repeat,
+            args.device,
+        )
+        vectorised = timed(
+            lambda: sample_hypercolumns(feat, args.samps),
+            args.repeat,
+            args.device,
+        )
+
+    print(f"device={args.device} size={args.size} samps={args.samps}")
+    print(f"legacy     {legacy:8.3f} ms/call")
+    print(f"vectorised {vectorised:8.3f} ms/call ({legacy / vectorised:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
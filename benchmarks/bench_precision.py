@@ -0,0 +1,147 @@
+"""
+Throughput and quality check of the precision modes of the extractor.
+
+Every mode runs the same seeded strotss job at a small iteration budget.
+The final loss is compared with the float32 NCHW run and the benchmark
+fails if it is worse by more than the relative tolerance. The mean pixel
+difference to the float32 result is printed for reference only, the
+optimization amplifies tiny gradient differences, so even float32 with
+channels_last does not reproduce the reference pixels. The throughput is
+measured as forward/backward passes of the extractor.
+
+Usage:
+    python benchmarks/bench_precision.py --device cpu --size 256
+"""
+import sys
+from argparse import ArgumentParser
+from time import perf_counter
+
+import numpy as np
+import torch
+from PIL import Image
+
+from style_ai.scheduling import IterationSchedule
+from style_ai.style_transfer import Vgg16Extractor, strotss
+
+MODES = [
+    ("float32", False),
+    ("float32", True),
+    ("bfloat16", False),
+    ("bfloat16", True),
+    ("float16", False),
+]
+
+
+def test_images(size):
+    """
+    Returns a seeded content and style image.
+    """
+    random = np.random.RandomState(0)
+    gradient = np.linspace(0, 255, size, dtype=np.float32)
+    content = np.stack(
+        [
+            np.tile(gradient, (size, 1)),
+            np.tile(gradient[:, None], (1, size)),
+            random.rand(size, size) * 64,
+        ],
+        2,
+    )
+    style = random.rand(size, size, 3) * 255
+    return (
+        Image.fromarray(content.astype(np.uint8)),
+        Image.fromarray(style.astype(np.uint8)),
+    )
+
+
+def throughput(extractor, size, repeat, device):
+    """
+    Returns the forward/backward passes per second of the extractor.
+    """
+    image = torch.rand(1, 3, size, size, device=device) * 2 - 1
+    image.requires_grad_()
+
+    def step():
+        loss = sum(feat.float().mean() for feat in extractor(image))
+        loss.backward()
+
+    step()
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    start = perf_counter()
+    for _ in range(repeat):
+        step()
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    return repeat / (perf_counter() - start)
+
+
+def stylize(extractor, content, style, device, iterations):
+    """
+    Runs a seeded strotss job and returns the result as an array and its
+    final loss.
+    """
+    np.random.seed(0)
+    torch.manual_seed(0)
+    result, info = strotss(
+        content,
+        style,
+        extractor=extractor,
+        device=device,
+        schedule=IterationSchedule(budgets=iterations),
+        return_info=True,
+    )
+    return np.asarray(result, dtype=np.float32), info["loss"]
+
+
+def main():
+    """
+    Runs every mode, prints its throughput and difference to float32 and
+    exits with an error if the loss of a mode exceeds the tolerance.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--device", type=str, default="cuda:0")
+    parser.add_argument("--size", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.05,
+        help="maximum relative increase of the final loss over float32",
+    )
+    args = parser.parse_args()
+
+    content, style = test_images(args.size)
+    reference, reference_loss = None, None
+    failed = False
+    print(f"device={args.device} size={args.size} iterations={args.iterations}")
+    for precision, channels_last in MODES:
+        extractor = Vgg16Extractor(
+            space="uniform", precision=precision, channels_last=channels_last
+        ).to(args.device)
+        try:
+            passes = throughput(extractor, args.size, args.repeat, args.device)
+            result, loss = stylize(
+                extractor, content, style, args.device, args.iterations
+            )
+        except RuntimeError as error:
+            print(f"{precision:8} channels_last={channels_last!s:5} skipped: {error}")
+            continue
+
+        if reference is None:
+            reference, reference_loss = result, loss
+        loss_change = (loss - reference_loss) / reference_loss
+        pixel_difference = np.abs(result - reference).mean()
+        status = "ok" if loss_change <= args.tolerance else "FAIL"
+        failed = failed or status == "FAIL"
+        print(
+            f"{precision:8} channels_last={channels_last!s:5} "
+            f"{passes:7.2f} passes/s  loss={loss:8.4f} ({loss_change:+.2%})  "
+            f"pixel diff={pixel_difference:6.3f}  {status}"
+        )
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Throughput of one RunPod worker with and without batched pairs.
+
+Feeds synthetic jobs straight into runpod_entry.process_image(), without
+the RunPod queue. The single run sends every pair as a job of its own, the
+batched run sends the pairs of a customer as one job, so they share one
+strotss batch.
+
+Usage:
+    STYLE_AI_DEVICE=cuda:0 python benchmarks/bench_runpod.py --jobs 8 --pairs 2
+"""
+import base64
+import io
+from argparse import ArgumentParser
+from time import perf_counter
+
+import numpy as np
+from PIL import Image
+
+from style_ai import runpod_entry
+
+
+def synthetic_image(size, seed):
+    """
+    Returns a smooth random RGB image as base64 encoded JPEG.
+    """
+    random = np.random.RandomState(seed)
+    small = random.rand(max(size // 16, 1), max(size // 16, 1), 3) * 255
+    image = Image.fromarray(small.astype(np.uint8)).resize((size, size), Image.BICUBIC)
+    image_bytes = io.BytesIO()
+    image.save(image_bytes, format="JPEG")
+    return base64.b64encode(image_bytes.getvalue()).decode("utf-8")
+
+
+def synthetic_jobs(count, pairs, size, resize_to):
+    """
+    Returns jobs with a list of pairs each, like the colourway variants of
+    one customer.
+    """
+    return [
+        {
+            "id": f"job-{index}",
+            "input": {
+                "resize_to": resize_to,
+                "pairs": [
+                    {
+                        "content_img": synthetic_image(size, 2 * index),
+                        "style_img": synthetic_image(size, 2 * index + pair + 1),
+                    }
+                    for pair in range(pairs)
+                ],
+            },
+        }
+        for index in range(count)
+    ]
+
+
+def run_jobs(jobs):
+    """
+    Runs the jobs one after the other and returns the seconds taken.
+    """
+    start = perf_counter()
+    for job in jobs:
+        output = runpod_entry.process_image(job)
+        assert "error" not in output, output
+    return perf_counter() - start
+
+
+def main():
+    """
+    Runs both modes and prints the pairs per second of the worker.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=8)
+    parser.add_argument("--pairs", type=int, default=2)
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--resize-to", type=int, default=256)
+    args = parser.parse_args()
+
+    pairs = args.jobs * args.pairs
+    print(
+        f"device={runpod_entry.device} jobs={args.jobs} pairs={args.pairs} "
+        f"resize_to={args.resize_to}"
+    )
+
+    jobs = synthetic_jobs(pairs, 1, args.size, args.resize_to)
+    seconds = run_jobs(jobs)
+    print(f"single pairs      {pairs / seconds:6.3f} pairs/s")
+
+    jobs = synthetic_jobs(args.jobs, args.pairs, args.size, args.resize_to)
+    seconds = run_jobs(jobs)
+    print(
+        f"batched pairs     {args.jobs / seconds:6.3f} jobs/s  "
+        f"{pairs / seconds:6.3f} pairs/s"
+    )
+
+
+if __name__ == "__main__":
+    main()
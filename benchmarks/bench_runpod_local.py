@@ -0,0 +1,155 @@
+"""
+Load test of the webshop to worker path against the local RunPod endpoint.
+
+Every simulated customer submits jobs with the runpod client the webshop
+uses, runpod.Endpoint(...).run(...).output(), one after the other. The
+endpoint is style_ai.runpod_local, started in process or given with --url.
+The queueing delay and execution time of every job are read from its
+/status, like RunPod reports them, and printed with the end-to-end
+latency and the throughput.
+
+Usage:
+    python benchmarks/bench_runpod_local.py --customers 4 --jobs 2 --workers 2
+    python benchmarks/bench_runpod_local.py --url http://localhost:8001/v2
+"""
+import base64
+import io
+import threading
+from argparse import ArgumentParser
+from time import perf_counter, sleep
+
+import numpy as np
+import requests
+import runpod
+import uvicorn
+from PIL import Image
+
+from style_ai import runpod_local
+
+ENDPOINT_ID = "local"
+
+
+def synthetic_image(size, seed):
+    """
+    Returns a smooth random RGB image as base64 encoded JPEG.
+    """
+    random = np.random.RandomState(seed)
+    small = random.rand(max(size // 16, 1), max(size // 16, 1), 3) * 255
+    image = Image.fromarray(small.astype(np.uint8)).resize((size, size), Image.BICUBIC)
+    image_bytes = io.BytesIO()
+    image.save(image_bytes, format="JPEG")
+    return base64.b64encode(image_bytes.getvalue()).decode("utf-8")
+
+
+def start_server(port, workers, cold_start, idle_timeout):
+    """
+    Starts the local endpoint in a thread and returns its server.
+    """
+    runpod_local.endpoint.queue.workers = workers
+    runpod_local.endpoint.cold_start = cold_start
+    runpod_local.endpoint.idle_timeout = idle_timeout
+    server = uvicorn.Server(
+        uvicorn.Config(runpod_local.app, port=port, log_level="warning")
+    )
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        sleep(0.1)
+    return server
+
+
+def customer(index, jobs, size, resize_to, timeout, records):
+    """
+    Submits the jobs of one customer one after the other and appends the
+    latency and the reported times of every job to records.
+    """
+    endpoint = runpod.Endpoint(ENDPOINT_ID)
+    for job in range(jobs):
+        data = {
+            "content_img": synthetic_image(size, 2 * (index * jobs + job)),
+            "style_img": synthetic_image(size, 2 * (index * jobs + job) + 1),
+            "resize_to": resize_to,
+        }
+        start = perf_counter()
+        run_request = endpoint.run(data)
+        output = run_request.output(timeout=timeout)
+        latency = perf_counter() - start
+        status = requests.get(
+            f"{runpod.endpoint_url_base}/{ENDPOINT_ID}/status/{run_request.job_id}",
+            timeout=10,
+        ).json()
+        records.append(
+            {
+                "latency": latency,
+                "delay": status.get("delayTime", 0) / 1000,
+                "execution": status.get("executionTime", 0) / 1000,
+                "ok": output is not None and "result_image" in output,
+            }
+        )
+
+
+def percentiles(values):
+    """
+    Formats the median and the 95th percentile of values.
+    """
+    return (
+        f"p50={np.percentile(values, 50):7.2f}s p95={np.percentile(values, 95):7.2f}s"
+    )
+
+
+def main():
+    """
+    Runs the customers concurrently and prints the latencies and throughput.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--url", type=str, default=None)
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--customers", type=int, default=4)
+    parser.add_argument("--jobs", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--cold-start", type=float, default=0.0)
+    parser.add_argument("--idle-timeout", type=float, default=5.0)
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--resize-to", type=int, default=256)
+    parser.add_argument("--timeout", type=float, default=3600)
+    args = parser.parse_args()
+
+    server = None
+    if args.url is None:
+        server = start_server(
+            args.port, args.workers, args.cold_start, args.idle_timeout
+        )
+        args.url = f"http://localhost:{args.port}/v2"
+    runpod.endpoint_url_base = args.url
+
+    records: list = []
+    threads = [
+        threading.Thread(
+            target=customer,
+            args=(index, args.jobs, args.size, args.resize_to, args.timeout, records),
+        )
+        for index in range(args.customers)
+    ]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = perf_counter() - start
+
+    health = requests.get(f"{args.url}/{ENDPOINT_ID}/health", timeout=10).json()
+    print(
+        f"customers={args.customers} jobs={args.jobs} workers={args.workers} "
+        f"cold_start={args.cold_start}s"
+    )
+    print(f"completed  {sum(record['ok'] for record in records)}/{len(records)}")
+    print(f"throughput {len(records) / seconds:.3f} jobs/s")
+    print(f"queueing   {percentiles([record['delay'] for record in records])}")
+    print(f"execution  {percentiles([record['execution'] for record in records])}")
+    print(f"end-to-end {percentiles([record['latency'] for record in records])}")
+    print(f"cold starts {health['workers']['coldStarts']}")
+    if server is not None:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
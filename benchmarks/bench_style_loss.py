@@ -0,0 +1,94 @@
+"""
+Benchmark of the dense and the tiled REMD style loss.
+
+Every mode runs in its own subprocess so the peak RSS of one mode does not
+hide the other. On CUDA the peak allocated device memory is reported too.
+
+Usage:
+    python benchmarks/bench_style_loss.py --device cpu --tiles 0 512 1024
+"""
+import json
+import resource
+import subprocess
+import sys
+from argparse import ArgumentParser
+from time import perf_counter
+
+import torch
+
+from style_ai.utils import style_loss
+
+# sum of all extracted channels of the Vgg16Extractor
+CHANNELS = 3 + 2 * 64 + 128 * 2 + 256 * 3 + 512 * 2
+
+
+def run_mode(device, locations, samples, tile_size, repeat):
+    """
+    Runs forward and backward of the style loss and returns the mean latency
+    and the peak memory of this process.
+    """
+    matrix_x = torch.randn(1, CHANNELS, locations, 1, device=device)
+    matrix_y = torch.randn(1, CHANNELS, samples, 1, device=device)
+    matrix_x.requires_grad_()
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if device.startswith("cuda"):
+        torch.cuda.reset_peak_memory_stats()
+
+    start = perf_counter()
+    for _ in range(repeat):
+        loss = style_loss(matrix_x, matrix_y, tile_size=tile_size or None)
+        loss.backward()
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    latency = (perf_counter() - start) / repeat * 1000
+
+    result = {
+        "tile_size": tile_size or "dense",
+        "latency_ms": round(latency, 2),
+        "peak_rss_delta_mb": round(
+            (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024,
+            1,
+        ),
+    }
+    if device.startswith("cuda"):
+        result["peak_cuda_mb"] = round(torch.cuda.max_memory_allocated() / 2**20, 1)
+    return result
+
+
+def main():
+    """
+    Runs every mode in a subprocess and prints one line per mode.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--locations", type=int, default=1024)
+    parser.add_argument("--samples", type=int, default=5000)
+    parser.add_argument("--tiles", type=int, nargs="+", default=[0, 512, 1024])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--child", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        result = run_mode(
+            args.device, args.locations, args.samples, args.child, args.repeat
+        )
+        print(json.dumps(result))
+        return
+
+    print(
+        f"device={args.device} locations={args.locations} "
+        f"samples={args.samples} channels={CHANNELS}"
+    )
+    for tile_size in args.tiles:
+        output = subprocess.run(
+            [sys.executable, __file__, *sys.argv[1:], "--child", str(tile_size)],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        print(output.strip())
+
+
+if __name__ == "__main__":
+    main()
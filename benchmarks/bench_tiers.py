@@ -0,0 +1,131 @@
+"""
+Latency and quality of the quality tiers.
+
+Every tier runs the same seeded style transfer. The latency is the wall
+clock time of style_transfer(), the quality is the mean pixel difference
+to the print result after both are resized to the size of the smallest
+tier, so it shows how far a cheaper tier is from the best one. The number
+of scales and iterations per tier are printed with it.
+
+With --resume the print tier also runs resumed from the preview result,
+like an order after a preview, and is compared with the print from scratch.
+
+Usage:
+    python benchmarks/bench_tiers.py --device cpu --size 512
+"""
+from argparse import ArgumentParser
+from time import perf_counter
+
+import numpy as np
+import torch
+from PIL import Image
+
+from style_ai.metrics import StageTimer
+from style_ai.style_transfer import Vgg16Extractor, style_transfer
+from style_ai.tiers import TIERS
+
+
+def test_images(size):
+    """
+    Returns a seeded content and style image.
+    """
+    random = np.random.RandomState(0)
+    gradient = np.linspace(0, 255, size, dtype=np.float32)
+    content = np.stack(
+        [
+            np.tile(gradient, (size, 1)),
+            np.tile(gradient[:, None], (1, size)),
+            random.rand(size, size) * 64,
+        ],
+        2,
+    )
+    style = random.rand(size, size, 3) * 255
+    return (
+        Image.fromarray(content.astype(np.uint8)),
+        Image.fromarray(style.astype(np.uint8)),
+    )
+
+
+def stylize(extractor, content, style, device, tier, resume_from=None):
+    """
+    Runs a seeded style transfer with a tier and returns the result, the
+    seconds it took, its timer and its state.
+    """
+    np.random.seed(0)
+    torch.manual_seed(0)
+    timer = StageTimer()
+    start = perf_counter()
+    result, info = style_transfer(
+        content,
+        style,
+        extractor=extractor,
+        device=device,
+        timer=timer,
+        tier=tier,
+        resume_from=resume_from,
+        return_info=True,
+    )
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    return result, perf_counter() - start, timer, info["state"]
+
+
+def report(name, result, seconds, timer):
+    """
+    Prints the size, latency, scales and iterations of a run.
+    """
+    scales = sum(1 for stage in timer.stages if stage[0] == "optimize")
+    print(
+        f"{name:8} {result.width}x{result.height}  {seconds:8.2f}s  "
+        f"scales={scales} iterations={timer.counters.get('iterations', 0)}"
+    )
+
+
+def main():
+    """
+    Runs every tier and prints its latency and difference to print.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--device", type=str, default="cuda:0")
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument(
+        "--tiers", type=str, nargs="+", default=list(TIERS), choices=list(TIERS)
+    )
+    parser.add_argument("--resume", action="store_true")
+    args = parser.parse_args()
+
+    content, style = test_images(args.size)
+    extractor = Vgg16Extractor(space="uniform").to(args.device)
+    results, states = {}, {}
+    print(f"device={args.device} size={args.size}")
+    for name in args.tiers:
+        result, seconds, timer, states[name] = stylize(
+            extractor, content, style, args.device, TIERS[name]
+        )
+        results[name] = result
+        report(name, result, seconds, timer)
+
+    if args.resume and "preview" in states:
+        result, seconds, timer, _ = stylize(
+            extractor,
+            content,
+            style,
+            args.device,
+            TIERS["print"],
+            resume_from=states["preview"],
+        )
+        results["resumed"] = result
+        report("resumed", result, seconds, timer)
+
+    reference = results.get("print")
+    if reference is None:
+        return
+    size = min(result.size for result in results.values())
+    reference = np.asarray(reference.resize(size, Image.LANCZOS), dtype=np.float32)
+    for name, result in results.items():
+        result = np.asarray(result.resize(size, Image.LANCZOS), dtype=np.float32)
+        print(f"{name:8} pixel diff to print={np.abs(result - reference).mean():6.3f}")
+
+
+if __name__ == "__main__":
+    main()
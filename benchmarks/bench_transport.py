@@ -0,0 +1,105 @@
+"""
+Payload size and codec latency of the /transfer transport contracts.
+
+Compares the legacy contract, base64 text in the multipart upload and a
+base64 JPEG in a JSON response, with raw JPEG files in the upload and a
+raw image/jpeg response body. Both sides of a request are replayed in
+process: building the multipart body, decoding the uploads, encoding the
+result and decoding it on the client. The network time is estimated from
+the payload size and the given bandwidth.
+
+Usage:
+    python benchmarks/bench_transport.py --size 512 --mbit 100
+"""
+import base64
+import io
+import json
+from argparse import ArgumentParser
+from time import perf_counter
+
+import numpy as np
+import requests
+from PIL import Image
+
+from style_ai.api import decode_image, encode_image, image_bytes
+
+
+def test_image(size, seed):
+    """
+    Returns a smooth random RGB image, closer to a photo than plain noise.
+    """
+    random = np.random.RandomState(seed)
+    small = random.rand(size // 16, size // 16, 3) * 255
+    return Image.fromarray(small.astype(np.uint8)).resize((size, size), Image.BICUBIC)
+
+
+def multipart_body(files) -> bytes:
+    """
+    Returns the multipart body that requests would send for the files.
+    """
+    request = requests.Request("POST", "http://localhost/", files=files)
+    return request.prepare().body
+
+
+def legacy_round_trip(content, style):
+    """
+    Returns the request and response bytes of the base64 contract.
+    """
+    files = [
+        ("content_img", base64.b64encode(image_bytes(content))),
+        ("style_img", base64.b64encode(image_bytes(style))),
+    ]
+    body = multipart_body(files)
+    decode_image(files[0][1], "base64").load()
+    decode_image(files[1][1], "base64").load()
+
+    response = json.dumps({"message": "ok", "result_image": encode_image(content)})
+    data = json.loads(response)
+    Image.open(io.BytesIO(base64.b64decode(data["result_image"]))).load()
+    return len(body), len(response)
+
+
+def raw_round_trip(content, style):
+    """
+    Returns the request and response bytes of the raw contract.
+    """
+    files = [
+        ("content_img", ("content.jpg", image_bytes(content))),
+        ("style_img", ("style.jpg", image_bytes(style))),
+    ]
+    body = multipart_body(files)
+    decode_image(files[0][1][1]).load()
+    decode_image(files[1][1][1]).load()
+
+    response = image_bytes(content)
+    Image.open(io.BytesIO(response)).load()
+    return len(body), len(response)
+
+
+def main():
+    """
+    Runs both contracts and prints the bytes and time per request.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--mbit", type=float, default=100.0)
+    args = parser.parse_args()
+
+    content, style = test_image(args.size, 0), test_image(args.size, 1)
+    print(f"size={args.size} bandwidth={args.mbit} Mbit/s")
+    for name, round_trip in (("base64", legacy_round_trip), ("raw", raw_round_trip)):
+        round_trip(content, style)
+        start = perf_counter()
+        for _ in range(args.repeat):
+            sent, received = round_trip(content, style)
+        codec = (perf_counter() - start) / args.repeat * 1000
+        network = (sent + received) * 8 / (args.mbit * 1e6) * 1000
+        print(
+            f"{name:7} request {sent / 1024:7.1f} KiB  response {received / 1024:7.1f}"
+            f" KiB  codec {codec:6.2f} ms  network {network:6.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
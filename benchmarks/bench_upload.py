@@ -0,0 +1,139 @@
+"""
+Upload size and latency of the webshop uploads for phone photos.
+
+Compares the full-size upload, the RGB conversion encoded as JPEG at the
+size of the photo, with the upload encode_upload() prepares, resized to
+the long edge the API works at and encoded adaptively. Both sides of a
+/jobs request are replayed in process: encoding on the webshop, building
+the multipart body, decoding the upload and resizing it to RESIZE_TO on
+the API. The upload time is estimated from the request size and the
+given uplink bandwidth.
+
+Usage:
+    python benchmarks/bench_upload.py --megapixels 12 --mbit 20
+"""
+import io
+from argparse import ArgumentParser
+from time import perf_counter
+
+import numpy as np
+import requests
+from PIL import Image, ImageDraw
+
+from sts.utils.ai_client import encode_upload
+from style_ai.api import DECODE_SIZE, RESIZE_TO, decode_image
+from style_ai.utils import pil_resize_long_edge_to
+
+
+def phone_photo(megapixels, seed):
+    """
+    Returns a 4:3 photo-like image opened from a JPEG, like the webshop
+    gets it from st.file_uploader: smooth random structure with sensor
+    noise.
+    """
+    height = int((megapixels * 1e6 * 3 / 4) ** 0.5)
+    width = height * 4 // 3
+    random = np.random.RandomState(seed)
+    small = random.rand(height // 64, width // 64, 3) * 255
+    image = np.asarray(
+        Image.fromarray(small.astype(np.uint8)).resize((width, height), Image.BICUBIC),
+        dtype=np.float32,
+    )
+    image += random.normal(0, 6, image.shape).astype(np.float32)
+    photo = io.BytesIO()
+    Image.fromarray(np.clip(image, 0, 255).astype(np.uint8)).save(
+        photo, format="JPEG", quality=92
+    )
+    return Image.open(photo)
+
+
+def drawing(megapixels, seed):
+    """
+    Returns a drawing with a few flat colors opened from a PNG, like a logo
+    or a poster used as style image.
+    """
+    height = int((megapixels * 1e6 * 3 / 4) ** 0.5)
+    width = height * 4 // 3
+    random = np.random.RandomState(seed)
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x, y = random.randint(0, width), random.randint(0, height)
+        radius = random.randint(height // 20, height // 4)
+        color = tuple(int(value) for value in random.randint(0, 256, 3))
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=color)
+    file = io.BytesIO()
+    image.save(file, format="PNG")
+    return Image.open(file)
+
+
+def full_upload(image):
+    """
+    Returns the upload of the full-size image.
+    """
+    upload = io.BytesIO()
+    image.convert("RGB").save(upload, format="JPEG")
+    return "upload.jpg", upload.getvalue()
+
+
+def resized_upload(image):
+    """
+    Returns the upload resized on the webshop.
+    """
+    return encode_upload(image, RESIZE_TO)
+
+
+def round_trip(content, style, prepare):
+    """
+    Returns the request bytes and the seconds of the webshop and the API.
+    """
+    start = perf_counter()
+    files = [("content_img", prepare(content)), ("style_img", prepare(style))]
+    body = requests.Request("POST", "http://localhost/jobs", files=files).prepare()
+    client = perf_counter() - start
+
+    start = perf_counter()
+    for _, (_, data) in files:
+        pil_resize_long_edge_to(decode_image(data, max_size=DECODE_SIZE), RESIZE_TO)
+    server = perf_counter() - start
+    return len(body.body), client, server, files[0][1][0]
+
+
+def main():
+    """
+    Runs both uploads and prints the bytes and the time per request.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--megapixels", type=float, default=12)
+    parser.add_argument("--mbit", type=float, default=20.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--kind", choices=["photo", "drawing"], default="photo")
+    args = parser.parse_args()
+
+    make = phone_photo if args.kind == "photo" else drawing
+    content, style = make(args.megapixels, 0), make(args.megapixels, 1)
+    content.load()
+    style.load()
+    print(
+        f"{args.kind} {content.size[0]}x{content.size[1]} resize_to={RESIZE_TO}"
+        f" uplink={args.mbit} Mbit/s"
+    )
+    for name, prepare in (("full", full_upload), ("resized", resized_upload)):
+        round_trip(content, style, prepare)
+        sent, client, server = 0, 0.0, 0.0
+        for _ in range(args.repeat):
+            sent, seconds_client, seconds_server, file_name = round_trip(
+                content, style, prepare
+            )
+            client += seconds_client / args.repeat
+            server += seconds_server / args.repeat
+        network = sent * 8 / (args.mbit * 1e6)
+        print(
+            f"{name:8} {file_name:11} request {sent / 1024:8.1f} KiB  webshop"
+            f" {client * 1000:7.1f} ms  upload {network * 1000:8.1f} ms  api"
+            f" {server * 1000:7.1f} ms  total {(client + network + server):6.2f} s"
+        )
+
+
+if __name__ == "__main__":
+    main()
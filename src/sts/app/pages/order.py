@@ -10,8 +10,14 @@ from streamlit_extras.app_logo import add_logo
 
 from sts.app.database import save_order
 from sts.utils.checkout_utils import generate_cart, generate_payment_link
-from sts.utils.streamlit_utils import (get_authenticator, is_logged_in,
-                                       overlay_image, transfer)
+from sts.utils.streamlit_utils import (
+    get_authenticator,
+    is_logged_in,
+    overlay_image,
+    poll_transfer,
+    show_transfer,
+    submit_transfer,
+)
 from sts.utils.utils import Product
 
 add_logo(logo_url="src/sts/img/Style-Transfer_Webshop_Logo.png", height=80)
@@ -45,6 +51,7 @@ def upload_image(column_num):
             use_column_width=True,
         )
 
+
 def create_image():
     """
     Creates the AI image by uploading two images and generating the AI image.
@@ -71,11 +78,11 @@ def create_image():
     )
 
     if generate and all([image is not None for image in st.session_state["images"]]):
-        ai_image = transfer(
-            st.session_state["images"][0], st.session_state["images"][1]
-        )
+        st.session_state["ai_image"] = None
+        submit_transfer(st.session_state["images"][0], st.session_state["images"][1])
 
-        st.session_state["ai_image"] = ai_image
+    # the job is polled by poll_transfer() at the end of main()
+    show_transfer()
 
     if st.session_state["ai_image"] is not None:
         _, col, _ = st.columns((1, 2, 1))
@@ -93,6 +100,7 @@ def create_image():
                 st.session_state["current_page"] = place_product
                 st.experimental_rerun()
 
+
 def cart():
     """
     Displays the cart with the added products and allows interaction with the cart items.
@@ -112,14 +120,24 @@ def cart():
             with information:
                 subheader = f"{item.type} ({item.color})"
                 st.subheader(subheader)
-                size, quant, delete = st.columns((1,1, 0.3))
+                size, quant, delete = st.columns((1, 1, 0.3))
                 with size:
-                    item.size=st.selectbox("Size", ("S", "M", "L", "XL"),
-                                              index=["S", "M", "L", "XL"].index(item.size),
-                                              key=f"size-{i}")
+                    item.size = st.selectbox(
+                        "Size",
+                        ("S", "M", "L", "XL"),
+                        index=["S", "M", "L", "XL"].index(item.size),
+                        key=f"size-{i}",
+                    )
                 with quant:
-                    item.count=st.number_input(label="Quantity", min_value=0, max_value=None, step=1,
-                                                  value=item.count, format="%i", key=f"count-{i}")
+                    item.count = st.number_input(
+                        label="Quantity",
+                        min_value=0,
+                        max_value=None,
+                        step=1,
+                        value=item.count,
+                        format="%i",
+                        key=f"count-{i}",
+                    )
                 with delete:
                     st.markdown("## ")
                     delete_button = st.button("🗑️", key=f"delete-{i}")
@@ -140,6 +158,7 @@ def cart():
     else:
         st.info("Your cart is empty")
 
+
 def place_product():
     """
     Allows the user to select product type, size, and form, and overlays the AI image with the selected product.
@@ -147,14 +166,16 @@ def place_product():
     Returns:
         None
     """
-    _, col, _ = st.columns((1,3,1))
+    _, col, _ = st.columns((1, 3, 1))
     st.title("Select Product")
     ai_image = st.session_state.get("ai_image")
     with col:
         product_preview = st.empty()
     if ai_image is not None:
         if st.session_state["product_picture"] is not None:
-            product_preview.image(st.session_state.get("product_picture"), caption="White Shirt")
+            product_preview.image(
+                st.session_state.get("product_picture"), caption="White Shirt"
+            )
         else:
             product_preview.image(ai_image, caption="Generated AI Image")
         product_type = "Shirt"
@@ -169,26 +190,50 @@ def place_product():
             product_color = st.selectbox("Color:", ("White", "Black"))
         st.subheader("Select Size:")
         size = st.selectbox("Size", ("S", "M", "L", "XL"))
-        circle = st.checkbox("Form: Circle", False, None, None, on_change = None, args = None, kwargs = None, label_visibility = "visible", )
+        circle = st.checkbox(
+            "Form: Circle",
+            False,
+            None,
+            None,
+            on_change=None,
+            args=None,
+            kwargs=None,
+            label_visibility="visible",
+        )
         if circle:
             st.session_state["circle_image"] = True
         else:
             st.session_state["circle_image"] = False
-        img_size = st.slider("Image Size:", min_value = 0.25, max_value = 0.75, value = 0.5, step = 0.05, label_visibility = "visible")
+        img_size = st.slider(
+            "Image Size:",
+            min_value=0.25,
+            max_value=0.75,
+            value=0.5,
+            step=0.05,
+            label_visibility="visible",
+        )
         shirt_image = overlay_image(
-            (product_type, product_color), ai_image_bytes, array_shape, st.session_state["circle_image"], img_size
+            (product_type, product_color),
+            ai_image_bytes,
+            array_shape,
+            st.session_state["circle_image"],
+            img_size,
         )
         st.session_state["product_picture"] = shirt_image
         product_preview.image(shirt_image, caption=f"{product_type} ({product_color})")
-        place_product_button = st.button("Place Product in Cart",use_container_width=True)
+        place_product_button = st.button(
+            "Place Product in Cart", use_container_width=True
+        )
         if place_product_button:
             cart_items = st.session_state.get("cart_items", [])
-            product = Product(pimage=st.session_state["product_picture"],
-                              psize=size,
-                              ai_size=img_size,
-                              ptype=product_type,
-                              pcolor=product_color,
-                              pcount=1)
+            product = Product(
+                pimage=st.session_state["product_picture"],
+                psize=size,
+                ai_size=img_size,
+                ptype=product_type,
+                pcolor=product_color,
+                pcount=1,
+            )
             for i, item in enumerate(cart_items):
                 if product == item:
                     cart_items[i].count += 1
@@ -201,6 +246,7 @@ def place_product():
     else:
         st.warning("Please generate the AI image first!")
 
+
 def checkout():
     """
     Creates the checkout page.
@@ -210,15 +256,18 @@ def checkout():
     to end his shopping experience.
     """
 
-    shipping_address_from = st.form("Shipping address", )
+    shipping_address_from = st.form(
+        "Shipping address",
+    )
     shipping_address_from.subheader("Shipping Address")
     full_name = shipping_address_from.text_input("Full Name")
     street_and_number = shipping_address_from.text_input("Street and Number")
     city = shipping_address_from.text_input("City")
     zipcode = shipping_address_from.text_input("zip")
     shipping_address_from.divider()
-    if shipping_address_from.form_submit_button("Continue to payment", use_container_width=True):
-
+    if shipping_address_from.form_submit_button(
+        "Continue to payment", use_container_width=True
+    ):
         if street_and_number == "" or city == "" or zipcode == "" or full_name == "":
             st.error("Please fill out all fields!")
             return
@@ -227,15 +276,19 @@ def checkout():
             "full_name": full_name,
             "street_and_number": street_and_number,
             "city": city,
-            "zip": zipcode
+            "zip": zipcode,
         }
         st.session_state["current_page"] = payment
 
         _, checkout_items, _ = generate_cart(st.session_state.get("cart_items", []))
-        st.session_state["stripe_url"], st.session_state["payment_session"] = generate_payment_link(checkout_items)
+        (
+            st.session_state["stripe_url"],
+            st.session_state["payment_session"],
+        ) = generate_payment_link(checkout_items)
 
         st.experimental_rerun()
 
+
 def payment():
     """
     Creates the payment page.
@@ -249,35 +302,43 @@ def payment():
     add_vertical_space.add_vertical_space(3)
     st.table(table)
     st.markdown(
-            f"<div style='display: flex; justify-content: flex-end;'><p>"\
-                f"Total sum of your order: <strong> {total_sum:.2f}€</strong></p></div>",
-            unsafe_allow_html=True
-        )
+        f"<div style='display: flex; justify-content: flex-end;'><p>"
+        f"Total sum of your order: <strong> {total_sum:.2f}€</strong></p></div>",
+        unsafe_allow_html=True,
+    )
 
     st.divider()
 
-    st.markdown(f'''
+    st.markdown(
+        f"""
         <a href={st.session_state["stripe_url"]} style="color: inherit;">
             <button class="css-1a359ur e1ewe7hr10">
                 <div data-testid="stMarkdownContainer" class="css-x78sv8 eqr7zpz4"><p>Pay Now</p></div>
             </button>
-        </a>''', unsafe_allow_html=True)
+        </a>""",
+        unsafe_allow_html=True,
+    )
     add_vertical_space.add_vertical_space(1)
     check_button = st.button("Check payment status", use_container_width=True)
 
     if check_button:
-        st.session_state["payment_session"] = stripe.checkout.Session.retrieve(st.session_state["payment_session"].id)
+        st.session_state["payment_session"] = stripe.checkout.Session.retrieve(
+            st.session_state["payment_session"].id
+        )
         status = st.session_state["payment_session"].payment_status
         if status == "paid":
             st.session_state["current_page"] = success
             st.session_state["cart_items"] = []
             st.session_state["ai_image"] = None
             st.session_state["images"] = [None, None]
-            save_order(st.session_state["username"], st.session_state["address"], total_sum)
+            save_order(
+                st.session_state["username"], st.session_state["address"], total_sum
+            )
             st.experimental_rerun()
         else:
             st.warning("Payment not successful yet. Please pay and recheck afterwards.")
 
+
 def success():
     """
     Creates the success page.
@@ -291,6 +352,7 @@ def success():
         st.session_state["current_page"] = create_image
         st.experimental_rerun()
 
+
 def main() -> None:
     """
     The main function that serves as the entry point of the Streamlit application.
@@ -301,7 +363,6 @@ def main() -> None:
 
     st.sidebar.title("Order Process")
     if is_logged_in():
-
         if "images" not in st.session_state:
             st.session_state["images"] = [None, None]
 
@@ -319,7 +380,8 @@ def main() -> None:
 
         cart_btn = st.sidebar.button(
             f"Cart [{sum([item.count for item in st.session_state.get('cart_items', [])])}]",
-            key="cart_button", use_container_width=True
+            key="cart_button",
+            use_container_width=True,
         )
         create_image_btn = st.sidebar.button(
             "Create AI Image", key="create_image_button", use_container_width=True
@@ -330,7 +392,9 @@ def main() -> None:
             disabled=st.session_state["ai_image"] is None,
         )
         checkout_btn = st.sidebar.button(
-            "Checkout", use_container_width=True, disabled=len(st.session_state.get("cart_items", [])) == 0
+            "Checkout",
+            use_container_width=True,
+            disabled=len(st.session_state.get("cart_items", [])) == 0,
         )
 
         if cart_btn:
@@ -354,6 +418,11 @@ def main() -> None:
                 st.experimental_rerun()
             else:
                 st.session_state["current_page"]()
+
+        # last, its rerun skips everything after it, the transfer is only
+        # polled while its page is shown
+        if st.session_state["current_page"] is create_image:
+            poll_transfer()
     else:
         st.title("Order")
         st.warning(
@@ -363,5 +432,6 @@ def main() -> None:
         auth = get_authenticator()
         auth.login("Login to access the app", location="sidebar")
 
+
 if __name__ == "__main__":
     main()
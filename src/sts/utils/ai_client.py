@@ -0,0 +1,376 @@
+"""
+This module contains the client of the webshop for the Style AI service,
+one or more style_ai APIs or a RunPod endpoint.
+"""
+
+import io
+import random
+import threading
+import time
+
+import requests
+import runpod
+from PIL import Image
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+AI_DEFAULTS = {
+    "url": "http://localhost:8000",
+    "request_timeout": 10.0,
+    "job_timeout": 600.0,
+    "poll_interval": 0.5,
+    "poll_backoff": 1.5,
+    "poll_max_interval": 2.0,
+    "retries": 3,
+    "retry_backoff": 0.25,
+    "health_ttl": 10.0,
+    "pool_size": 10,
+    "resize_to": 256,
+    "upload_quality": 90,
+}
+# methods a server may see twice without a different outcome
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+# share of distinct colors below which an upload is a graphic, e.g. a logo or
+# a drawing, a photo has about as many colors as pixels
+GRAPHIC_COLOR_SHARE = 1 / 8
+# JPEG quality of uploads the service enlarges, their artifacts grow with them
+ENLARGED_QUALITY = 95
+
+
+def encode_upload(img, resize_to: int, quality: int = 90) -> tuple:
+    """
+    Resizes an image to the long edge the AI service works at and encodes
+    it for the upload. Graphics with few colors are sent as lossless PNG,
+    JPEG would ring around their flat areas, photos as JPEG. Smaller
+    images are not enlarged, the service does that itself, and are sent
+    at a higher JPEG quality.
+
+    Parameters:
+        img (PIL.Image): The uploaded image.
+        resize_to (int): The long edge the AI service resizes to.
+        quality (int): The JPEG quality of resized photos.
+
+    Returns:
+        tuple: The file name and the encoded bytes.
+    """
+    # before the resize, Pillow resizes palette and bilevel images with
+    # NEAREST, which would alias the graphics the PNG path protects
+    img = img.convert("RGB")
+    if max(img.size) > resize_to:
+        # the same size as pil_resize_long_edge_to() on the server, so its
+        # resize is a no-op, the reducing gap shrinks by whole factors first
+        scale = resize_to / max(img.size)
+        img = img.resize(
+            (int(img.width * scale), int(img.height * scale)),
+            Image.BICUBIC,
+            reducing_gap=3.0,
+        )
+    else:
+        quality = max(quality, ENLARGED_QUALITY)
+
+    upload = io.BytesIO()
+    max_colors = int(img.width * img.height * GRAPHIC_COLOR_SHARE)
+    if img.getcolors(max_colors) is not None:
+        img.save(upload, format="PNG", optimize=True)
+        return "upload.png", upload.getvalue()
+    # no chroma subsampling, every pixel of the upload is a model input
+    img.save(upload, format="JPEG", quality=quality, subsampling=0)
+    return "upload.jpg", upload.getvalue()
+
+
+def failed_to_connect(error: requests.exceptions.ConnectionError) -> bool:
+    """
+    Checks whether a request failed before it reached the server, because
+    the connection was refused or could not be opened in time.
+
+    Parameters:
+        error (requests.exceptions.ConnectionError): The error of the request.
+
+    Returns:
+        bool: True if the server cannot have seen the request.
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = error.args[0] if error.args else None
+    # requests wraps the urllib3 error in a MaxRetryError
+    reason = getattr(reason, "reason", reason)
+    return isinstance(reason, NewConnectionError)
+
+
+class NoBackendAvailable(Exception):
+    """
+    Raised when none of the style_ai APIs answers its health check.
+    """
+
+
+class AIClient:
+    """
+    Client for the style_ai APIs with a pooled keep-alive session. Requests
+    that fail to connect are retried with a jittered exponential backoff.
+    New jobs go to the healthy backend with the least work per worker, the
+    health of every backend is checked at most every health_ttl seconds.
+    The jobs are polled and cancelled on the backend that took them.
+
+    Parameters:
+        urls (list): The base URLs of the style_ai APIs.
+        request_timeout (float): Seconds per HTTP request.
+        retries (int): Number of retries of a request that failed to connect.
+        retry_backoff (float): Seconds before the first retry, doubled for
+            every further retry.
+        health_ttl (float): Seconds a health check is reused.
+        pool_size (int): Number of kept-alive connections per backend.
+        runpod_settings (dict): The [runpod] section of the toml.
+        settings (dict): The [ai] section of the toml with AI_DEFAULTS.
+    """
+
+    def __init__(
+        self,
+        urls: list,
+        request_timeout: float = 10.0,
+        retries: int = 3,
+        retry_backoff: float = 0.25,
+        health_ttl: float = 10.0,
+        pool_size: int = 10,
+        runpod_settings: dict = None,
+        settings: dict = None,
+    ) -> None:
+        self.urls = [url.rstrip("/") for url in urls]
+        self.request_timeout = request_timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.health_ttl = health_ttl
+        self.runpod_settings = runpod_settings or {}
+        self.settings = settings or dict(AI_DEFAULTS)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=max(len(self.urls), 1), pool_maxsize=pool_size
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._health: dict = {}
+        self._lock = threading.Lock()
+        self._endpoint = None
+
+    @classmethod
+    def from_config(cls, config: dict) -> "AIClient":
+        """
+        Creates the client from the parsed toml.
+
+        Parameters:
+            config (dict): The toml from load_user_toml().
+
+        Returns:
+            AIClient: The client with the [ai] and [runpod] settings.
+        """
+        settings = {**AI_DEFAULTS, **config.get("ai", {})}
+        urls = settings["url"]
+        if isinstance(urls, str):
+            urls = [urls]
+        return cls(
+            urls,
+            request_timeout=settings["request_timeout"],
+            retries=settings["retries"],
+            retry_backoff=settings["retry_backoff"],
+            health_ttl=settings["health_ttl"],
+            pool_size=settings["pool_size"],
+            runpod_settings=config.get("runpod", {}),
+            settings=settings,
+        )
+
+    @property
+    def use_runpod(self) -> bool:
+        """
+        Whether the jobs run on the RunPod endpoint instead of the APIs.
+        """
+        return self.runpod_settings.get("use") == "true"
+
+    def endpoint(self) -> runpod.Endpoint:
+        """
+        Returns the RunPod endpoint, created on the first call.
+
+        Returns:
+            runpod.Endpoint: The endpoint of the [runpod] settings.
+        """
+        if self._endpoint is None:
+            runpod.api_key = self.runpod_settings["api_key"]
+            if self.runpod_settings.get("url"):
+                # e.g. the local stand-in style_ai.runpod_local
+                runpod.endpoint_url_base = self.runpod_settings["url"]
+            self._endpoint = runpod.Endpoint(self.runpod_settings["endpoint"])
+        return self._endpoint
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Sends a request on the pooled session. Requests that failed to
+        connect are retried. Other connection errors, e.g. a reset
+        connection, are only retried for idempotent methods, the server may
+        have acted on a POST before the connection broke.
+
+        Parameters:
+            method (str): The HTTP method.
+            url (str): The full URL.
+            **kwargs: Passed on to requests.Session.request().
+
+        Returns:
+            requests.Response: The response.
+        """
+        kwargs.setdefault("timeout", self.request_timeout)
+        for attempt in range(self.retries + 1):
+            try:
+                return self.session.request(method, url, **kwargs)
+            except requests.exceptions.ConnectionError as error:
+                retry = method.upper() in IDEMPOTENT_METHODS or failed_to_connect(error)
+                if not retry or attempt == self.retries:
+                    raise
+                # full jitter, so the clients of a restarted backend spread out
+                time.sleep(random.uniform(0, self.retry_backoff * 2**attempt))
+        raise AssertionError("unreachable")
+
+    def health(self, url: str) -> dict:
+        """
+        Returns the cached /health of a backend, None if it is down.
+
+        Parameters:
+            url (str): The base URL of the backend.
+
+        Returns:
+            dict: The body of /health or None.
+        """
+        with self._lock:
+            checked, body = self._health.get(url, (None, None))
+        if checked is not None and time.monotonic() - checked < self.health_ttl:
+            return body
+        try:
+            # a single attempt, a backend that is down is skipped right away
+            response = self.session.get(f"{url}/health", timeout=self.request_timeout)
+            body = response.json() if response.ok else None
+        except (requests.exceptions.RequestException, ValueError):
+            body = None
+        with self._lock:
+            self._health[url] = (time.monotonic(), body)
+        return body
+
+    def mark_down(self, url: str) -> None:
+        """
+        Skips a backend until its next health check.
+
+        Parameters:
+            url (str): The base URL of the backend.
+        """
+        with self._lock:
+            self._health[url] = (time.monotonic(), None)
+
+    def backends(self) -> list:
+        """
+        Returns the healthy backends, the one with the least queued and
+        running jobs per worker first.
+
+        Returns:
+            list: The base URLs.
+        """
+        loads = []
+        for url in self.urls:
+            body = self.health(url)
+            if body is None:
+                continue
+            jobs = body.get("jobs") or {}
+            load = (jobs.get("queued", 0) + jobs.get("running", 0)) / max(
+                jobs.get("workers", 1), 1
+            )
+            loads.append((load, url))
+        # ties are broken at random, so the clients do not pile onto one
+        random.shuffle(loads)
+        return [url for _, url in sorted(loads, key=lambda item: item[0])]
+
+    def submit(self, files: list, params: dict) -> tuple:
+        """
+        Queues a job on the best backend with POST /jobs. A backend that
+        is full or refuses the connection is skipped for the next one.
+
+        Parameters:
+            files (list): The content_img and style_img uploads.
+            params (dict): The query parameters of /jobs.
+
+        Returns:
+            tuple: The base URL of the backend and the job id.
+
+        Raises:
+            NoBackendAvailable: If no backend is healthy.
+            requests.HTTPError: If every backend refused the job.
+        """
+        backends = self.backends()
+        if not backends:
+            raise NoBackendAvailable("No AI service is reachable.")
+        for index, url in enumerate(backends):
+            last = index == len(backends) - 1
+            try:
+                response = self.request(
+                    "POST", f"{url}/jobs", files=files, params=params
+                )
+            except requests.exceptions.ConnectionError as error:
+                # a job that may have been queued is not sent a second time
+                if not failed_to_connect(error):
+                    raise
+                self.mark_down(url)
+                if last:
+                    raise
+                continue
+            if response.status_code == 429 and not last:
+                continue
+            response.raise_for_status()
+            return url, response.json()["job_id"]
+        raise AssertionError("unreachable")
+
+    def job(self, url: str, job_id: str) -> requests.Response:
+        """
+        Reads the state of a job with GET /jobs/{job_id}, without its images,
+        so a poll does not make the server encode them.
+
+        Parameters:
+            url (str): The base URL of the backend that took the job.
+            job_id (str): The id of the job.
+
+        Returns:
+            requests.Response: The response.
+        """
+        return self.request("GET", f"{url}/jobs/{job_id}", params={"images": "false"})
+
+    def preview(self, url: str, job_id: str) -> requests.Response:
+        """
+        Reads the latest preview of a job as a raw JPEG with
+        GET /jobs/{job_id}/preview.
+
+        Parameters:
+            url (str): The base URL of the backend that took the job.
+            job_id (str): The id of the job.
+
+        Returns:
+            requests.Response: The response.
+        """
+        return self.request("GET", f"{url}/jobs/{job_id}/preview")
+
+    def result(self, url: str, job_id: str) -> requests.Response:
+        """
+        Reads the result of a finished job as a raw JPEG with
+        GET /jobs/{job_id}/result.
+
+        Parameters:
+            url (str): The base URL of the backend that took the job.
+            job_id (str): The id of the job.
+
+        Returns:
+            requests.Response: The response.
+        """
+        return self.request("GET", f"{url}/jobs/{job_id}/result")
+
+    def cancel(self, url: str, job_id: str) -> None:
+        """
+        Cancels a job with DELETE /jobs/{job_id}.
+
+        Parameters:
+            url (str): The base URL of the backend that took the job.
+            job_id (str): The id of the job.
+        """
+        self.request("DELETE", f"{url}/jobs/{job_id}")
@@ -4,16 +4,18 @@ This module contains utility functions for the Streamlit app.
 
 import base64
 import io
+import time
 from functools import lru_cache
 
 import numpy as np
 import requests
-import runpod
 import streamlit as st
+import streamlit.components.v1 as components
 import streamlit_authenticator as stauth
 from PIL import Image, ImageDraw
 
 import sts.app.database as db
+from sts.utils.ai_client import AIClient, NoBackendAvailable, encode_upload
 from sts.utils.utils import get_module_root, load_user_toml
 
 user_data = load_user_toml()
@@ -23,6 +25,10 @@ white_tshirt = get_module_root() / "img" / "white_tshirt.png"
 white_hoodie = get_module_root() / "img" / "white_hoodie.png"
 black_hoodie = get_module_root() / "img" / "black_hoodie.png"
 
+autorefresh_component = components.declare_component(
+    "autorefresh", path=str(get_module_root() / "utils" / "autorefresh")
+)
+
 
 @lru_cache
 def overlay_image(strg, input_image, array_shape, is_circle=False, size=None):
@@ -130,91 +136,318 @@ def check_if_logged_in():
     return True
 
 
-def convert_img_to_base64(img) -> str:
+def convert_base64_to_img(base64_str: str):
     """
-    Converts an image to a base64 string.
+    Converts a base64 string to an image.
 
     Parameters:
-        img (PIL.Image): The input image as a PIL Image object.
+        base64_str (str): The base64-encoded string representing the image.
 
     Returns:
-        str: The base64-encoded string representing the image.
+        PIL.Image: The decoded image as a PIL Image object.
     """
 
-    result_bytes = io.BytesIO()
-    img.save(result_bytes, format="JPEG")
-    result_bytes.seek(0)
-    result_base64 = base64.b64encode(result_bytes.getvalue()).decode("utf-8")
-    return result_base64
+    img = Image.open(io.BytesIO(base64.b64decode(base64_str)))
+    return img
 
 
-def convert_base64_to_img(base64_str: str):
+@st.cache_resource
+def get_ai_client() -> AIClient:
     """
-    Converts a base64 string to an image.
+    Returns the AI service client shared by all sessions, so the toml is
+    parsed once and the connections are kept alive between reruns.
+
+    Returns:
+        AIClient: The client of the [ai] and [runpod] settings.
+    """
+    return AIClient.from_config(user_data)
+
+
+def submit_transfer(content_img, style_img):
+    """
+    Submits the style transfer of the content image and returns right away.
+    The job handle is kept in st.session_state["transfer_job"], its result
+    is collected by poll_transfer() on the following reruns and shown by
+    show_transfer().
 
     Parameters:
-        base64_str (str): The base64-encoded string representing the image.
+        content_img (PIL.Image): The content image as a PIL Image object.
+        style_img (PIL.Image): The style image as a PIL Image object.
 
     Returns:
-        PIL.Image: The decoded image as a PIL Image object.
+        bool: True if the job was submitted.
     """
+    # a new transfer replaces the pending one
+    cancel_transfer()
+    st.session_state.pop("transfer_status", None)
+    client = get_ai_client()
+    settings = client.settings
+    resize_to = (
+        int(client.runpod_settings.get("resize_to", 512))
+        if client.use_runpod
+        else int(settings["resize_to"])
+    )
+    # the service only works at resize_to, so the uploads are shrunk here
+    content_upload = encode_upload(content_img, resize_to, settings["upload_quality"])
+    style_upload = encode_upload(style_img, resize_to, settings["upload_quality"])
 
-    img = Image.open(io.BytesIO(base64.b64decode(base64_str)))
-    return img
+    try:
+        if client.use_runpod:
+            # the RunPod input is JSON, so the images have to be base64 encoded
+            handle = client.endpoint().run(
+                {
+                    "content_img": base64.b64encode(content_upload[1]).decode("utf-8"),
+                    "style_img": base64.b64encode(style_upload[1]).decode("utf-8"),
+                    "resize_to": resize_to,
+                    "timeout": settings["job_timeout"],
+                }
+            )
+            backend = "runpod"
+        else:
+            # the API takes the raw image files
+            files = [("content_img", content_upload), ("style_img", style_upload)]
+            handle = client.submit(
+                files,
+                {
+                    "user": st.session_state.get("username") or "anonymous",
+                    "timeout": settings["job_timeout"],
+                },
+            )
+            backend = "api"
+    except requests.exceptions.HTTPError as error:
+        if error.response.status_code == 429:
+            st.warning("The AI service is busy, please try again in a minute.")
+        else:
+            st.error(f"Style transfer could not be started: {error}")
+        return False
+    except (NoBackendAvailable, requests.exceptions.ConnectionError):
+        st.error("ConnectionError: Make sure the server is running.")
+        return False
+    except requests.exceptions.RequestException as error:
+        st.error(f"Style transfer could not be started: {error}")
+        return False
+
+    st.session_state["transfer_job"] = {
+        "backend": backend,
+        "handle": handle,
+        "deadline": time.monotonic() + settings["job_timeout"],
+        "interval": settings["poll_interval"],
+    }
+    return True
 
 
-def transfer(content_img, style_img):
+def read_api_job(handle: tuple, client: AIClient, preview: dict = None) -> dict:
     """
-    Transfers style from the style image to the content image.
+    Reads the state of a job of a style_ai API. The state is polled without
+    images, a preview is only downloaded when its scale changed and the
+    result once the job is done, both as raw JPEG.
 
     Parameters:
-        content_img (PIL.Image): The content image as a PIL Image object.
-        style_img (PIL.Image): The style image as a PIL Image object.
+        handle (tuple): The backend URL and job id from AIClient.submit().
+        client (AIClient): The client from get_ai_client().
+        preview (dict): The preview of the last poll, reused while the
+            scale is the same.
 
     Returns:
-        PIL.Image: The result image with the transferred style.
+        dict: The state ("queued", "running", "done" or "failed") with the
+            queue position, the latest preview, the result or the error.
     """
-    content_img = content_img.convert("RGB")
-    style_img = style_img.convert("RGB")
+    response = client.job(*handle)
+    if response.status_code == 404:
+        # the server restarted or dropped the finished job
+        return {"state": "failed", "error": "The job is no longer known."}
+    response.raise_for_status()
+    body = response.json()
+    status = {"state": body["state"], "position": body.get("position")}
+    if body["state"] == "done":
+        response = client.result(*handle)
+        response.raise_for_status()
+        status["result"] = Image.open(io.BytesIO(response.content))
+        return status
+    if body["state"] not in ("queued", "running"):
+        status["state"] = "failed"
+        status["error"] = body.get("error") or body["state"]
+        return status
+
+    scale = (body.get("preview") or {}).get("scale")
+    if preview is not None and preview["scale"] == scale:
+        status["preview"] = preview
+    elif scale is not None:
+        response = client.preview(*handle)
+        if response.ok:
+            status["preview"] = {
+                **body["preview"],
+                "image": Image.open(io.BytesIO(response.content)),
+            }
+        else:
+            # e.g. a 409 right after a restart, the next poll tries again
+            status["preview"] = preview
+    return status
 
-    content_img = convert_img_to_base64(content_img)
-    style_img = convert_img_to_base64(style_img)
 
-    if load_user_toml()["runpod"]["use"] == "true":
-        runpod.api_key = load_user_toml()["runpod"]["api_key"]
-        endpoint = runpod.Endpoint(load_user_toml()["runpod"]["endpoint"])
+def read_runpod_job(job, client: AIClient) -> dict:
+    """
+    Reads the state of a RunPod job, RunPod reports no previews.
 
-        data = {
-            "content_img": content_img,
-            "style_img": style_img,
-            "resize_to": 512,
-        }
+    Parameters:
+        job (runpod.endpoint.runner.Job): The job returned by Endpoint.run().
+        client (AIClient): The client from get_ai_client().
 
-        run_request = endpoint.run(
-            data,
-        )
+    Returns:
+        dict: The state like read_api_job().
+    """
+    try:
+        state = job.status()
+    except (RuntimeError, ValueError) as error:
+        # a failed job carries its error in the status, a job the endpoint
+        # does not know, e.g. after a restart, has no status at all
+        return {"state": "failed", "error": str(error)}
+    if state == "IN_QUEUE":
+        return {"state": "queued"}
+    if state == "IN_PROGRESS":
+        return {"state": "running"}
+    if state != "COMPLETED":
+        return {"state": "failed", "error": state}
+    try:
+        output = job.output(timeout=client.request_timeout)
+    except (RuntimeError, ValueError) as error:
+        return {"state": "failed", "error": str(error)}
+    if not output or "result_image" not in output:
+        return {"state": "failed", "error": (output or {}).get("error", "no output")}
+    return {"state": "done", "result": convert_base64_to_img(output["result_image"])}
 
-        with st.spinner("Transferring style..."):
-            result = run_request.output()
 
-        result_image = convert_base64_to_img(result["result_image"])
-        return result_image
+def cancel_transfer():
+    """
+    Cancels the pending transfer of the session, if there is one.
+    """
+    job = st.session_state.pop("transfer_job", None)
+    if job is None:
+        return
+    client = get_ai_client()
+    try:
+        if job["backend"] == "runpod":
+            handle = job["handle"]
+            handle.rp_client.post(
+                f"{handle.endpoint_id}/cancel/{handle.job_id}",
+                {},
+                timeout=client.request_timeout,
+            )
+        else:
+            client.cancel(*job["handle"])
+    except requests.exceptions.RequestException:
+        # the job stops at its own timeout on the server
+        pass
 
+
+def autorefresh(interval: float, key: str):
+    """
+    Reruns the script once after interval seconds. The timer runs in the
+    browser, so the script finishes right away, and it is dropped when the
+    next run does not draw the refresh again, e.g. on another page.
+
+    Parameters:
+        interval (float): Seconds until the rerun.
+        key (str): The widget key of the refresh.
+    """
+    autorefresh_component(interval=int(interval * 1000), key=key, default=0)
+
+
+def show_transfer():
+    """
+    Shows the progress of the pending transfer of the session, as read by
+    the last poll_transfer(), with a button to cancel it. A failed transfer
+    is reported once.
+    """
+    status = st.session_state.get("transfer_status")
+    if status is not None and status["state"] == "failed":
+        del st.session_state["transfer_status"]
+        st.error(status["error"])
+        return
+    if "transfer_job" not in st.session_state:
+        return
+
+    status = status or {"state": "queued"}
+    preview = status.get("preview")
+    if preview is not None:
+        st.progress(
+            preview["scale"] / preview["num_scales"],
+            text=f"Transferring style... scale {preview['scale']}/{preview['num_scales']}",
+        )
+        st.image(
+            preview["image"],
+            caption=f"Preview {preview['scale']}/{preview['num_scales']}",
+            use_column_width=True,
+        )
+    elif status["state"] == "queued":
+        position = status.get("position")
+        st.info(
+            "Waiting for the AI service..."
+            if not position
+            else f"Waiting for the AI service, {position} jobs ahead..."
+        )
+    elif status["state"] == "unreachable":
+        st.warning("The AI service is not reachable, retrying...")
     else:
-        files = [("content_img", content_img), ("style_img", style_img)]
+        st.info("Transferring style...")
+    if st.button("Cancel", key="cancel_transfer"):
+        cancel_transfer()
+        st.session_state.pop("transfer_status", None)
 
+
+def poll_transfer():
+    """
+    Polls the pending transfer of the session once. A finished result is
+    stored in st.session_state["ai_image"], the state is kept for
+    show_transfer(). While the job runs, autorefresh() reruns the script
+    after the poll interval, which grows by the configured backoff up to
+    poll_max_interval. A finished or failed transfer reruns it right away,
+    which skips the rest of the script, so call it last on the page that
+    shows the transfer, after the page state is set.
+    """
+    job = st.session_state.get("transfer_job")
+    if job is None:
+        return
+    client = get_ai_client()
+    settings = client.settings
+
+    if time.monotonic() > job["deadline"]:
+        cancel_transfer()
+        status = {
+            "state": "failed",
+            "error": "The style transfer took too long, please try again.",
+        }
+    else:
         try:
-            with st.spinner("Transferring style..."):
-                response = requests.post("http://localhost:8000/transfer", files=files)
-        except requests.exceptions.ConnectionError:
-            st.error("ConnectionError: Make sure the server is running.")
-            return None
-
-        retult_img = Image.open(
-            io.BytesIO(base64.b64decode(response.json()["result_image"]))
+            if job["backend"] == "runpod":
+                status = read_runpod_job(job["handle"], client)
+            else:
+                previous = st.session_state.get("transfer_status") or {}
+                status = read_api_job(
+                    job["handle"], client, preview=previous.get("preview")
+                )
+        except requests.exceptions.RequestException:
+            # the service may be restarting, keep polling until the deadline
+            status = {"state": "unreachable"}
+        if status["state"] == "failed":
+            status["error"] = f"Style transfer failed: {status['error']}"
+
+    if status["state"] == "done":
+        st.session_state.pop("transfer_job", None)
+        st.session_state.pop("transfer_status", None)
+        st.session_state["ai_image"] = status.pop("result")
+    elif status["state"] == "failed":
+        st.session_state.pop("transfer_job", None)
+        st.session_state["transfer_status"] = status
+    else:
+        st.session_state["transfer_status"] = status
+        autorefresh(job["interval"], key="transfer_refresh")
+        job["interval"] = min(
+            job["interval"] * settings["poll_backoff"], settings["poll_max_interval"]
         )
-
-        return retult_img
+        return
+    # redraws the page with the new state, e.g. enables Place Product
+    st.experimental_rerun()
 
 
 def display_register(auth: stauth.Authenticate):
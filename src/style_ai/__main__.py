@@ -3,12 +3,30 @@ This file is used to run the fastAPI using
 uvicorn when the package is run as a module. 
 """
 
+import os
 import sys
+from argparse import ArgumentParser
 from pathlib import Path
 
 root = Path(__file__).parent
 
 if __name__ == "__main__":
+    parser = ArgumentParser(prog="python -m style_ai")
+    parser.add_argument(
+        "--dev",
+        action="store_true",
+        help="single process that reloads on code changes",
+    )
+    # every process loads its own model and keeps its own jobs, so more
+    # than one process needs sticky routing for the /jobs endpoints
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("STYLE_AI_PROCESSES", "1")),
+        help="number of server processes, the cores are split between them",
+    )
+    args = parser.parse_args()
+
     sys.argv = [
         "uvicorn",
         "style_ai.api:app",
@@ -16,7 +34,17 @@ if __name__ == "__main__":
         "0.0.0.0",
         "--port",
         "8000",
-        "--reload",
     ]
+    if args.dev:
+        sys.argv.append("--reload")
+        os.environ["STYLE_AI_PROCESSES"] = "1"
+    else:
+        sys.argv += ["--workers", str(args.workers)]
+        # read by the processes, they split the memory budget between them
+        os.environ["STYLE_AI_PROCESSES"] = str(args.workers)
+        # torch sizes its thread pool by the cores, split them so the
+        # processes do not oversubscribe the CPU
+        threads = max((os.cpu_count() or 1) // args.workers, 1)
+        os.environ.setdefault("OMP_NUM_THREADS", str(threads))
     sys.path.append(str(root))
     sys.exit(__import__("uvicorn").main())
@@ -0,0 +1,70 @@
+"""
+Memory estimates of style transfer jobs for the admission control
+"""
+import os
+
+import torch
+
+from style_ai.tiers import TIERS, QualityTier
+
+# VGG16 activations per input pixel that autograd keeps for the backward
+# pass: the conv outputs of the five blocks at 1, 1/4, 1/16, 1/64 and 1/256
+# of the pixels
+ACTIVATIONS_PER_PIXEL = (
+    2 * 64 + 2 * 128 / 4 + 3 * 256 / 16 + 3 * 512 / 64 + 3 * 512 / 256
+)
+# the kept activations, their gradients and the content features
+ACTIVATION_COPIES = 3
+HALF_PRECISIONS = ("bfloat16", "float16")
+
+
+def estimate_job_bytes(
+    resize_to: int, tier: QualityTier = None, precision: str = "float32"
+) -> int:
+    """
+    Estimates the peak memory of one job at its finest scale, the coarser
+    scales need a fraction of it. The image is assumed to be square, the
+    worst case for a long edge of resize_to.
+    :params:
+        resize_to: long edge of the job
+        tier: quality tier of the job, defaults to standard
+        precision: precision mode of the extractor
+    :returns:
+        estimated bytes
+    """
+    if tier is None:
+        tier = TIERS["standard"]
+    element_bytes = 2 if precision in HALF_PRECISIONS else 4
+    activations = (
+        resize_to**2 * ACTIVATIONS_PER_PIXEL * ACTIVATION_COPIES * element_bytes
+    )
+    # the float32 distance matrices of the style loss, with their gradient
+    style_samples = tier.style_draws * tier.style_samples
+    if tier.loss_tile_size is not None:
+        style_samples = min(style_samples, tier.loss_tile_size)
+    distances = 2 * 2 * tier.num_locations * style_samples * 4
+    return int(activations + distances)
+
+
+def default_memory_budget(device: str, reserved: int = 0) -> int:
+    """
+    Returns the memory the jobs of a process may use together. The budget
+    of the whole server is set in MiB by STYLE_AI_MEMORY_BUDGET_MB, without
+    it it is 90% of the GPU memory or half of the physical memory on the
+    CPU. The server processes share the device, so every one of the
+    STYLE_AI_PROCESSES processes gets an equal share of it.
+    :params:
+        device: device the jobs run on
+        reserved: bytes the process already takes, e.g. by the model
+    :returns:
+        budget in bytes
+    """
+    budget = os.environ.get("STYLE_AI_MEMORY_BUDGET_MB")
+    if budget:
+        total = int(budget) * 2**20
+    elif device.startswith("cuda") and torch.cuda.is_available():
+        total = torch.cuda.get_device_properties(device).total_memory * 0.9
+    else:
+        total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") * 0.5
+    processes = max(int(os.environ.get("STYLE_AI_PROCESSES", "1")), 1)
+    return max(int(total / processes) - reserved, 0)
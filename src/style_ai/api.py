@@ -1,15 +1,560 @@
 """
 API Endpoint for the style transfer AI.
 """
+import asyncio
 import base64
 import io
+import json
+import logging
+import os
+import queue
+from contextlib import asynccontextmanager
+from math import ceil
+from time import perf_counter
+from typing import Literal
 
-from fastapi import FastAPI, UploadFile
-from PIL import Image
+from fastapi import FastAPI, HTTPException, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import (
+    JSONResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+)
+from PIL import Image, UnidentifiedImageError
 
+from style_ai.admission import default_memory_budget, estimate_job_bytes
+from style_ai.batching import MicroBatcher, run_transfer_batch
+from style_ai.cancellation import DEADLINE_EXCEEDED, JobCancelled
+from style_ai.feature_cache import StyleFeatureCache
+from style_ai.jobs import DONE, Job, JobQueue, OverBudget, QueueFull
+from style_ai.metrics import (
+    Counter,
+    Gauge,
+    Histogram,
+    MetricsRegistry,
+    StageTimer,
+)
+from style_ai.registry import ModelRegistry
+from style_ai.result_cache import ResultCache
 from style_ai.style_transfer import style_transfer
+from style_ai.tiers import TIERS, get_tier
+from style_ai.utils import pil_resize_long_edge_to
 
-app = FastAPI(title="Style Transfer AI")
+RESIZE_TO = 2**8
+PREVIEW_TIER = get_tier("preview")
+TRANSFER_WEIGHT = 1.5 * 16
+# the uploads are decoded close to the largest size any tier resizes to
+DECODE_SIZE = max([RESIZE_TO] + [tier.resize_to for tier in TIERS.values()])
+MAX_UPLOAD_BYTES = int(os.environ.get("STYLE_AI_MAX_UPLOAD_MB", "20")) * 2**20
+# two base64 uploads and the form fields
+MAX_REQUEST_BYTES = 3 * MAX_UPLOAD_BYTES
+UPLOAD_CHUNK_BYTES = 2**20
+DRAIN_SECONDS = float(os.environ.get("STYLE_AI_DRAIN_SECONDS", "60"))
+
+style_cache = StyleFeatureCache(directory=os.environ.get("STYLE_AI_FEATURE_CACHE_DIR"))
+result_cache = ResultCache(
+    max_bytes=int(os.environ.get("STYLE_AI_RESULT_CACHE_MB", "256")) * 2**20,
+    directory=os.environ.get("STYLE_AI_RESULT_CACHE_DIR"),
+)
+registry = ModelRegistry.from_env()
+
+logging.basicConfig(level=os.environ.get("STYLE_AI_LOG_LEVEL", "INFO"))
+logger = logging.getLogger(__name__)
+
+metrics = MetricsRegistry()
+stage_seconds = metrics.register(
+    Histogram(
+        "style_ai_stage_seconds",
+        "Seconds spent in a stage of a job",
+        labelnames=("stage",),
+    )
+)
+scale_seconds = metrics.register(
+    Histogram(
+        "style_ai_scale_seconds",
+        "Seconds spent optimizing one scale",
+        labelnames=("scale",),
+    )
+)
+job_seconds = metrics.register(
+    Histogram(
+        "style_ai_job_seconds",
+        "Seconds from submission until a job is finished",
+        labelnames=("state",),
+        buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600),
+    )
+)
+iterations_total = metrics.register(
+    Counter("style_ai_iterations_total", "Optimization iterations run")
+)
+
+
+def run_job(job: Job) -> Image.Image:
+    """
+    Runs the style transfer of a queued job, identical requests share one
+    run through the result cache.
+    """
+    return transfer_cached(job)
+
+
+def preview_state_key(job: Job) -> str:
+    """
+    Returns the key of the optimization state a preview job leaves behind.
+    """
+    return ResultCache.make_key(
+        job.inputs["content"],
+        job.inputs["style"],
+        state=PREVIEW_TIER.name,
+        weight=TRANSFER_WEIGHT,
+        space=registry.space,
+        precision=registry.precision,
+    )
+
+
+def transfer_cached(job: Job) -> Image.Image:
+    """
+    Returns the result of a job from the result cache or runs the transfer.
+    A job of a larger tier resumes from the state of an earlier preview of
+    the same images, so it only runs the finer scales.
+    """
+    tier = job.inputs["tier"]
+    resume_from = None
+    if tier is not None and tier.resize_to > PREVIEW_TIER.resize_to:
+        resume_from = result_cache.get_state(preview_state_key(job))
+    job.inputs["resume_from"] = resume_from
+    key = ResultCache.make_key(
+        job.inputs["content"],
+        job.inputs["style"],
+        resize_to=RESIZE_TO if tier is None else tier.resize_to,
+        tier=None if tier is None else tier.name,
+        resumed=resume_from is not None,
+        weight=TRANSFER_WEIGHT,
+        space=registry.space,
+        precision=registry.precision,
+    )
+    return result_cache.get_or_compute(
+        key, lambda: transfer(job), cancel_token=job.token
+    )
+
+
+def transfer(job: Job) -> Image.Image:
+    """
+    Runs the style transfer of a job, alone or as part of a micro-batch.
+    Without a tier the job runs the standard settings at RESIZE_TO. The
+    state of a preview job is kept for a later print of the same images.
+    """
+    content, style = job.inputs["content"], job.inputs["style"]
+    timer, tier = job.inputs["timer"], job.inputs["tier"]
+    resume_from = job.inputs["resume_from"]
+    if batcher is None:
+        result, info = style_transfer(
+            content,
+            style,
+            extractor=registry.extractor,
+            weight=TRANSFER_WEIGHT,
+            device=registry.device,
+            resize_to=RESIZE_TO,
+            style_cache=style_cache,
+            callback=job.publish_preview,
+            cancel_token=job.token,
+            timer=timer,
+            tier=tier,
+            resume_from=resume_from,
+            return_info=True,
+        )
+        state = info["state"]
+    else:
+        result, state = transfer_batched(job)
+    if tier is PREVIEW_TIER:
+        result_cache.put_state(preview_state_key(job), state)
+    return result
+
+
+def transfer_batched(job: Job) -> tuple:
+    """
+    Runs the style transfer of a job as part of a micro-batch and returns
+    the result and its optimization state.
+    """
+    content, style = job.inputs["content"], job.inputs["style"]
+    timer, tier = job.inputs["timer"], job.inputs["tier"]
+    resize_to = RESIZE_TO if tier is None else tier.resize_to
+    with timer.stage("resize"):
+        content = pil_resize_long_edge_to(content, resize_to)
+        style = pil_resize_long_edge_to(style, resize_to)
+    item = {
+        "content": content,
+        "style": style,
+        "tier": tier,
+        "resume_from": job.inputs["resume_from"],
+        "callback": job.publish_preview,
+        "cancel_token": job.token,
+        "timer": timer,
+    }
+    result = batcher.submit(item).result()
+    return result, item["state"]
+
+
+def run_batch(items: list) -> list:
+    """
+    Runs a micro-batch of requests with the shared extractor, the batcher
+    only puts requests of the same tier and resumed state size into one
+    batch.
+    """
+    return run_transfer_batch(
+        items,
+        extractor=registry.extractor,
+        device=registry.device,
+        weight=TRANSFER_WEIGHT,
+        style_cache=style_cache,
+        tier=items[0]["tier"],
+    )
+
+
+def record_job(job: Job, inputs: dict) -> None:
+    """
+    Adds the stage timings of a finished job to the metrics and logs its
+    timing record as one JSON line. Called by the job queue for every job,
+    also for the jobs that were cancelled or expired while they waited.
+    """
+    timer, state = inputs["timer"], job.state
+    record = {
+        "job_id": job.id,
+        "user": job.user,
+        "state": state,
+        "queued_seconds": round((job.started or job.finished) - job.submitted, 6),
+        "total_seconds": round(job.finished - job.submitted, 6),
+        **timer.record(),
+    }
+    for stage in record["stages"]:
+        if stage["stage"] == "optimize":
+            scale_seconds.observe(stage["seconds"], scale=stage["scale"])
+        else:
+            stage_seconds.observe(stage["seconds"], stage=stage["stage"])
+    stage_seconds.observe(record["queued_seconds"], stage="queue")
+    job_seconds.observe(record["total_seconds"], state=state)
+    iterations_total.inc(timer.counters.get("iterations", 0))
+    logger.info("job timing %s", json.dumps(record))
+
+
+# with STYLE_AI_MAX_BATCH above 1 the requests that arrive within
+# STYLE_AI_MAX_WAIT_MS are batched, the workers then only wait for the
+# batcher, so there are at least as many as fit into one batch
+MAX_BATCH = int(os.environ.get("STYLE_AI_MAX_BATCH", "1"))
+batcher = (
+    MicroBatcher(
+        run_batch,
+        max_batch=MAX_BATCH,
+        max_wait=float(os.environ.get("STYLE_AI_MAX_WAIT_MS", "50")) / 1000,
+        key=lambda item: (
+            item["content"].size,
+            item["tier"],
+            None if item["resume_from"] is None else item["resume_from"].shape,
+        ),
+    )
+    if MAX_BATCH > 1
+    else None
+)
+job_queue = JobQueue(
+    run_job,
+    workers=max(int(os.environ.get("STYLE_AI_WORKERS", "1")), MAX_BATCH),
+    max_queued=int(os.environ.get("STYLE_AI_QUEUE_SIZE", "16")),
+    on_finish=record_job,
+)
+metrics.register(
+    Gauge(
+        "style_ai_queue_depth",
+        "Jobs waiting in the queue",
+        function=lambda: job_queue.stats()["queued"],
+    )
+)
+metrics.register(
+    Gauge(
+        "style_ai_jobs_running",
+        "Jobs running on the workers",
+        function=lambda: job_queue.stats()["running"],
+    )
+)
+metrics.register(
+    Gauge(
+        "style_ai_memory_reserved_bytes",
+        "Estimated memory of the running jobs",
+        function=lambda: job_queue.stats()["memory_reserved"],
+    )
+)
+metrics.register(
+    Gauge(
+        "style_ai_extractor_bytes",
+        "Bytes of the parameters and buffers of the extractor",
+        function=registry.memory_bytes,
+    )
+)
+metrics.register(
+    Gauge(
+        "style_ai_device_allocated_bytes",
+        "Bytes allocated by torch on the GPU, 0 on the CPU",
+        function=registry.device_memory_bytes,
+    )
+)
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """
+    Loads and warms up the model, then starts the workers of the job queue
+    with a memory budget that leaves out the memory the model took. On
+    shutdown the queued and running jobs get DRAIN_SECONDS to finish.
+    """
+    await run_in_threadpool(registry.load, RESIZE_TO)
+    job_queue.memory_budget = default_memory_budget(
+        registry.device, reserved=registry.device_memory_bytes()
+    )
+    if batcher is not None:
+        batcher.start()
+    job_queue.start()
+    yield
+    drained = await run_in_threadpool(job_queue.drain, DRAIN_SECONDS)
+    if not drained:
+        logger.warning("Cancelled the jobs left after %s seconds", DRAIN_SECONDS)
+    if batcher is not None:
+        batcher.shutdown(timeout=30)
+
+
+app = FastAPI(title="Style Transfer AI", lifespan=lifespan)
+
+
+class RequestSizeLimit:
+    """
+    ASGI middleware that answers 413 for requests with a body above
+    max_bytes. A declared Content-Length is checked before the body is
+    read. The bytes of every body are also counted while it streams in, so
+    a chunked request without Content-Length is cut off at the limit
+    instead of being spooled in full by the multipart parser.
+
+    Parameters:
+        app: The wrapped ASGI app.
+        max_bytes (int): Size limit of a request body.
+    """
+
+    def __init__(self, app, max_bytes: int) -> None:
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        too_large = JSONResponse(
+            status_code=413,
+            content={"detail": f"Request is larger than {self.max_bytes} bytes"},
+        )
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.max_bytes:
+            await too_large(scope, receive, send)
+            return
+
+        received = 0
+        cut_off = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, cut_off
+            if cut_off:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # the app sees a disconnected client and stops reading
+                    cut_off = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            if cut_off:
+                # the app answers the cut off body, the 413 replaces that
+                return
+            response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:  # pylint: disable=broad-except
+            if not cut_off:
+                raise
+        if cut_off and not response_started:
+            await too_large(scope, receive, send)
+
+
+app.add_middleware(RequestSizeLimit, max_bytes=MAX_REQUEST_BYTES)
+
+
+IMAGE_FORMATS = {"jpeg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp")}
+
+
+def decode_image(data: bytes, encoding: str = "raw", max_size=None) -> Image.Image:
+    """
+    Converts an upload to a decoded image. The upload holds the raw image
+    file, or with the legacy "base64" encoding its base64 text.
+    With max_size a large image is decoded close to that long edge, never
+    below it. A JPEG is scaled by 1/2, 1/4 or 1/8 in the DCT domain while it
+    is decoded, so the full resolution image never exists in memory. Other
+    formats are decoded fully and then reduced by a whole factor.
+    Images with alpha, grayscale and palette images are converted to RGB.
+    """
+    if encoding == "base64":
+        data = base64.b64decode(data)
+    image = Image.open(io.BytesIO(data))
+    if max_size is not None and max(image.size) > max_size:
+        scale = max_size / max(image.size)
+        image.draft("RGB", (ceil(image.width * scale), ceil(image.height * scale)))
+    image.load()
+    # before the reduce, which rejects palette, bilevel and 16 bit images
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if max_size is not None and max(image.size) // max_size >= 2:
+        image = image.reduce(max(image.size) // max_size)
+    return image
+
+
+async def read_upload(upload: UploadFile, max_bytes: int) -> bytearray:
+    """
+    Reads an upload in chunks and answers 413 as soon as it is larger than
+    max_bytes. The multipart parser has already spooled the upload, larger
+    ones to a temporary file, RequestSizeLimit caps the whole request.
+    """
+    data = bytearray()
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            return data
+        data.extend(chunk)
+        if len(data) > max_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Upload {upload.filename} is larger than {max_bytes} bytes",
+            )
+
+
+async def read_images(
+    content_img: UploadFile, style_img: UploadFile, encoding: str
+) -> dict:
+    """
+    Reads the content and style uploads up to MAX_UPLOAD_BYTES each and
+    decodes them close to DECODE_SIZE in the threadpool.
+    :returns:
+        the inputs of a job, both images and the StageTimer of the job
+    """
+    max_bytes = MAX_UPLOAD_BYTES
+    if encoding == "base64":
+        max_bytes = 4 * ceil(MAX_UPLOAD_BYTES / 3)
+    content_data = await read_upload(content_img, max_bytes)
+    style_data = await read_upload(style_img, max_bytes)
+
+    timer = StageTimer()
+    try:
+        with timer.stage("decode"):
+            content = await run_in_threadpool(
+                decode_image, content_data, encoding, DECODE_SIZE
+            )
+            style = await run_in_threadpool(
+                decode_image, style_data, encoding, DECODE_SIZE
+            )
+    except Image.DecompressionBombError as error:
+        raise HTTPException(status_code=413, detail=str(error)) from error
+    except UnidentifiedImageError as error:
+        raise HTTPException(
+            status_code=415, detail="Uploads have to be image files"
+        ) from error
+    except (OSError, ValueError) as error:
+        # truncated or corrupt image files and invalid base64
+        raise HTTPException(
+            status_code=400, detail=f"Upload could not be decoded: {error}"
+        ) from error
+    return {"content": content, "style": style, "timer": timer}
+
+
+def image_bytes(image: Image.Image, image_format: str = "jpeg") -> bytes:
+    """
+    Converts an image to the bytes of a JPEG or WebP file.
+    """
+    start = perf_counter()
+    result_bytes = io.BytesIO()
+    image.save(result_bytes, format=IMAGE_FORMATS[image_format][0])
+    stage_seconds.observe(perf_counter() - start, stage="encode")
+    return result_bytes.getvalue()
+
+
+def encode_image(image: Image.Image) -> str:
+    """
+    Converts an image to a base64 encoded JPEG.
+    """
+    return base64.b64encode(image_bytes(image)).decode("utf-8")
+
+
+def image_response(image: Image.Image, image_format: str) -> Response:
+    """
+    Returns an image as the raw body of a response.
+    """
+    return Response(
+        content=image_bytes(image, image_format),
+        media_type=IMAGE_FORMATS[image_format][1],
+    )
+
+
+def cancelled_error(error: JobCancelled) -> HTTPException:
+    """
+    Maps a cancelled job to an HTTP error, 504 for a passed deadline and the
+    nginx convention 499 for a client that went away.
+    """
+    status_code = 504 if error.reason == DEADLINE_EXCEEDED else 499
+    return HTTPException(status_code=status_code, detail=str(error))
+
+
+def submit_job(
+    user: str, inputs: dict, tier: str = None, listener=None, timeout=None
+) -> Job:
+    """
+    Queues a style transfer, answers 429 if the queue is full and 413 if
+    the job needs more memory than the whole budget.
+    """
+    inputs["tier"] = None if tier is None else get_tier(tier)
+    resize_to = RESIZE_TO if tier is None else inputs["tier"].resize_to
+    try:
+        return job_queue.submit(
+            user,
+            inputs,
+            listener=listener,
+            timeout=timeout,
+            cost=estimate_job_bytes(resize_to, inputs["tier"], registry.precision),
+        )
+    except OverBudget as error:
+        raise HTTPException(status_code=413, detail=str(error)) from error
+    except QueueFull as error:
+        raise HTTPException(
+            status_code=429, detail=str(error), headers={"Retry-After": "5"}
+        ) from error
+
+
+async def wait_for_job(request: Request, job: Job):
+    """
+    Waits for a job without blocking the event loop and cancels it as soon
+    as the client disconnects, so abandoned work is released.
+    """
+    task = asyncio.ensure_future(run_in_threadpool(job.wait))
+    while not task.done():
+        await asyncio.wait({task}, timeout=0.5)
+        if not task.done() and await request.is_disconnected():
+            job_queue.cancel(job.id, "client disconnected")
+    return await task
+
+
+def server_sent_event(event: str, data: dict) -> str:
+    """
+    Formats one server-sent event.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 
 @app.get("/health")
@@ -18,31 +563,221 @@ def read_root():
     Returns the status of the API.
     """
 
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "model": registry.stats(),
+        "style_cache": style_cache.stats(),
+        "result_cache": result_cache.stats(),
+        "jobs": job_queue.stats(),
+        "batching": batcher.stats() if batcher is not None else None,
+        "tiers": {name: tier.describe() for name, tier in TIERS.items()},
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    """
+    Returns the metrics of the service in the Prometheus text format.
+    """
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
 
 @app.post("/transfer")
-async def upload_images(content_img: UploadFile, style_img: UploadFile):
+async def upload_images(
+    request: Request,
+    content_img: UploadFile,
+    style_img: UploadFile,
+    timeout: float = None,
+    user: str = "anonymous",
+    encoding: Literal["raw", "base64"] = "raw",
+    tier: Literal["preview", "standard", "print"] = None,
+    response_format: Literal["json", "jpeg", "webp"] = "json",
+):
     """
     Uploads two images and returns the result of the style transfer.
+    The transfer runs on the job queue and is stopped when the client
+    disconnects or after the optional timeout in seconds.
+    The uploads are raw image files, encoding=base64 accepts the legacy
+    base64 uploads. response_format=jpeg or webp returns the image itself
+    instead of the base64 JSON body. tier=preview, standard or print picks
+    the quality tier, the default keeps the standard settings at RESIZE_TO.
     """
 
-    content_file_content = await content_img.read()
-    style_file_content = await style_img.read()
-
-    content = Image.open(io.BytesIO(base64.b64decode(content_file_content)))
-    style = Image.open(io.BytesIO(base64.b64decode(style_file_content)))
+    inputs = await read_images(content_img, style_img, encoding)
 
-    result = style_transfer(content, style, resize_to=2**8)
+    job = submit_job(user, inputs, tier=tier, timeout=timeout)
+    try:
+        result = await wait_for_job(request, job)
+    except JobCancelled as error:
+        raise cancelled_error(error) from error
 
-    # Convert the resulting image to base64 string
-    result_bytes = io.BytesIO()
-    result.save(result_bytes, format="JPEG")
-    result_bytes.seek(0)
-    result_base64 = base64.b64encode(result_bytes.getvalue()).decode("utf-8")
+    if response_format != "json":
+        return image_response(result, response_format)
 
     # Return the result image
     return {
         "message": "Images transferred successfully!",
-        "result_image": result_base64,
+        "result_image": encode_image(result),
     }
+
+
+@app.post("/transfer/stream")
+async def stream_images(
+    content_img: UploadFile,
+    style_img: UploadFile,
+    timeout: float = None,
+    user: str = "anonymous",
+    encoding: Literal["raw", "base64"] = "raw",
+    tier: Literal["preview", "standard", "print"] = None,
+):
+    """
+    Uploads two images and streams the style transfer as server-sent events.
+    A "preview" event with the intermediate image is sent after every scale,
+    followed by a "result" event with the same body as /transfer, or an
+    "error" event. The transfer is stopped when the client disconnects or
+    after the optional timeout in seconds. tier picks the quality tier.
+    """
+
+    inputs = await read_images(content_img, style_img, encoding)
+
+    events: queue.Queue = queue.Queue()
+
+    def listener(job: Job, event: str):
+        if event == "preview":
+            scale_index, num_scales, image = job.preview
+            events.put(
+                (
+                    "preview",
+                    {
+                        "scale": scale_index + 1,
+                        "num_scales": num_scales,
+                        "image": encode_image(image),
+                    },
+                )
+            )
+        elif event == DONE:
+            events.put(
+                (
+                    "result",
+                    {
+                        "message": "Images transferred successfully!",
+                        "result_image": encode_image(job.result),
+                    },
+                )
+            )
+        else:
+            error = job.error or JobCancelled(job.token.reason)
+            events.put(("error", {"message": str(error)}))
+
+    job = submit_job(user, inputs, tier=tier, listener=listener, timeout=timeout)
+
+    async def stream():
+        try:
+            while True:
+                event, data = await run_in_threadpool(events.get)
+                yield server_sent_event(event, data)
+                if event != "preview":
+                    break
+        finally:
+            # the generator is closed early when the client disconnects
+            job_queue.cancel(job.id, "client disconnected")
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+def describe_job(job: Job, images: bool = True) -> dict:
+    """
+    Returns the state of a job with its queue position and the scale of the
+    latest preview. If images is set, the body also holds the preview and,
+    once the job is done, the result as base64.
+    """
+    body = job.describe()
+    body["position"] = job_queue.position(job)
+    if job.preview is not None:
+        scale_index, num_scales, image = job.preview
+        body["preview"] = {"scale": scale_index + 1, "num_scales": num_scales}
+        if images:
+            body["preview"]["image"] = encode_image(image)
+    if images and job.state == DONE:
+        body["result_image"] = encode_image(job.result)
+    return body
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(
+    content_img: UploadFile,
+    style_img: UploadFile,
+    timeout: float = None,
+    user: str = "anonymous",
+    encoding: Literal["raw", "base64"] = "raw",
+    tier: Literal["preview", "standard", "print"] = None,
+):
+    """
+    Uploads two images and queues their style transfer. Returns the job id
+    right away, the job is polled with GET /jobs/{job_id}. Answers 429 if
+    the queue is full. tier picks the quality tier.
+    """
+
+    inputs = await read_images(content_img, style_img, encoding)
+
+    job = submit_job(user, inputs, tier=tier, timeout=timeout)
+    return describe_job(job, images=False)
+
+
+@app.get("/jobs/{job_id}")
+def read_job(job_id: str, images: bool = True):
+    """
+    Returns the state of a job, its latest preview and, once it is done,
+    the result image as base64. images=false only returns the state and
+    the preview scale, the images are then fetched raw from
+    GET /jobs/{job_id}/preview and GET /jobs/{job_id}/result.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return describe_job(job, images=images)
+
+
+@app.get("/jobs/{job_id}/preview")
+def read_job_preview(job_id: str, response_format: Literal["jpeg", "webp"] = "jpeg"):
+    """
+    Returns the latest preview of a job as the raw response body, its scale
+    is in the X-Preview-Scale header. Answers 409 before the first preview.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    preview = job.preview
+    if preview is None:
+        raise HTTPException(status_code=409, detail="Job has no preview yet")
+    scale_index, num_scales, image = preview
+    response = image_response(image, response_format)
+    response.headers["X-Preview-Scale"] = f"{scale_index + 1}/{num_scales}"
+    return response
+
+
+@app.get("/jobs/{job_id}/result")
+def read_job_result(job_id: str, response_format: Literal["jpeg", "webp"] = "jpeg"):
+    """
+    Returns the result image of a finished job as the raw response body.
+    Answers 409 while the job is not done.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    if job.state != DONE:
+        raise HTTPException(status_code=409, detail=f"Job is {job.state}")
+    return image_response(job.result, response_format)
+
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    """
+    Cancels a waiting or running job.
+    """
+    job = job_queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job.describe()
@@ -0,0 +1,206 @@
+"""
+Micro-batching of concurrent style transfer requests
+"""
+import threading
+from concurrent.futures import Future
+from time import monotonic
+
+import numpy as np
+
+from style_ai.cancellation import CombinedToken, JobCancelled
+from style_ai.metrics import StageTimer
+from style_ai.style_transfer import strotss_batch
+
+
+class MicroBatcher:
+    """
+    Collects requests that arrive within a short window and runs them as
+    one batch. Requests are bucketed by a key, e.g. the resolution, and
+    only requests of the same bucket share a batch. The batches run one
+    after the other on a single thread, so the device is never shared
+    between two batches.
+
+    Parameters:
+        run_batch (callable): Callable that gets a list of requests and
+            returns one result per request, an exception as result fails
+            only its request.
+        max_batch (int): Maximum number of requests per batch.
+        max_wait (float): Seconds the oldest request waits for others.
+        key (callable): Callable that returns the bucket of a request.
+    """
+
+    def __init__(self, run_batch, max_batch: int = 4, max_wait: float = 0.05, key=None):
+        self.run_batch = run_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.key = key or (lambda item: None)
+        self.batches = 0
+        self.batched_items = 0
+        self._pending: list = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def start(self) -> None:
+        """
+        Starts the batching thread.
+        """
+        self._stopped = False
+        self._thread = threading.Thread(
+            target=self._loop, name="style-ai-batcher", daemon=True
+        )
+        self._thread.start()
+
+    def shutdown(self, timeout: float = None) -> None:
+        """
+        Runs the pending requests without waiting for more and stops.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, item) -> Future:
+        """
+        Adds a request to the next batch of its bucket.
+        :params:
+            item: request passed on to run_batch
+        :returns:
+            future of the result of the request
+        """
+        future: Future = Future()
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError("The batcher is shut down")
+            self._pending.append((monotonic(), self.key(item), item, future))
+            self._condition.notify_all()
+        return future
+
+    def stats(self) -> dict:
+        """
+        Returns the batch counters and the number of waiting requests.
+        """
+        with self._condition:
+            return {
+                "max_batch": self.max_batch,
+                "max_wait": self.max_wait,
+                "pending": len(self._pending),
+                "batches": self.batches,
+                "mean_batch_size": self.batched_items / self.batches
+                if self.batches
+                else None,
+            }
+
+    def _next_batch(self) -> list:
+        # the bucket of the oldest request runs once it is full or once the
+        # oldest request waited max_wait seconds
+        with self._condition:
+            while not self._pending and not self._stopped:
+                self._condition.wait()
+            if not self._pending:
+                return []
+            arrival, key = self._pending[0][0], self._pending[0][1]
+            while True:
+                bucket = [entry for entry in self._pending if entry[1] == key]
+                remaining = arrival + self.max_wait - monotonic()
+                if len(bucket) >= self.max_batch or remaining <= 0 or self._stopped:
+                    break
+                self._condition.wait(remaining)
+            batch = bucket[: self.max_batch]
+            batched = {id(entry) for entry in batch}
+            self._pending = [
+                entry for entry in self._pending if id(entry) not in batched
+            ]
+            self.batches += 1
+            self.batched_items += len(batch)
+            return batch
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            futures = [future for _, _, _, future in batch]
+            try:
+                results = self.run_batch([item for _, _, item, _ in batch])
+            except BaseException as error:  # pylint: disable=broad-except
+                for future in futures:
+                    future.set_exception(error)
+                continue
+            for future, result in zip(futures, results):
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+
+def run_transfer_batch(
+    items: list,
+    extractor=None,
+    device: str = "cuda:0",
+    weight: float = 1.5 * 16,
+    style_cache=None,
+    schedule=None,
+    tier=None,
+) -> list:
+    """
+    Runs requests with content images of the same size as one strotss
+    batch, they share every extractor forward and backward pass.
+    :params:
+        items: requests, dicts with the resized "content" and "style"
+            images and the optional "callback", "cancel_token", "timer" and
+            "resume_from" state, either every request or none has a state.
+            The "state" of every finished request is stored in its dict
+        extractor: feature extractor shared by all requests
+        device: device to run on
+        weight: weight of content loss
+        style_cache: optional cache for the style features
+        schedule: iteration schedule, defaults to the one of the tier
+        tier: quality tier shared by all requests, defaults to standard
+    :returns:
+        the stylized image of every request, or JobCancelled for a
+        request that was cancelled while its batch ran
+    """
+    tokens = [item.get("cancel_token") for item in items]
+
+    def batch_callback(scale_index, num_scales, images):
+        for item, image in zip(items, images):
+            if item.get("callback") is not None:
+                item["callback"](scale_index, num_scales, image)
+
+    resume_from = None
+    if items[0].get("resume_from") is not None:
+        resume_from = np.concatenate([item["resume_from"] for item in items])
+
+    timer = StageTimer()
+    try:
+        images, info = strotss_batch(
+            [item["content"] for item in items],
+            [item["style"] for item in items],
+            content_weight=weight,
+            extractor=extractor,
+            device=device,
+            schedule=schedule,
+            style_cache=style_cache,
+            callback=batch_callback,
+            cancel_token=CombinedToken(tokens),
+            timer=timer,
+            tier=tier,
+            resume_from=resume_from,
+        )
+    except JobCancelled as error:
+        return [error] * len(items)
+
+    for index, item in enumerate(items):
+        item["state"] = info["state"][index : index + 1]
+        if item.get("timer") is not None:
+            item["timer"].stages.extend(timer.stages)
+            for name, amount in timer.counters.items():
+                item["timer"].add(name, amount)
+            item["timer"].add("batch_size", len(items))
+    return [
+        JobCancelled(token.reason) if token is not None and token.cancelled else image
+        for token, image in zip(tokens, images)
+    ]
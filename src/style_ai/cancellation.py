@@ -0,0 +1,93 @@
+"""
+Cancellation and deadlines for running style transfer jobs
+"""
+import threading
+from time import monotonic
+
+DEADLINE_EXCEEDED = "deadline exceeded"
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a style transfer when its job was cancelled or ran past
+    its deadline.
+    """
+
+    def __init__(self, reason: str) -> None:
+        super().__init__(f"Style transfer stopped: {reason}")
+        self.reason = reason
+
+
+class CancellationToken:
+    """
+    Token that is checked by the optimization between iterations.
+
+    Parameters:
+        timeout (float): Seconds until the job runs past its deadline,
+            None for no deadline.
+    """
+
+    def __init__(self, timeout: float = None) -> None:
+        self.deadline = None if timeout is None else monotonic() + timeout
+        self.reason = None
+        self._event = threading.Event()
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        """
+        Cancels the job, the first reason given is kept.
+        """
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        """
+        Returns True if the job was cancelled or ran past its deadline.
+        """
+        if self.deadline is not None and monotonic() > self.deadline:
+            self.cancel(DEADLINE_EXCEEDED)
+        return self._event.is_set()
+
+    def raise_if_cancelled(self) -> None:
+        """
+        Raises JobCancelled if the job was cancelled or ran past its deadline.
+        """
+        if self.cancelled:
+            raise JobCancelled(self.reason)
+
+
+class CombinedToken:
+    """
+    Token of a batch that runs several jobs at once. The batch only stops
+    once every job in it is cancelled, a single cancelled job is dropped
+    from the results instead.
+
+    Parameters:
+        tokens (list): CancellationToken of every job, None for a job that
+            cannot be cancelled.
+    """
+
+    def __init__(self, tokens: list) -> None:
+        self.tokens = list(tokens)
+
+    @property
+    def cancelled(self) -> bool:
+        """
+        Returns True if every job of the batch was cancelled.
+        """
+        return all(token is not None and token.cancelled for token in self.tokens)
+
+    @property
+    def reason(self) -> str:
+        """
+        Returns the reason of the first job.
+        """
+        return self.tokens[0].reason if self.tokens and self.tokens[0] else None
+
+    def raise_if_cancelled(self) -> None:
+        """
+        Raises JobCancelled if every job of the batch was cancelled.
+        """
+        if self.cancelled:
+            raise JobCancelled(self.reason)
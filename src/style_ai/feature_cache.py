@@ -0,0 +1,118 @@
+"""
+Content-addressed cache for the sampled features of style images
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+
+class StyleFeatureCache:
+    """
+    Two tier cache for style features. The first tier is an in-memory LRU
+    bounded by bytes, the optional second tier stores every entry as a
+    .npy file that is memory-mapped when it is read again.
+
+    Parameters:
+        max_bytes (int): Size limit of the in-memory tier.
+        directory (str): Directory of the on-disk tier, None disables it.
+        seed (int): Seed used to sample the style features of cached entries.
+    """
+
+    def __init__(self, max_bytes: int = 512 * 2**20, directory=None, seed=0):
+        self.max_bytes = max_bytes
+        self.directory = Path(directory) if directory else None
+        self.seed = seed
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """
+        Builds a cache key from its parts, e.g. the kind of the entry, the
+        image hash, the scale, the color space and the sample seed.
+        """
+        return hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()
+
+    def get(self, key: str):
+        """
+        Returns the cached array for a key or None. Hits on the disk tier are
+        promoted to the memory tier.
+        :params:
+            key: cache key
+        :returns:
+            numpy array or None
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        path = self._path(key)
+        if path is not None and path.exists():
+            array = np.load(path, mmap_mode="r")
+            with self._lock:
+                self.disk_hits += 1
+                self._insert(key, array)
+            return array
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, array: np.ndarray) -> None:
+        """
+        Stores an array in the memory tier and, if enabled, on disk.
+        :params:
+            key: cache key
+            array: numpy array to store
+        """
+        path = self._path(key)
+        if path is not None and not path.exists():
+            tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp_path, "wb") as file:
+                np.save(file, array)
+            os.replace(tmp_path, path)
+
+        with self._lock:
+            self._insert(key, array)
+
+    def stats(self) -> dict:
+        """
+        Returns the hit and miss counters and the size of the memory tier.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def _path(self, key: str):
+        if self.directory is None:
+            return None
+        return self.directory / f"{key}.npy"
+
+    def _insert(self, key: str, array: np.ndarray) -> None:
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key).nbytes
+        if array.nbytes > self.max_bytes:
+            return
+        self._entries[key] = array
+        self._bytes += array.nbytes
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes
@@ -0,0 +1,413 @@
+"""
+Job queue with a worker pool for the style transfer API
+"""
+import logging
+import threading
+import uuid
+from collections import OrderedDict, deque
+from time import monotonic
+
+from style_ai.cancellation import CancellationToken, JobCancelled
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """
+    Raised when a job is submitted while the queue is at its limit or
+    while it is draining.
+    """
+
+
+class OverBudget(Exception):
+    """
+    Raised when a job needs more memory than the whole budget of the queue.
+    """
+
+
+class Job:
+    """
+    One style transfer job and its state.
+
+    Parameters:
+        user (str): Owner of the job, jobs are dealt out fairly per user.
+        inputs (dict): Keyword arguments for the runner, released once the
+            job is finished.
+        listener (callable): Optional callable that gets the job and the
+            event name on every preview and when the job is finished.
+        timeout (float): Optional deadline in seconds from submission.
+        cost (int): Estimated memory of the job in bytes.
+    """
+
+    def __init__(
+        self, user: str, inputs: dict, listener=None, timeout=None, cost: int = 0
+    ):
+        self.id = uuid.uuid4().hex
+        self.user = user
+        self.inputs = inputs
+        self.cost = cost
+        self.listener = listener
+        self.token = CancellationToken(timeout=timeout)
+        self.state = QUEUED
+        self.result = None
+        self.error = None
+        self.preview = None
+        self.submitted = monotonic()
+        self.started = None
+        self.finished = None
+        self._done = threading.Event()
+
+    def publish_preview(self, scale_index: int, num_scales: int, image) -> None:
+        """
+        Stores the intermediate image of a scale, used as the callback of
+        style_transfer().
+        """
+        self.preview = (scale_index, num_scales, image)
+        self._notify("preview")
+
+    def wait(self, timeout: float = None):
+        """
+        Blocks until the job is finished and returns its result.
+        :params:
+            timeout: seconds to wait, None waits forever
+        :returns:
+            result of the runner, None if the job is still unfinished after
+            the timeout. Raises the error of a failed or cancelled job
+        """
+        self._done.wait(timeout)
+        if self.state == CANCELLED:
+            raise JobCancelled(self.token.reason)
+        if self.state == FAILED:
+            raise self.error
+        return self.result
+
+    def describe(self) -> dict:
+        """
+        Returns the state of the job without the result.
+        """
+        now = monotonic()
+        return {
+            "job_id": self.id,
+            "user": self.user,
+            "state": self.state,
+            "error": None if self.error is None else str(self.error),
+            "queued_for": (self.started or self.finished or now) - self.submitted,
+            "run_for": None
+            if self.started is None
+            else (self.finished or now) - self.started,
+        }
+
+    def finish(self, state: str, result=None, error=None) -> None:
+        """
+        Moves the job to a finished state and wakes up everyone waiting.
+        :params:
+            state: DONE, FAILED or CANCELLED
+            result: result of the runner
+            error: exception of a failed job
+        """
+        self.state = state
+        self.result = result
+        self.error = error
+        self.finished = monotonic()
+        self.inputs = None
+        self._done.set()
+        self._notify(state)
+
+    def _notify(self, event: str) -> None:
+        if self.listener is not None:
+            self.listener(self, event)
+
+
+class JobQueue:
+    """
+    Bounded job queue served by a pool of worker threads. The workers share
+    the process, so they share the loaded model and the caches, torch
+    releases the GIL during the heavy lifting.
+
+    Jobs are dealt out round robin across users, every user's jobs run in
+    FIFO order, so one user with many jobs does not starve the others.
+
+    With a memory budget a job only starts once the estimated memory of the
+    running jobs and its own fits into the budget, the next job in line
+    waits for that, so a large job is not starved by small ones.
+
+    Parameters:
+        runner (callable): Callable that gets a Job and returns its result.
+        workers (int): Number of jobs that run concurrently.
+        max_queued (int): Number of waiting jobs before submit() raises
+            QueueFull.
+        keep_finished (float): Seconds finished jobs are kept for polling.
+        memory_budget (int): Bytes the running jobs may use together, None
+            disables the admission control.
+        on_finish (callable): Optional callable that gets every job and its
+            inputs once the job reached its final state, also the jobs that
+            were cancelled or expired before they ran.
+    """
+
+    def __init__(
+        self,
+        runner,
+        workers: int = 1,
+        max_queued: int = 16,
+        keep_finished: float = 600.0,
+        memory_budget: int = None,
+        on_finish=None,
+    ) -> None:
+        self.runner = runner
+        self.workers = workers
+        self.max_queued = max_queued
+        self.keep_finished = keep_finished
+        self.memory_budget = memory_budget
+        self.on_finish = on_finish
+        self._reserved = 0
+        self._jobs: dict = {}
+        self._waiting: OrderedDict = OrderedDict()
+        self._queued = 0
+        self._running = 0
+        self._condition = threading.Condition()
+        self._threads: list = []
+        self._stopped = False
+        self._draining = False
+
+    def start(self) -> None:
+        """
+        Starts the worker threads.
+        """
+        self._stopped = False
+        self._draining = False
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name=f"style-ai-worker-{index}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def shutdown(self, timeout: float = None) -> None:
+        """
+        Stops the workers once the running jobs are finished, waiting jobs
+        are cancelled.
+        :params:
+            timeout: seconds to wait for every worker, None waits forever
+        """
+        with self._condition:
+            self._stopped = True
+            cancelled = [job for jobs in self._waiting.values() for job in jobs]
+            self._waiting.clear()
+            self._queued = 0
+            self._condition.notify_all()
+        for job in cancelled:
+            job.token.cancel("shutdown")
+            self._finish(job, CANCELLED)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def drain(self, timeout: float = None) -> bool:
+        """
+        Stops accepting jobs and waits until the queued and running jobs are
+        finished, then stops the workers. Jobs still unfinished after the
+        timeout are cancelled.
+        :params:
+            timeout: seconds to wait for the jobs, None waits forever
+        :returns:
+            True if every job finished in time
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._condition:
+            self._draining = True
+            while self._queued or self._running:
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            drained = not self._queued and not self._running
+            unfinished = [
+                job for job in self._jobs.values() if job.state not in FINISHED_STATES
+            ]
+        for job in unfinished:
+            self.cancel(job.id, "shutdown")
+        self.shutdown(timeout=timeout)
+        return drained
+
+    def submit(
+        self, user: str, inputs: dict, listener=None, timeout=None, cost: int = 0
+    ) -> Job:
+        """
+        Adds a job to the queue.
+        :params:
+            user: owner of the job
+            inputs: keyword arguments for the runner
+            listener: optional callable for the preview and finish events
+            timeout: optional deadline of the job in seconds
+            cost: estimated memory of the job in bytes
+        :returns:
+            the queued job, raises QueueFull if the queue is at its limit or
+            draining and OverBudget if the job can never fit the budget
+        """
+        if self.memory_budget is not None and cost > self.memory_budget:
+            raise OverBudget(
+                f"Job needs about {cost} bytes, the budget is {self.memory_budget}"
+            )
+        job = Job(user, inputs, listener=listener, timeout=timeout, cost=cost)
+        with self._condition:
+            self._prune()
+            if self._draining:
+                raise QueueFull("Queue is draining for a shutdown")
+            if self._queued >= self.max_queued:
+                raise QueueFull(f"Queue is full with {self._queued} waiting jobs")
+            self._jobs[job.id] = job
+            self._waiting.setdefault(user, deque()).append(job)
+            self._queued += 1
+            self._condition.notify()
+        return job
+
+    def get(self, job_id: str):
+        """
+        Returns the job with the id or None.
+        """
+        with self._condition:
+            self._prune()
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str, reason: str = "cancelled by client"):
+        """
+        Cancels a job. A waiting job is removed from the queue, a running
+        job stops at its next iteration.
+        :params:
+            job_id: id of the job
+            reason: reason reported by the cancelled job
+        :returns:
+            the job or None if the id is unknown
+        """
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None or job.state in FINISHED_STATES:
+                return job
+            job.token.cancel(reason)
+            if job.state != QUEUED:
+                return job
+            jobs = self._waiting[job.user]
+            jobs.remove(job)
+            if not jobs:
+                del self._waiting[job.user]
+            self._queued -= 1
+            # a cancelled job is not handed out again, so it can be finished
+            # outside of the lock
+            job.state = CANCELLED
+            self._condition.notify_all()
+        self._finish(job, CANCELLED)
+        return job
+
+    def position(self, job: Job) -> int:
+        """
+        Returns the number of jobs that run before a waiting job, 0 once it
+        is running or finished.
+        """
+        with self._condition:
+            if job.state != QUEUED:
+                return 0
+            # replay the round robin of the workers
+            queues = [list(jobs) for jobs in self._waiting.values()]
+            position = 0
+            while queues:
+                for jobs in list(queues):
+                    if jobs.pop(0) is job:
+                        return position
+                    position += 1
+                    if not jobs:
+                        queues.remove(jobs)
+            return position
+
+    def stats(self) -> dict:
+        """
+        Returns the queue depth and the worker usage.
+        """
+        with self._condition:
+            self._prune()
+            return {
+                "workers": self.workers,
+                "running": self._running,
+                "queued": self._queued,
+                "max_queued": self.max_queued,
+                "users_waiting": len(self._waiting),
+                "memory_budget": self.memory_budget,
+                "memory_reserved": self._reserved,
+            }
+
+    def _can_start(self) -> bool:
+        if not self._waiting:
+            return False
+        if self.memory_budget is None:
+            return True
+        job = next(iter(self._waiting.values()))[0]
+        return self._reserved + job.cost <= self.memory_budget
+
+    def _next_job(self):
+        # the first user in line gets one job and moves to the end
+        user, jobs = next(iter(self._waiting.items()))
+        job = jobs.popleft()
+        if jobs:
+            self._waiting.move_to_end(user)
+        else:
+            del self._waiting[user]
+        self._queued -= 1
+        return job
+
+    def _finish(self, job: Job, state: str, result=None, error=None) -> None:
+        inputs = job.inputs
+        job.finish(state, result=result, error=error)
+        if self.on_finish is None:
+            return
+        try:
+            self.on_finish(job, inputs)
+        except Exception:  # pylint: disable=broad-except
+            # a failing hook must not take down the worker
+            logger.exception("on_finish failed for job %s", job.id)
+
+    def _prune(self) -> None:
+        now = monotonic()
+        expired = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.finished is not None and now - job.finished > self.keep_finished
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                while not self._can_start() and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                job = self._next_job()
+                job.state = RUNNING
+                job.started = monotonic()
+                self._running += 1
+                self._reserved += job.cost
+
+            try:
+                job.token.raise_if_cancelled()
+                result = self.runner(job)
+            except JobCancelled:
+                self._finish(job, CANCELLED)
+            except Exception as error:  # pylint: disable=broad-except
+                self._finish(job, FAILED, error=error)
+            else:
+                self._finish(job, DONE, result=result)
+            finally:
+                with self._condition:
+                    self._running -= 1
+                    self._reserved -= job.cost
+                    # finished jobs are also dropped while nobody submits
+                    self._prune()
+                    # the freed memory may let a waiting job start
+                    self._condition.notify_all()
@@ -0,0 +1,219 @@
+"""
+Metrics in the Prometheus text format and per-job stage timing
+"""
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def format_labels(labelnames: tuple, values: tuple) -> str:
+    """
+    Formats label names and values as {name="value",...}.
+    """
+    if not labelnames:
+        return ""
+    pairs = ",".join(
+        f'{name}="{str(value)}"' for name, value in zip(labelnames, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Metric:
+    """
+    Base of the metric types, keeps one value per label combination.
+
+    Parameters:
+        name (str): Metric name.
+        documentation (str): Help text of the metric.
+        labelnames (tuple): Names of the labels.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self) -> list:
+        """
+        Returns the lines of the metric in the Prometheus text format.
+        """
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            lines.append(
+                f"{self.name}{format_labels(self.labelnames, key)} {float(value)}"
+            )
+        return lines
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing value.
+    """
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        """
+        Increases the counter of a label combination.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    """
+    Value that can go up and down. A gauge with a function reads its value
+    when the metrics are rendered.
+
+    Parameters:
+        function (callable): Optional callable that returns the value.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value: float, **labels) -> None:
+        """
+        Sets the gauge of a label combination.
+        """
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self) -> list:
+        if self.function is not None:
+            self.set(self.function())
+        return super().render()
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values in cumulative buckets.
+
+    Parameters:
+        buckets (tuple): Upper bounds of the buckets, +Inf is added.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels) -> None:
+        """
+        Adds an observation to the histogram of a label combination.
+        """
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self) -> list:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        with self._lock:
+            values = [
+                (key, (list(counts), total))
+                for key, (counts, total) in self._values.items()
+            ]
+        for key, (counts, total) in values:
+            for bound, count in zip(self.buckets, counts):
+                labels = format_labels(
+                    self.labelnames + ("le",),
+                    key + ("+Inf" if bound == float("inf") else bound,),
+                )
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Collection of metrics that are rendered together for /metrics.
+    """
+
+    def __init__(self) -> None:
+        self.metrics: list = []
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Adds a metric and returns it.
+        """
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Returns all metrics in the Prometheus text format.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class StageTimer:
+    """
+    Collects the wall-clock seconds of the stages of one job and counters
+    like the number of iterations, used for the per-job timing record.
+    """
+
+    def __init__(self) -> None:
+        self.stages: list = []
+        self.counters: dict = {}
+
+    @contextmanager
+    def stage(self, name: str, **labels):
+        """
+        Times the block as a stage, labels like the scale are kept with it.
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((name, labels, perf_counter() - start))
+
+    def add(self, name: str, amount: float) -> None:
+        """
+        Adds to a counter of the job.
+        """
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record(self) -> dict:
+        """
+        Returns the stages and counters as a JSON serialisable dict.
+        """
+        return {
+            "stages": [
+                {"stage": name, **labels, "seconds": round(seconds, 6)}
+                for name, labels, seconds in self.stages
+            ],
+            **self.counters,
+        }
@@ -0,0 +1,140 @@
+"""
+Process wide registry of the loaded style transfer model
+"""
+import os
+import threading
+from time import perf_counter
+
+import torch
+
+from style_ai.style_transfer import Vgg16Extractor, pyramid_scales
+
+
+def default_device() -> str:
+    """
+    Returns the device from STYLE_AI_DEVICE, else the first GPU if there is
+    one, else the CPU.
+    """
+    device = os.environ.get("STYLE_AI_DEVICE")
+    if device:
+        return device
+    return "cuda:0" if torch.cuda.is_available() else "cpu"
+
+
+class ModelRegistry:
+    """
+    Loads the Vgg16Extractor once per process and shares it between all
+    requests. The extractor holds no per-request state, so concurrent jobs
+    can use it at the same time.
+
+    Parameters:
+        space (str): Color space of the extractor.
+        device (str): Device of the extractor, None picks default_device().
+        precision (str): Precision mode of the extractor.
+        channels_last (bool): Run the extractor in channels_last format.
+    """
+
+    def __init__(
+        self,
+        space: str = "uniform",
+        device: str = None,
+        precision: str = "float32",
+        channels_last: bool = False,
+    ) -> None:
+        self.space = space
+        self.device = device or default_device()
+        self.precision = precision
+        self.channels_last = channels_last
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self._extractor = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ModelRegistry":
+        """
+        Returns a registry configured by STYLE_AI_DEVICE, STYLE_AI_PRECISION
+        and STYLE_AI_CHANNELS_LAST.
+        """
+        return cls(
+            precision=os.environ.get("STYLE_AI_PRECISION", "float32"),
+            channels_last=os.environ.get("STYLE_AI_CHANNELS_LAST") == "1",
+        )
+
+    @property
+    def extractor(self) -> Vgg16Extractor:
+        """
+        Returns the shared extractor, loading it on first use.
+        """
+        if self._extractor is None:
+            self.load()
+        return self._extractor
+
+    def load(self, warmup_size: int = None) -> Vgg16Extractor:
+        """
+        Loads the extractor onto the device and optionally warms it up with
+        a dummy forward pass at every scale of a warmup_size image.
+        :params:
+            warmup_size: long edge of the requests, None skips the warmup
+        :returns:
+            the loaded extractor
+        """
+        with self._lock:
+            if self._extractor is None:
+                start = perf_counter()
+                extractor = Vgg16Extractor(
+                    space=self.space,
+                    precision=self.precision,
+                    channels_last=self.channels_last,
+                ).to(self.device)
+                extractor.eval()
+                self.load_seconds = perf_counter() - start
+                self._extractor = extractor
+
+            if warmup_size is not None and self.warmup_seconds is None:
+                start = perf_counter()
+                self._warmup(warmup_size)
+                self.warmup_seconds = perf_counter() - start
+        return self._extractor
+
+    def stats(self) -> dict:
+        """
+        Returns the settings of the model and the time spent loading and
+        warming it up.
+        """
+        return {
+            "loaded": self._extractor is not None,
+            "device": self.device,
+            "precision": self.precision,
+            "channels_last": self.channels_last,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+        }
+
+    def memory_bytes(self) -> int:
+        """
+        Returns the bytes held by the parameters and buffers of the
+        extractor, 0 before it is loaded.
+        """
+        if self._extractor is None:
+            return 0
+        tensors = list(self._extractor.parameters()) + list(self._extractor.buffers())
+        return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+    def device_memory_bytes(self) -> int:
+        """
+        Returns the memory allocated by torch on a GPU device, 0 on the CPU.
+        """
+        if not self.device.startswith("cuda") or not torch.cuda.is_available():
+            return 0
+        return torch.cuda.memory_allocated(self.device)
+
+    def _warmup(self, size: int) -> None:
+        # the first pass at every resolution pays for kernel selection and
+        # allocator growth, so it is done before the first request
+        with torch.no_grad():
+            for scale in pyramid_scales(size, size):
+                tensor = torch.zeros(1, 3, size // scale, size // scale)
+                self._extractor(tensor.to(self.device))
+        if self.device.startswith("cuda"):
+            torch.cuda.synchronize(self.device)
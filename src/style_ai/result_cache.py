@@ -0,0 +1,129 @@
+"""
+Cache for the results of identical style transfer requests
+"""
+import threading
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import numpy as np
+from PIL import Image
+
+from style_ai.cancellation import JobCancelled
+from style_ai.feature_cache import StyleFeatureCache
+from style_ai.utils import pil_hash
+
+
+class ResultCache:
+    """
+    Result images keyed by the hash of both input images and the transfer
+    parameters. The images are stored as arrays in a StyleFeatureCache, so
+    they get the same byte bounded LRU and optional disk tier.
+
+    Identical requests that arrive while the first one is still running
+    wait for it instead of starting their own run (single-flight). Next to
+    the images it keeps optimization states that later runs resume from.
+
+    Parameters:
+        max_bytes (int): Size limit of the in-memory tier.
+        directory (str): Directory of the on-disk tier, None disables it.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 2**20, directory=None) -> None:
+        self.store = StyleFeatureCache(max_bytes=max_bytes, directory=directory)
+        self.shared = 0
+        self._in_flight: dict = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(content: Image.Image, style: Image.Image, **params) -> str:
+        """
+        Builds the key of a request from the pixels of both images and the
+        parameters that change the result, e.g. resize_to, weight and space.
+        """
+        parts = [f"{name}={params[name]}" for name in sorted(params)]
+        return StyleFeatureCache.make_key(
+            "result", pil_hash(content), pil_hash(style), *parts
+        )
+
+    def get_or_compute(self, key: str, compute, cancel_token=None) -> Image.Image:
+        """
+        Returns the cached result of a key, waits for an identical run in
+        flight, or computes and stores the result.
+        :params:
+            key: key from make_key()
+            compute: callable that runs the style transfer
+            cancel_token: optional CancellationToken of the waiting job
+        :returns:
+            result image
+        """
+        while True:
+            cached = self.store.get(key)
+            if cached is not None:
+                return Image.fromarray(np.array(cached))
+
+            with self._lock:
+                future = self._in_flight.get(key)
+                owner = future is None
+                if owner:
+                    future = Future()
+                    self._in_flight[key] = future
+
+            if owner:
+                return self._compute(key, future, compute)
+
+            with self._lock:
+                self.shared += 1
+            try:
+                return self._wait(future, cancel_token)
+            except JobCancelled:
+                # the run we waited for was cancelled, not this job, so
+                # try again and possibly become the owner
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+
+    def get_state(self, key: str):
+        """
+        Returns the stored optimization state of a key or None, the state
+        lets a larger render resume from an earlier one, see strotss().
+        """
+        return self.store.get(key)
+
+    def put_state(self, key: str, state: np.ndarray) -> None:
+        """
+        Stores the optimization state ("state" of the run info) of a key.
+        """
+        self.store.put(key, np.asarray(state))
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of the store and the shared runs.
+        """
+        stats = self.store.stats()
+        with self._lock:
+            stats["shared"] = self.shared
+            stats["in_flight"] = len(self._in_flight)
+        return stats
+
+    def _compute(self, key: str, future: Future, compute) -> Image.Image:
+        try:
+            image = compute()
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            self.store.put(key, np.asarray(image))
+            future.set_result(image)
+            return image
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    @staticmethod
+    def _wait(future: Future, cancel_token) -> Image.Image:
+        while True:
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            try:
+                return future.result(timeout=0.5)
+            except FutureTimeout:
+                continue
@@ -3,41 +3,98 @@ Runpod entry point for the Style AI example.
 """
 import base64
 import io
+import os
 
 import runpod
 from PIL import Image
 
-from style_ai.style_transfer import Vgg16Extractor, style_transfer
+from style_ai.cancellation import CancellationToken, JobCancelled
+from style_ai.feature_cache import StyleFeatureCache
+from style_ai.registry import default_device
+from style_ai.style_transfer import Vgg16Extractor, style_transfer_batch
 
-extractor = Vgg16Extractor(space="uniform")
+device = default_device()
+extractor = Vgg16Extractor(
+    space="uniform",
+    precision=os.environ.get("STYLE_AI_PRECISION", "float32"),
+    channels_last=os.environ.get("STYLE_AI_CHANNELS_LAST") == "1",
+)
+style_cache = StyleFeatureCache(directory=os.environ.get("STYLE_AI_FEATURE_CACHE_DIR"))
 
 
-def process_image(job):
+def decode_image(data: str) -> Image.Image:
     """
-    Processes the image and returns the result.
+    Decodes a base64 encoded image of a job.
     """
-    content_img_raw = job["input"]["content_img"]
-    style_img_raw = job["input"]["style_img"]
-    resize_to = job["input"]["resize_to"]
-
-    content_img = Image.open(io.BytesIO(base64.b64decode(content_img_raw)))
-    style_img = Image.open(io.BytesIO(base64.b64decode(style_img_raw)))
+    image = Image.open(io.BytesIO(base64.b64decode(data)))
+    image.load()
+    return image
 
-    result = style_transfer(
-        content_img, style_img, extractor=extractor, resize_to=resize_to
-    )
 
-    # Convert the resulting image to base64 string
+def encode_image(image: Image.Image) -> str:
+    """
+    Converts an image to a base64 encoded JPEG.
+    """
     result_bytes = io.BytesIO()
-    result.save(result_bytes, format="JPEG")
-    result_bytes.seek(0)
-    result_base64 = base64.b64encode(result_bytes.getvalue()).decode("utf-8")
+    image.save(result_bytes, format="JPEG")
+    return base64.b64encode(result_bytes.getvalue()).decode("utf-8")
+
+
+def read_pairs(job_input: dict) -> list:
+    """
+    Returns the decoded content and style image of every pair of a job. A
+    job holds a list of {"content_img", "style_img"} dicts in "pairs", or a
+    single pair in "content_img" and "style_img".
+    """
+    pairs = job_input.get("pairs") or [job_input]
+    return [
+        (decode_image(pair["content_img"]), decode_image(pair["style_img"]))
+        for pair in pairs
+    ]
+
 
-    # Return the result image
+def job_output(job_input: dict, results: list) -> dict:
+    """
+    Returns the output of a job, a job with a list of pairs gets a list of
+    result images in the same order.
+    """
+    if "pairs" not in job_input:
+        return {
+            "message": "Images transferred successfully!",
+            "result_image": encode_image(results[0]),
+        }
     return {
         "message": "Images transferred successfully!",
-        "result_image": result_base64,
+        "result_images": [encode_image(result) for result in results],
     }
 
 
-runpod.serverless.start({"handler": process_image})
+def process_image(job):
+    """
+    Processes the image pairs of a job and returns the results. The pairs
+    of a job with the same resized resolution run as one strotss batch.
+    The optional "timeout" input in seconds stops the job once it runs past
+    its deadline.
+    """
+    job_input = job["input"]
+    token = CancellationToken(timeout=job_input.get("timeout"))
+    contents, styles = zip(*read_pairs(job_input))
+
+    try:
+        results = style_transfer_batch(
+            list(contents),
+            list(styles),
+            extractor=extractor,
+            device=device,
+            resize_to=job_input["resize_to"],
+            style_cache=style_cache,
+            cancel_token=token,
+        )
+    except JobCancelled as error:
+        return {"error": str(error)}
+
+    return job_output(job_input, results)
+
+
+if __name__ == "__main__":
+    runpod.serverless.start({"handler": process_image})
@@ -0,0 +1,272 @@
+"""
+Local stand-in for a RunPod serverless endpoint, used for offline load tests
+of the webshop. It serves the /run, /runsync, /status, /cancel and /health
+routes of the RunPod API for any endpoint id and runs the jobs with
+runpod_entry.process_image on a pool of simulated workers.
+
+The webshop is pointed at it with runpod.url = "http://localhost:8001/v2"
+in its toml.
+"""
+import threading
+from argparse import ArgumentParser
+from contextlib import asynccontextmanager
+from time import monotonic, sleep
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from style_ai.jobs import (
+    CANCELLED,
+    DONE,
+    FAILED,
+    FINISHED_STATES,
+    QUEUED,
+    Job,
+    JobQueue,
+    QueueFull,
+)
+
+RUNPOD_STATES = {
+    QUEUED: "IN_QUEUE",
+    DONE: "COMPLETED",
+    FAILED: "FAILED",
+    CANCELLED: "CANCELLED",
+}
+
+
+class HandlerError(Exception):
+    """
+    Raised when the handler returns an output with an "error", RunPod
+    reports such a job as failed.
+    """
+
+
+class LocalEndpoint:
+    """
+    Queue of RunPod jobs served in FIFO order by simulated workers. A worker
+    is cold when it starts and after it was idle for idle_timeout seconds,
+    its next job first waits cold_start seconds, like a RunPod worker that
+    boots its container and loads the model. The jobs wait IN_QUEUE until
+    their worker is warm.
+
+    Parameters:
+        handler (callable): Callable that gets the RunPod job dict and
+            returns its output, defaults to runpod_entry.process_image.
+        workers (int): Number of simulated workers.
+        cold_start (float): Seconds a cold worker needs before its job.
+        idle_timeout (float): Seconds after which an idle worker is cold.
+        max_queued (int): Number of waiting jobs before /run answers 429.
+    """
+
+    def __init__(
+        self,
+        handler=None,
+        workers: int = 1,
+        cold_start: float = 0.0,
+        idle_timeout: float = 5.0,
+        max_queued: int = 1000,
+    ) -> None:
+        self.handler = handler
+        self.cold_start = cold_start
+        self.idle_timeout = idle_timeout
+        self.cold_starts = 0
+        self.queue = JobQueue(
+            self._run, workers=workers, max_queued=max_queued, keep_finished=1800.0
+        )
+        self._handler_started: dict = {}
+        self._last_active: dict = {}
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """
+        Starts the simulated workers.
+        """
+        if self.handler is None:
+            # loads the model, like the container of a RunPod worker
+            from style_ai.runpod_entry import process_image
+
+            self.handler = process_image
+        self.queue.start()
+
+    def shutdown(self) -> None:
+        """
+        Stops the workers once their jobs are finished.
+        """
+        self.queue.shutdown()
+
+    def submit(self, job_input: dict, timeout: float = None) -> Job:
+        """
+        Queues a job with the input of a /run request.
+        """
+        return self.queue.submit("runpod", {"input": job_input}, timeout=timeout)
+
+    def status(self, job: Job) -> dict:
+        """
+        Returns the body of /status in the RunPod format, the times are in
+        milliseconds like RunPod reports them.
+        """
+        with self._lock:
+            handler_started = self._handler_started.get(job.id)
+        body = {"id": job.id, "status": RUNPOD_STATES.get(job.state, "IN_PROGRESS")}
+        if handler_started is None:
+            if job.state not in FINISHED_STATES:
+                # the worker is still booting
+                body["status"] = "IN_QUEUE"
+            return body
+        body["delayTime"] = int((handler_started - job.submitted) * 1000)
+        if job.finished is not None:
+            body["executionTime"] = int((job.finished - handler_started) * 1000)
+        if job.state == DONE:
+            body["output"] = job.result
+        elif job.state == FAILED:
+            body["error"] = str(job.error)
+        return body
+
+    def health(self) -> dict:
+        """
+        Returns the body of /health in the RunPod format.
+        """
+        stats = self.queue.stats()
+        return {
+            "jobs": {"inQueue": stats["queued"], "inProgress": stats["running"]},
+            "workers": {
+                "running": stats["running"],
+                "idle": stats["workers"] - stats["running"],
+                "coldStarts": self.cold_starts,
+            },
+        }
+
+    def _run(self, job: Job):
+        worker = threading.get_ident()
+        last_active = self._last_active.get(worker)
+        if last_active is None or monotonic() - last_active > self.idle_timeout:
+            with self._lock:
+                self.cold_starts += 1
+            sleep(self.cold_start)
+        with self._lock:
+            self._handler_started[job.id] = monotonic()
+        try:
+            output = self.handler({"id": job.id, "input": job.inputs["input"]})
+        finally:
+            self._last_active[worker] = monotonic()
+        if isinstance(output, dict) and "error" in output:
+            raise HandlerError(output["error"])
+        return output
+
+
+class RunRequest(BaseModel):
+    """
+    Body of /run and /runsync.
+    """
+
+    input: dict
+
+
+endpoint = LocalEndpoint()
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """
+    Loads the handler and starts the workers.
+    """
+    await run_in_threadpool(endpoint.start)
+    yield
+    endpoint.shutdown()
+
+
+app = FastAPI(title="Local RunPod endpoint", lifespan=lifespan)
+
+
+@app.exception_handler(HTTPException)
+async def runpod_error(_request: Request, error: HTTPException) -> JSONResponse:
+    """
+    Answers errors with the {"error": ...} body of the RunPod API, which
+    the runpod client raises as a RuntimeError.
+    """
+    return JSONResponse(status_code=error.status_code, content={"error": error.detail})
+
+
+def get_job(job_id: str) -> Job:
+    """
+    Returns a job or answers 404.
+    """
+    job = endpoint.queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+def submit(request: RunRequest) -> Job:
+    """
+    Queues a job, answers 429 if the queue is full.
+    """
+    try:
+        return endpoint.submit(request.input)
+    except QueueFull as error:
+        raise HTTPException(status_code=429, detail=str(error)) from error
+
+
+@app.post("/v2/{endpoint_id}/run")
+def run(endpoint_id: str, request: RunRequest):
+    """
+    Queues a job and returns its id.
+    """
+    job = submit(request)
+    return {"id": job.id, "status": "IN_QUEUE"}
+
+
+@app.post("/v2/{endpoint_id}/runsync")
+async def run_sync(endpoint_id: str, request: RunRequest, wait: float = 50.0):
+    """
+    Queues a job and waits up to wait seconds for it, an unfinished job is
+    returned with its status like RunPod does.
+    """
+    job = submit(request)
+    try:
+        await run_in_threadpool(job.wait, wait)
+    except Exception:  # pylint: disable=broad-except
+        # failed and cancelled jobs are reported through their status
+        pass
+    return endpoint.status(job)
+
+
+@app.get("/v2/{endpoint_id}/status/{job_id}")
+def read_status(endpoint_id: str, job_id: str):
+    """
+    Returns the status and, once it is completed, the output of a job.
+    """
+    return endpoint.status(get_job(job_id))
+
+
+@app.post("/v2/{endpoint_id}/cancel/{job_id}")
+def cancel(endpoint_id: str, job_id: str):
+    """
+    Cancels a job, a running job finishes its handler call first.
+    """
+    job = endpoint.queue.cancel(get_job(job_id).id, "cancelled by client")
+    return endpoint.status(job)
+
+
+@app.get("/v2/{endpoint_id}/health")
+def read_health(endpoint_id: str):
+    """
+    Returns the queue and worker counts.
+    """
+    return endpoint.health()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(prog="python -m style_ai.runpod_local")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--cold-start", type=float, default=0.0)
+    parser.add_argument("--idle-timeout", type=float, default=5.0)
+    args = parser.parse_args()
+
+    endpoint.queue.workers = args.workers
+    endpoint.cold_start = args.cold_start
+    endpoint.idle_timeout = args.idle_timeout
+    __import__("uvicorn").run(app, host="0.0.0.0", port=args.port)
@@ -0,0 +1,122 @@
+"""
+Iteration scheduling for the scales of strotss
+"""
+from time import monotonic
+
+
+class IterationSchedule:
+    """
+    Decides how many optimization steps are run at every scale.
+
+    The schedule itself is stateless, so one instance can be shared by
+    concurrent jobs. The start time of a run is passed in by the caller.
+
+    Parameters:
+        budgets (int | list): Iterations per scale. A list is aligned to the
+            finest scale, e.g. [100, 200] runs 200 steps at the finest scale
+            and 100 steps at every coarser one.
+        plateau_window (int): Number of iterations whose mean loss is compared
+            with the window before. None disables plateau detection.
+        plateau_tolerance (float): Relative improvement between two windows
+            below which a scale counts as converged.
+        deadline (float): Wall-clock seconds for the whole run. None disables.
+        plateau_on_finest (bool): Also stop the finest scale on a plateau.
+    """
+
+    def __init__(
+        self,
+        budgets=200,
+        plateau_window: int = None,
+        plateau_tolerance: float = 1e-3,
+        deadline: float = None,
+        plateau_on_finest: bool = False,
+    ) -> None:
+        self.budgets = [budgets] if isinstance(budgets, int) else list(budgets)
+        self.plateau_window = plateau_window
+        self.plateau_tolerance = plateau_tolerance
+        self.deadline = deadline
+        self.plateau_on_finest = plateau_on_finest
+
+    @classmethod
+    def adaptive(cls, deadline: float = None) -> "IterationSchedule":
+        """
+        Returns a schedule with smaller budgets and plateau detection for the
+        coarse scales, the finest scale keeps the full 200 iterations.
+        """
+        return cls(
+            budgets=[100, 150, 200],
+            plateau_window=20,
+            plateau_tolerance=1e-3,
+            deadline=deadline,
+        )
+
+    def budget(self, scale_index: int, num_scales: int) -> int:
+        """
+        Returns the maximum number of iterations at a scale.
+        :params:
+            scale_index: index of the scale, 0 is the coarsest
+            num_scales: number of scales of the run
+        :returns:
+            iteration budget
+        """
+        from_finest = num_scales - 1 - scale_index
+        return self.budgets[max(len(self.budgets) - 1 - from_finest, 0)]
+
+    def deadline_passed(self, started: float) -> bool:
+        """
+        Checks whether the wall-clock deadline of a run has passed.
+        :params:
+            started: time.monotonic() at the start of the run
+        :returns:
+            True if the run is out of time
+        """
+        return self.deadline is not None and monotonic() - started > self.deadline
+
+    def converged(self, losses: list, scale_index: int, num_scales: int) -> bool:
+        """
+        Checks whether the loss of a scale has reached a plateau.
+        :params:
+            losses: loss of every iteration at the current scale
+            scale_index: index of the scale, 0 is the coarsest
+            num_scales: number of scales of the run
+        :returns:
+            True if the mean loss of the last window did not improve enough
+        """
+        window = self.plateau_window
+        if window is None or len(losses) < 2 * window:
+            return False
+        if scale_index == num_scales - 1 and not self.plateau_on_finest:
+            return False
+
+        previous = sum(losses[-2 * window : -window]) / window
+        current = sum(losses[-window:]) / window
+        return previous - current <= self.plateau_tolerance * abs(previous)
+
+    def should_stop(
+        self, losses: list, scale_index: int, num_scales: int, started: float
+    ) -> bool:
+        """
+        Checks whether the optimization of a scale should stop early.
+        :params:
+            losses: loss of every iteration at the current scale
+            scale_index: index of the scale, 0 is the coarsest
+            num_scales: number of scales of the run
+            started: time.monotonic() at the start of the run
+        :returns:
+            True if the deadline passed or the loss reached a plateau
+        """
+        return self.deadline_passed(started) or self.converged(
+            losses, scale_index, num_scales
+        )
+
+    def describe(self) -> dict:
+        """
+        Returns the settings of the schedule.
+        """
+        return {
+            "budgets": self.budgets,
+            "plateau_window": self.plateau_window,
+            "plateau_tolerance": self.plateau_tolerance,
+            "deadline": self.deadline,
+            "plateau_on_finest": self.plateau_on_finest,
+        }
@@ -1,16 +1,22 @@
 """
 Style transfer implementation using strotss
 """
+import logging
 from argparse import ArgumentParser
-from time import time
+from functools import partial
+from time import monotonic, time
 
 import numpy as np
 import torch
 from PIL import Image
 from torch import nn, optim
 from torchvision import models
-from tqdm import tqdm
 
+from style_ai.cancellation import CancellationToken
+from style_ai.feature_cache import StyleFeatureCache
+from style_ai.metrics import StageTimer
+from style_ai.scheduling import IterationSchedule
+from style_ai.tiers import TIERS, QualityTier
 from style_ai.utils import (
     calculate_loss,
     fold_laplace_pyramid,
@@ -19,27 +25,72 @@ from style_ai.utils import (
     make_laplace_pyramid,
     np_to_pil,
     np_to_tensor,
+    pil_hash,
     pil_resize_long_edge_to,
     pil_to_np,
+    precompute_content_distmats,
+    sample_hypercolumns,
     sample_indices,
     tensor_resample,
     tensor_to_np,
 )
 
+logger = logging.getLogger(__name__)
+
+
+PRECISIONS = {"float32": None, "bfloat16": torch.bfloat16, "float16": torch.float16}
+
 
 class Vgg16Extractor(nn.Module):
     """
     VGG16 feature extractor for style transfer
+
+    Parameters:
+        space (str): Color space of the inputs, "uniform" or "vgg".
+        precision (str): "float32", or "bfloat16" / "float16" to run the
+            convolutions under autocast on the device of the input.
+        channels_last (bool): Run the convolutions in channels_last memory
+            format.
     """
 
-    def __init__(self, space) -> None:
+    def __init__(
+        self, space, precision: str = "float32", channels_last: bool = False
+    ) -> None:
         super().__init__()
-        self.vgg_layers = models.vgg16(weights=models.VGG16_Weights.DEFAULT).features
+        if precision not in PRECISIONS:
+            raise ValueError(
+                f"Unknown precision {precision}, use one of {', '.join(PRECISIONS)}"
+            )
+        self.capture_layers = [1, 3, 6, 8, 11, 13, 15, 22, 29]
+        self.space = space
+        self.precision = precision
+        self.channels_last = channels_last
+
+        # only keep the layers up to the deepest capture layer, split into
+        # one stage per captured feature map
+        vgg_layers = models.vgg16(weights=models.VGG16_Weights.DEFAULT).features
+        stages, start = [], 0
+        for layer in self.capture_layers:
+            stages.append(nn.Sequential(*vgg_layers[start : layer + 1]))
+            start = layer + 1
+        self.stages = nn.Sequential(*stages)
 
         for param in self.parameters():
             param.requires_grad = False
-        self.capture_layers = [1, 3, 6, 8, 11, 13, 15, 22, 29]
-        self.space = space
+
+        self.register_buffer(
+            "mean",
+            torch.Tensor([0.485, 0.456, 0.406]).view(1, -1, 1, 1),
+            persistent=False,
+        )
+        self.register_buffer(
+            "std",
+            torch.Tensor([0.229, 0.224, 0.225]).view(1, -1, 1, 1),
+            persistent=False,
+        )
+
+        if channels_last:
+            self.to(memory_format=torch.channels_last)
 
     def forward_base(self, tensor: torch.Tensor) -> list:
         """
@@ -50,10 +101,9 @@ class Vgg16Extractor(nn.Module):
             extracted features at capture layers
         """
         feat = [tensor]
-        for i, layer in enumerate(self.vgg_layers):
-            tensor = layer(tensor)
-            if i in self.capture_layers:
-                feat.append(tensor)
+        for stage in self.stages:
+            tensor = stage(tensor)
+            feat.append(tensor)
         return feat
 
     def forward(self, tensor: torch.Tensor) -> list:
@@ -65,215 +115,578 @@ class Vgg16Extractor(nn.Module):
             extracted features
         """
         if self.space != "vgg":
-            tensor = (tensor + 1.0) / 2.0
-            tensor = tensor - (
-                torch.Tensor([0.485, 0.456, 0.406]).to(tensor.device).view(1, -1, 1, 1)
-            )
-            tensor = tensor / (
-                torch.Tensor([0.229, 0.224, 0.225]).to(tensor.device).view(1, -1, 1, 1)
-            )
-        feat = self.forward_base(tensor)
-        return feat
+            tensor = ((tensor + 1.0) / 2.0 - self.mean) / self.std
+        if self.channels_last:
+            tensor = tensor.contiguous(memory_format=torch.channels_last)
+        dtype = PRECISIONS[self.precision]
+        if dtype is None:
+            return self.forward_base(tensor)
+        with torch.autocast(device_type=tensor.device.type, dtype=dtype):
+            return self.forward_base(tensor)
 
     def forward_samples_hypercolumn(
-        self, input_tensor: torch.Tensor, samps: int = 100
+        self, input_tensor: torch.Tensor, samps: int = 100, generator=None
     ) -> torch.Tensor:
         """
         Forward pass for sampling hypercolumn features
         :params:
             input_tensor: input tensor
             samps: number of samples
+            generator: optional torch.Generator for reproducible samples
         :returns:
             sampled features
         """
         feat = self.forward(input_tensor)
+        return sample_hypercolumns(feat, samps, generator=generator)
 
-        x_indices, y_indices = np.meshgrid(
-            np.arange(input_tensor.shape[2]), np.arange(input_tensor.shape[3])
-        )
-        x_indices = np.expand_dims(x_indices.flatten(), 1)
-        y_indices = np.expand_dims(y_indices.flatten(), 1)
-        indices = np.concatenate([x_indices, y_indices], 1)
-
-        samples = min(samps, indices.shape[0])
-
-        np.random.shuffle(indices)
-        x_indices = indices[:samples, 0]
-        y_indices_sampled = indices[:samples, 1]
-
-        feat_samples = []
-        for i, layer_feat in enumerate(feat):
-            # hack to detect lower resolution
-            if i > 0 and layer_feat.size(2) < feat[i - 1].size(2):
-                x_indices = x_indices / 2.0
-                y_indices_sampled = y_indices_sampled / 2.0
-
-            x_indices = np.clip(x_indices, 0, layer_feat.shape[2] - 1).astype(np.int32)
-            y_indices_sampled = np.clip(
-                y_indices_sampled, 0, layer_feat.shape[3] - 1
-            ).astype(np.int32)
-
-            features = layer_feat[
-                :, :, x_indices[range(samples)], y_indices_sampled[range(samples)]
-            ]
-            feat_samples.append(features.clone().detach())
 
-        feat = torch.cat(feat_samples, 1)
-        return feat
+def sample_style_features(extractor, style, draws=5, samps=1000, seed=None):
+    """
+    Samples hypercolumn features of a style image
+    :params:
+        extractor: feature extractor
+        style: style image tensor (1 x C x H x W)
+        draws: number of sampling rounds
+        samps: number of samples per round
+        seed: optional seed for reproducible samples
+    :returns:
+        sampled style features (1 x C x draws * samps)
+    """
+    generator = None
+    if seed is not None:
+        generator = torch.Generator(device=style.device)
+        generator.manual_seed(seed)
+    feat_style = None
+    for _ in range(draws):
+        with torch.no_grad():
+            # r is region of interest (mask)
+            feat_e = extractor.forward_samples_hypercolumn(
+                style, samps=samps, generator=generator
+            )
+            feat_style = (
+                feat_e if feat_style is None else torch.cat((feat_style, feat_e), dim=2)
+            )
+    return feat_style
 
 
-def optimize(res, content: Image.Image, style, w_content, learning_rate, extractor):
+def cached_style_features(
+    extractor, style, style_cache=None, key=None, draws=5, samps=1000
+):
     """
-    Optimizes the result image
+    Returns the sampled features of a style image, consulting the cache first
     :params:
-        res: result image
-        content: content image
-        style: style image
+        extractor: feature extractor
+        style: style image tensor (1 x C x H x W)
+        style_cache: optional StyleFeatureCache
+        key: cache key of the style image at the current scale
+        draws: number of sampling rounds
+        samps: number of samples per round
+    :returns:
+        sampled style features (1 x C x S)
+    """
+    if style_cache is None or key is None:
+        return sample_style_features(extractor, style, draws=draws, samps=samps)
+
+    cached = style_cache.get(key)
+    if cached is not None:
+        return torch.from_numpy(np.array(cached)).to(style.device)
+
+    feat_style = sample_style_features(
+        extractor, style, draws=draws, samps=samps, seed=style_cache.seed
+    )
+    style_cache.put(key, feat_style.cpu().numpy())
+    return feat_style
+
+
+def cached_style_resample(style_full, scale, style_cache=None, key=None):
+    """
+    Returns the style image resampled to a scale, consulting the cache first
+    :params:
+        style_full: full resolution style image tensor (1 x C x H x W)
+        scale: divisor of the current scale
+        style_cache: optional StyleFeatureCache
+        key: cache key of the resampled style image
+    :returns:
+        resampled style image tensor
+    """
+    if style_cache is not None and key is not None:
+        cached = style_cache.get(key)
+        if cached is not None:
+            return torch.from_numpy(np.array(cached)).to(style_full.device)
+
+    style = tensor_resample(
+        style_full, [style_full.shape[2] // scale, style_full.shape[3] // scale]
+    )
+    if style_cache is not None and key is not None:
+        style_cache.put(key, style.cpu().numpy())
+    return style
+
+
+def optimize(
+    res,
+    content,
+    styles,
+    w_content,
+    learning_rate,
+    extractor,
+    opt_iter=200,
+    should_stop=None,
+    style_cache=None,
+    style_keys=None,
+    loss_tile_size=None,
+    index_pool=None,
+    cancel_token=None,
+    tier: QualityTier = None,
+):
+    """
+    Optimizes a batch of result images. All jobs share one extractor
+    forward/backward pass per iteration, their losses are kept separate.
+    :params:
+        res: batch of result images (N x C x H x W)
+        content: batch of content images (N x C x H x W)
+        styles: list of N style images (1 x C x H x W each)
         w_content: content weight
         learning_rate: learning rate
         extractor: feature extractor
+        opt_iter: maximum number of iterations
+        should_stop: optional callable that gets the summed loss of every
+            iteration so far and returns True to stop early
+        style_cache: optional StyleFeatureCache for the style features
+        style_keys: cache key of every style image at this scale
+        loss_tile_size: number of style samples per tile of the style loss,
+            None computes the full distance matrix
+        index_pool: number of sample index permutations that are cycled
+            through, the content side of the loss is computed once per
+            permutation. None draws a new permutation every iteration
+        cancel_token: optional CancellationToken checked every iteration
+        tier: quality tier for the style samples and loss locations,
+            defaults to the standard tier
     :returns:
-        stylized image
+        stylized batch, the last loss of every job and the iterations run
     """
+    if tier is None:
+        tier = TIERS["standard"]
     # torch.autograd.set_detect_anomaly(True)
     result_pyramid = make_laplace_pyramid(res, 5)
     result_pyramid = [l.data.requires_grad_() for l in result_pyramid]
 
-    opt_iter = 200
-    # if scale == 1:
-    #     opt_iter = 800
-
     # use rmsprop
     optimizer = optim.RMSprop(result_pyramid, lr=learning_rate)
 
     # extract features for content
-    feat_content = extractor(content)
+    with torch.no_grad():
+        feat_content = extractor(content)
 
     stylized = fold_laplace_pyramid(result_pyramid)
     # let's ignore the regions for now
     # some inner loop that extracts samples
-    feat_style = None
-    for _ in range(5):
-        with torch.no_grad():
-            # r is region of interest (mask)
-            feat_e = extractor.forward_samples_hypercolumn(style, samps=1000)
-            feat_style = (
-                feat_e if feat_style is None else torch.cat((feat_style, feat_e), dim=2)
-            )
+    if style_keys is None:
+        style_keys = [None] * len(styles)
+    feat_styles = [
+        cached_style_features(
+            extractor,
+            style,
+            style_cache,
+            key,
+            draws=tier.style_draws,
+            samps=tier.style_samples,
+        )
+        for style, key in zip(styles, style_keys)
+    ]
     # feat_style.requires_grad_(False)
 
     # init indices to optimize over
     x_indices, y_indices = sample_indices(
         feat_content[0]
     )  # 0 to sample over first layer extracted
-    for iteration in tqdm(range(opt_iter)):
+    # with a fixed pool of permutations the content features only have to
+    # be resampled and compared once per permutation
+    index_permutations = []
+    for _ in range(index_pool or 0):
+        np.random.shuffle(x_indices)
+        np.random.shuffle(y_indices)
+        index_permutations.append([x_indices.copy(), y_indices.copy()])
+    content_distmats: dict = {}
+
+    losses = []
+    history: list = []
+    iterations = 0
+    for iteration in range(opt_iter):
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        if should_stop is not None and should_stop(history):
+            break
         optimizer.zero_grad()
 
         stylized = fold_laplace_pyramid(result_pyramid)
         # original code has resample here, seems pointless with uniform shuffle
         # ...
         # also shuffle them every y iter
-        if iteration != 0:
-            np.random.shuffle(x_indices)
-            np.random.shuffle(y_indices)
+        if index_pool is None:
+            if iteration != 0:
+                np.random.shuffle(x_indices)
+                np.random.shuffle(y_indices)
+            indices = [x_indices, y_indices]
+            distmats = [None] * len(styles)
+        else:
+            permutation = iteration % index_pool
+            indices = index_permutations[permutation]
+            if permutation not in content_distmats:
+                content_distmats[permutation] = precompute_content_distmats(
+                    feat_content, indices, num_locations=tier.num_locations
+                )
+            distmats = content_distmats[permutation]
         feat_result = extractor(stylized)
 
-        loss = calculate_loss(
-            feat_result, feat_content, feat_style, [x_indices, y_indices], w_content
-        )
-        loss.backward()
+        # the jobs only share the forward pass, every job gets its own loss
+        losses = [
+            calculate_loss(
+                [feat[job : job + 1] for feat in feat_result],
+                [feat[job : job + 1] for feat in feat_content],
+                feat_style,
+                indices,
+                w_content,
+                tile_size=loss_tile_size,
+                content_distmat=distmats[job],
+                num_locations=tier.num_locations,
+            )
+            for job, feat_style in enumerate(feat_styles)
+        ]
+        # the pyramid levels of the jobs are disjoint, so summing the losses
+        # gives every job exactly the gradient of its own loss
+        loss_total = torch.stack(losses).sum()
+        loss_total.backward()
         optimizer.step()
-    return stylized
+        iterations += 1
+        if should_stop is not None:
+            history.append(loss_total.item())
+    return stylized, [loss.item() for loss in losses], iterations
 
 
-def strotss(
-    content_pil,
-    style_pil,
+def result_to_pils(result, space, size=None):
+    """
+    Converts a batch of results to PIL images
+    :params:
+        result: batch of result images (N x C x H x W)
+        space: color space of the result
+        size: optional size to resample the results to
+    :returns:
+        list of PIL images, one per job
+    """
+    clow = -1.0 if space == "uniform" else -1.7
+    chigh = 1.0 if space == "uniform" else 1.7
+    result = torch.clamp(result.detach(), clow, chigh)
+    if size is not None:
+        result = tensor_resample(result, size)
+    images = []
+    for job in range(result.shape[0]):
+        result_np = tensor_to_np(result[job : job + 1])
+        # renormalize image
+        result_np -= result_np.min()
+        result_np /= result_np.max()
+        images.append(np_to_pil(result_np * 255.0))
+    return images
+
+
+def pyramid_scales(width: int, height: int) -> list:
+    """
+    Returns the divisors of the scales strotss optimizes at, coarsest first
+    :params:
+        width: width of the content image
+        height: height of the content image
+    :returns:
+        list of divisors, e.g. [4, 2, 1]
+    """
+    scales = []
+    for scale in range(10):
+        divisor = 2**scale
+        if min(width, height) // divisor >= 33:
+            scales.insert(0, divisor)
+    return scales
+
+
+def strotss_batch(
+    content_pils,
+    style_pils,
     content_weight=1.0 * 16.0,
     extractor: Vgg16Extractor = None,
     device="cuda:0",
     space="uniform",
+    schedule: IterationSchedule = None,
+    style_cache: StyleFeatureCache = None,
+    loss_tile_size: int = None,
+    index_pool: int = None,
+    callback=None,
+    cancel_token: CancellationToken = None,
+    timer: StageTimer = None,
+    tier: QualityTier = None,
+    resume_from=None,
 ):
     """
-    Strotss implementation
+    Batched strotss implementation. All content images have to share the
+    same resolution, the style images may differ in size.
     :params:
-        content_pil: PIL image of content
-        style_pil: PIL image of style
+        content_pils: list of PIL images of content
+        style_pils: list of PIL images of style
         content_weight: weight of content loss
+        extractor: feature extractor shared by all jobs
         device: device to run on
         space: color space to use
+        schedule: iteration schedule, defaults to 200 iterations per scale
+        style_cache: optional cache for the resampled style images and their
+            sampled features
+        loss_tile_size: number of style samples per tile of the style loss,
+            lowers the peak memory for large images
+        index_pool: number of sample index permutations per scale whose
+            content side is computed once, None draws one every iteration.
+            Defaults to the index pool of the tier
+        callback: optional callable that gets the scale index, the number of
+            scales and the list of intermediate images after every scale
+        cancel_token: optional CancellationToken, raises JobCancelled once
+            it is cancelled or its deadline passed
+        timer: optional StageTimer that records the tensor conversion, the
+            optimization of every scale and the conversion of the results
+        tier: quality tier for the number of scales, the iterations, the
+            style samples and the loss locations, defaults to standard.
+            An explicit schedule, loss_tile_size or index_pool wins over the
+            tier
+        resume_from: optional "state" of an earlier run of the same jobs at a
+            lower resolution (N x C x h x w). The scales it already covers
+            are skipped and the content weight is halved for each of them,
+            as if the run had continued from there
     :returns:
-        stylized image
+        list of stylized images, one per job, and a dict with the final loss
+        of every job, the schedule, the iterations used per scale, the
+        number of skipped scales and the unclamped result as "state"
     """
-    content_np = pil_to_np(content_pil)
-    style_np = pil_to_np(style_pil)
-    content_full = np_to_tensor(content_np, space).to(device)
-    style_full = np_to_tensor(style_np, space).to(device)
+    if len(content_pils) != len(style_pils):
+        raise ValueError("Every content image needs exactly one style image")
+    if len({content_pil.size for content_pil in content_pils}) != 1:
+        raise ValueError("All content images of a batch must have the same size")
+
+    if timer is None:
+        timer = StageTimer()
+    if tier is None:
+        tier = TIERS["standard"]
+
+    with timer.stage("tensor"):
+        content_full = torch.cat(
+            [
+                np_to_tensor(pil_to_np(content_pil), space)
+                for content_pil in content_pils
+            ]
+        ).to(device)
+        styles_full = [
+            np_to_tensor(pil_to_np(style_pil), space).to(device)
+            for style_pil in style_pils
+        ]
+    style_hashes = [
+        pil_hash(style_pil) if style_cache is not None else None
+        for style_pil in style_pils
+    ]
 
     learning_rate = 2e-3
 
+    if schedule is None:
+        schedule = tier.schedule()
+    if loss_tile_size is None:
+        loss_tile_size = tier.loss_tile_size
+    if index_pool is None:
+        index_pool = tier.index_pool
+
     if extractor is None:
         extractor = Vgg16Extractor(space=space)
 
     extractor.to(device)
 
-    scales = []
-    for scale in range(10):
-        divisor = 2**scale
-        if min(content_pil.width, content_pil.height) // divisor >= 33:
-            scales.insert(0, divisor)
-
-    for scale in scales:
+    width, height = content_pils[0].size
+    scales = pyramid_scales(width, height)
+    if tier.max_scales is not None:
+        # skip the coarsest scales
+        scales = scales[-tier.max_scales :]
+    skipped = 0
+    if resume_from is not None:
+        if not torch.is_tensor(resume_from):
+            resume_from = torch.from_numpy(np.array(resume_from, dtype=np.float32))
+        if resume_from.shape[0] != len(content_pils):
+            raise ValueError("The resumed state needs one result per content image")
+        resume_from = resume_from.to(device)
+        # skip the scales the state already covers, the finest always runs
+        resumed = min(resume_from.shape[2], resume_from.shape[3])
+        skipped = sum(
+            1 for scale in scales[:-1] if min(width, height) // scale <= resumed
+        )
+        scales = scales[skipped:]
+        content_weight /= 2.0**skipped
+        timer.add("skipped_scales", skipped)
+
+    started = monotonic()
+    losses: list = []
+    iterations = []
+    for scale_index, scale in enumerate(scales):
         # rescale content to current scale
         content = tensor_resample(
             content_full,
             [content_full.shape[2] // scale, content_full.shape[3] // scale],
         )
-        style = tensor_resample(
-            style_full, [style_full.shape[2] // scale, style_full.shape[3] // scale]
+        styles = [
+            cached_style_resample(
+                style_full,
+                scale,
+                style_cache,
+                StyleFeatureCache.make_key("style", style_hash, scale, space),
+            )
+            for style_full, style_hash in zip(styles_full, style_hashes)
+        ]
+        style_keys = [
+            StyleFeatureCache.make_key(
+                "features",
+                style_hash,
+                scale,
+                space,
+                style_cache.seed,
+                extractor.precision,
+                tier.style_draws,
+                tier.style_samples,
+            )
+            if style_cache is not None
+            else None
+            for style_hash in style_hashes
+        ]
+        logger.debug(
+            "Optimizing at resolution [%d, %d]", content.shape[2], content.shape[3]
         )
-        print(f"Optimizing at resoluton [{content.shape[2]}, {content.shape[3]}]")
 
         # upsample or initialize the result
-        if scale == scales[0]:
+        if scale_index == 0 and resume_from is None:
             # first
-            result = laplacian(content) + style.mean(2, keepdim=True).mean(
-                3, keepdim=True
+            result = laplacian(content) + torch.cat(
+                [style.mean(2, keepdim=True).mean(3, keepdim=True) for style in styles]
             )
-        elif scale == scales[-1]:
-            # last
-            result = tensor_resample(result, [content.shape[2], content.shape[3]])
-            learning_rate = 1e-3
         else:
-            result = tensor_resample(
-                result, [content.shape[2], content.shape[3]]
-            ) + laplacian(content)
+            # upsample the previous scale or the resumed state
+            previous = resume_from if scale_index == 0 else result
+            result = tensor_resample(previous, [content.shape[2], content.shape[3]])
+            if scale == scales[-1]:
+                # last
+                learning_rate = 1e-3
+            else:
+                result = result + laplacian(content)
 
         # do the optimization on this scale
-        result = optimize(
-            result,
-            content,
-            style,
-            w_content=content_weight,
-            learning_rate=learning_rate,
-            extractor=extractor,
-        )
+        with timer.stage("optimize", scale=scale_index):
+            result, losses, scale_iterations = optimize(
+                result,
+                content,
+                styles,
+                w_content=content_weight,
+                learning_rate=learning_rate,
+                extractor=extractor,
+                opt_iter=schedule.budget(scale_index, len(scales)),
+                should_stop=partial(
+                    schedule.should_stop,
+                    scale_index=scale_index,
+                    num_scales=len(scales),
+                    started=started,
+                ),
+                style_cache=style_cache,
+                style_keys=style_keys,
+                loss_tile_size=loss_tile_size,
+                index_pool=index_pool,
+                cancel_token=cancel_token,
+                tier=tier,
+            )
+        iterations.append(scale_iterations)
+        timer.add("iterations", scale_iterations)
 
         # next scale lower weight
         content_weight /= 2.0
 
-    clow = -1.0 if space == "uniform" else -1.7
-    chigh = 1.0 if space == "uniform" else 1.7
-    result_np = tensor_to_np(
-        tensor_resample(
-            torch.clamp(result, clow, chigh),
-            [content_full.shape[2], content_full.shape[3]],
+        if callback is not None:
+            callback(scale_index, len(scales), result_to_pils(result, space))
+
+    with timer.stage("to_image"):
+        images = result_to_pils(
+            result, space, [content_full.shape[2], content_full.shape[3]]
         )
+    return images, {
+        "losses": losses,
+        "schedule": schedule.describe(),
+        "tier": tier.name,
+        "iterations": iterations,
+        "skipped_scales": skipped,
+        "state": result.detach().float().cpu().numpy(),
+    }
+
+
+def strotss(
+    content_pil,
+    style_pil,
+    content_weight=1.0 * 16.0,
+    extractor: Vgg16Extractor = None,
+    device="cuda:0",
+    space="uniform",
+    schedule: IterationSchedule = None,
+    return_info: bool = False,
+    style_cache: StyleFeatureCache = None,
+    loss_tile_size: int = None,
+    index_pool: int = None,
+    callback=None,
+    cancel_token: CancellationToken = None,
+    timer: StageTimer = None,
+    tier: QualityTier = None,
+    resume_from=None,
+):
+    """
+    Strotss implementation
+    :params:
+        content_pil: PIL image of content
+        style_pil: PIL image of style
+        content_weight: weight of content loss
+        device: device to run on
+        space: color space to use
+        schedule: iteration schedule, defaults to 200 iterations per scale
+        return_info: also return the loss, schedule and iterations per scale
+        style_cache: optional cache for the style features
+        loss_tile_size: number of style samples per tile of the style loss
+        index_pool: number of sample index permutations per scale, None
+            draws one every iteration unless the tier sets a pool
+        callback: optional callable that gets the scale index, the number of
+            scales and the intermediate image after every scale
+        cancel_token: optional CancellationToken to stop the run
+        timer: optional StageTimer for the stage timings of the run
+        tier: quality tier of the run, defaults to standard
+        resume_from: optional "state" from the info of an earlier run at a
+            lower resolution, its scales are skipped
+    :returns:
+        stylized image, and the run info if return_info is set
+    """
+
+    def batch_callback(scale_index, num_scales, images):
+        callback(scale_index, num_scales, images[0])
+
+    images, info = strotss_batch(
+        [content_pil],
+        [style_pil],
+        content_weight=content_weight,
+        extractor=extractor,
+        device=device,
+        space=space,
+        schedule=schedule,
+        style_cache=style_cache,
+        loss_tile_size=loss_tile_size,
+        index_pool=index_pool,
+        callback=batch_callback if callback is not None else None,
+        cancel_token=cancel_token,
+        timer=timer,
+        tier=tier,
+        resume_from=resume_from,
     )
-    # renormalize image
-    result_np -= result_np.min()
-    result_np /= result_np.max()
-    return np_to_pil(result_np * 255.0)
+    if return_info:
+        losses = info.pop("losses")
+        info["loss"] = losses[0] if losses else None
+        return images[0], info
+    return images[0]
 
 
 def style_transfer(
@@ -283,6 +696,15 @@ def style_transfer(
     weight: float = 1.5 * 16,
     device: str = "cuda:0",
     resize_to: int = 512,
+    schedule: IterationSchedule = None,
+    style_cache: StyleFeatureCache = None,
+    loss_tile_size: int = None,
+    callback=None,
+    cancel_token: CancellationToken = None,
+    timer: StageTimer = None,
+    tier: QualityTier = None,
+    resume_from=None,
+    return_info: bool = False,
 ) -> Image:
     """
     Stylize content image with style image
@@ -293,15 +715,106 @@ def style_transfer(
         output: output file name
         device: device to run on
         resize_to: resize to this size before stylizing
+        schedule: iteration schedule, defaults to 200 iterations per scale
+        style_cache: optional cache for the style features
+        loss_tile_size: number of style samples per tile of the style loss
+        callback: optional callable that gets the scale index, the number of
+            scales and the intermediate image after every scale
+        cancel_token: optional CancellationToken to stop the run
+        timer: optional StageTimer for the stage timings of the run
+        tier: quality tier, its resolution replaces resize_to
+        resume_from: optional "state" of an earlier run at a lower
+            resolution, e.g. a preview, only the finer scales are run
+        return_info: also return the run info, see strotss()
     :returns:
-        stylized image
+        stylized image, and the run info if return_info is set
     """
-    content = pil_resize_long_edge_to(content, resize_to)
-    style = pil_resize_long_edge_to(style, resize_to)
-    stylized = strotss(
-        content, style, content_weight=weight, extractor=extractor, device=device
+    if timer is None:
+        timer = StageTimer()
+    if tier is not None:
+        resize_to = tier.resize_to
+    with timer.stage("resize"):
+        content = pil_resize_long_edge_to(content, resize_to)
+        style = pil_resize_long_edge_to(style, resize_to)
+    return strotss(
+        content,
+        style,
+        content_weight=weight,
+        extractor=extractor,
+        device=device,
+        schedule=schedule,
+        return_info=return_info,
+        style_cache=style_cache,
+        loss_tile_size=loss_tile_size,
+        callback=callback,
+        cancel_token=cancel_token,
+        timer=timer,
+        tier=tier,
+        resume_from=resume_from,
     )
-    return stylized
+
+
+def style_transfer_batch(
+    contents: list,
+    styles: list,
+    extractor: Vgg16Extractor = None,
+    weight: float = 1.5 * 16,
+    device: str = "cuda:0",
+    resize_to: int = 512,
+    schedule: IterationSchedule = None,
+    style_cache: StyleFeatureCache = None,
+    loss_tile_size: int = None,
+    cancel_token: CancellationToken = None,
+    tier: QualityTier = None,
+) -> list:
+    """
+    Stylize several content images with their style images. The jobs are
+    bucketed by their resized resolution and every bucket is optimized as
+    one batch.
+    :params:
+        contents: content images
+        styles: style images, one per content image
+        extractor: feature extractor shared by all jobs
+        weight: weight of content loss
+        device: device to run on
+        resize_to: resize to this size before stylizing
+        schedule: iteration schedule, defaults to 200 iterations per scale
+        style_cache: optional cache for the style features
+        loss_tile_size: number of style samples per tile of the style loss
+        cancel_token: optional CancellationToken to stop all buckets
+        tier: quality tier, its resolution replaces resize_to
+    :returns:
+        stylized images in the order of the inputs
+    """
+    if extractor is None:
+        extractor = Vgg16Extractor(space="uniform")
+    if tier is not None:
+        resize_to = tier.resize_to
+
+    buckets: dict = {}
+    for job, (content, style) in enumerate(zip(contents, styles)):
+        content = pil_resize_long_edge_to(content, resize_to)
+        style = pil_resize_long_edge_to(style, resize_to)
+        buckets.setdefault(content.size, []).append((job, content, style))
+
+    results = [None] * len(contents)
+    for bucket in buckets.values():
+        jobs, bucket_contents, bucket_styles = zip(*bucket)
+        stylized, _ = strotss_batch(
+            list(bucket_contents),
+            list(bucket_styles),
+            content_weight=weight,
+            extractor=extractor,
+            device=device,
+            schedule=schedule,
+            style_cache=style_cache,
+            loss_tile_size=loss_tile_size,
+            cancel_token=cancel_token,
+            tier=tier,
+        )
+        for job, image in zip(jobs, stylized):
+            results[job] = image
+    return results
 
 
 if __name__ == "__main__":
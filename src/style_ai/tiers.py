@@ -0,0 +1,102 @@
+"""
+Named quality tiers of the style transfer
+"""
+from style_ai.scheduling import IterationSchedule
+
+
+class QualityTier:
+    """
+    Bundles the knobs that trade quality for latency.
+
+    Parameters:
+        name (str): Name of the tier.
+        resize_to (int): Long edge of the output image.
+        budgets (int | list): Iterations per scale, see IterationSchedule.
+        max_scales (int): Number of pyramid scales, the coarsest ones are
+            skipped. None runs every scale.
+        style_draws (int): Sampling rounds of the style features.
+        style_samples (int): Style feature samples per round.
+        num_locations (int): Number of sampled locations in the loss.
+        loss_tile_size (int): Tile size of the style loss, None computes the
+            full distance matrix.
+        index_pool (int): Number of fixed sample permutations cycled per
+            scale, their content distance matrices are computed once. None
+            draws a new permutation every iteration.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        resize_to: int,
+        budgets=200,
+        max_scales: int = None,
+        style_draws: int = 5,
+        style_samples: int = 1000,
+        num_locations: int = 1024,
+        loss_tile_size: int = None,
+        index_pool: int = None,
+    ) -> None:
+        self.name = name
+        self.resize_to = resize_to
+        self.budgets = budgets
+        self.max_scales = max_scales
+        self.style_draws = style_draws
+        self.style_samples = style_samples
+        self.num_locations = num_locations
+        self.loss_tile_size = loss_tile_size
+        self.index_pool = index_pool
+
+    def schedule(self) -> IterationSchedule:
+        """
+        Returns the iteration schedule of the tier.
+        """
+        return IterationSchedule(budgets=self.budgets)
+
+    def describe(self) -> dict:
+        """
+        Returns the settings of the tier.
+        """
+        return {
+            "name": self.name,
+            "resize_to": self.resize_to,
+            "budgets": self.budgets,
+            "max_scales": self.max_scales,
+            "style_draws": self.style_draws,
+            "style_samples": self.style_samples,
+            "num_locations": self.num_locations,
+            "loss_tile_size": self.loss_tile_size,
+            "index_pool": self.index_pool,
+        }
+
+
+# standard matches the settings strotss always used
+TIERS = {
+    "preview": QualityTier(
+        "preview",
+        resize_to=256,
+        budgets=60,
+        max_scales=2,
+        style_draws=2,
+        style_samples=500,
+        num_locations=256,
+        index_pool=16,
+    ),
+    "standard": QualityTier("standard", resize_to=512),
+    "print": QualityTier(
+        "print",
+        resize_to=1024,
+        budgets=[200, 300],
+        style_draws=8,
+        num_locations=2048,
+        loss_tile_size=2048,
+    ),
+}
+
+
+def get_tier(name: str) -> QualityTier:
+    """
+    Returns the tier with the name, raises ValueError for unknown names.
+    """
+    if name not in TIERS:
+        raise ValueError(f"Unknown tier {name}, use one of {', '.join(TIERS)}")
+    return TIERS[name]
@@ -2,6 +2,7 @@
 Utils for style transfer
 """
 
+import hashlib
 import math
 
 import numpy as np
@@ -43,6 +44,19 @@ def pil_resize_long_edge_to(pil, trg_size):
     return resized
 
 
+def pil_hash(pil):
+    """
+    Hash the pixels of a PIL.Image object
+    :params:
+        pil: PIL.Image object
+    :return:
+        str, hex digest of mode, size and pixel data
+    """
+    digest = hashlib.sha1(f"{pil.mode}{pil.size}".encode())
+    digest.update(pil.tobytes())
+    return digest.hexdigest()
+
+
 def np_to_pil(npy):
     """
     Convert numpy array to PIL.Image object
@@ -227,41 +241,131 @@ def distmat(tensor_x, tensor_y, cos_d=True):
     return distance_matrix
 
 
-def content_loss(feat_result, feat_content):
+def paired_distances_l2(tensor_x, tensor_y):
     """
-    Compute content loss between two torch.Tensor objects
+    Compute the L2 distance of every row of tensor_x to the same row of
+    tensor_y, scaled like distmat(..., cos_d=False)
     :params:
-        feat_result: torch.Tensor object
-        feat_content: torch.Tensor object
+        tensor_x: torch.Tensor object
+        tensor_y: torch.Tensor object with the same shape
     :return:
-        torch.Tensor object of content loss
+        torch.Tensor object of one distance per row
     """
-    distance = feat_result.size(1)
-
-    feat_result_transposed = (
-        feat_result.transpose(0, 1).contiguous().view(distance, -1).transpose(0, 1)
+    dist = (
+        (tensor_x**2).sum(1)
+        + (tensor_y**2).sum(1)
+        - 2.0 * (tensor_x * tensor_y).sum(1)
     )
-    feat_content_transposed = (
-        feat_content.transpose(0, 1).contiguous().view(distance, -1).transpose(0, 1)
+    return torch.sqrt(torch.clamp(dist, 1e-5, 1e5) / tensor_x.size(1))
+
+
+def tiled_remd_loss(matrix_x, matrix_y, tile_size, with_l2=False):
+    """
+    Compute the relaxed earth mover's distance between two sets of feature
+    vectors over tiles of matrix_y. The full distance matrix is never held:
+    the closest partners are searched tile by tile without autograd, then
+    only the distances to those partners are recomputed with autograd. This
+    gives the same value and gradient as the dense version, because the
+    gradient of a minimum only flows into the selected element.
+    :params:
+        matrix_x: torch.Tensor object (rows x channels)
+        matrix_y: torch.Tensor object (columns x channels)
+        tile_size: int, number of columns per tile
+        with_l2: bool, if True, add the L2 distance to the cosine distance
+    :return:
+        torch.Tensor object of the distance
+    """
+    with torch.no_grad():
+        row_min = torch.full(
+            (matrix_x.size(0),),
+            float("inf"),
+            dtype=matrix_x.dtype,
+            device=matrix_x.device,
+        )
+        row_arg = torch.zeros(
+            matrix_x.size(0), dtype=torch.long, device=matrix_x.device
+        )
+        col_args = []
+        for start in range(0, matrix_y.size(0), tile_size):
+            tile = matrix_y[start : start + tile_size]
+            distance_matrix = distmat(matrix_x, tile)
+            if with_l2:
+                distance_matrix += distmat(matrix_x, tile, cos_d=False)
+
+            tile_min, tile_arg = distance_matrix.min(1)
+            closer = tile_min < row_min
+            row_min = torch.where(closer, tile_min, row_min)
+            row_arg = torch.where(closer, tile_arg + start, row_arg)
+            col_args.append(distance_matrix.min(0)[1])
+        col_arg = torch.cat(col_args)
+
+    x_unit = matrix_x / torch.sqrt((matrix_x**2).sum(1, keepdim=True))
+    y_unit = matrix_y / torch.sqrt((matrix_y**2).sum(1, keepdim=True))
+
+    # cosine distance of every row to its closest column
+    min_dist_1 = 1.0 - (x_unit * y_unit[row_arg]).sum(1).mean()
+    # every column adds its unit vector to its closest row, so the column
+    # side never gathers a (columns x channels) copy of matrix_x
+    y_per_row = torch.zeros_like(x_unit).index_add(0, col_arg, y_unit)
+    min_dist_2 = 1.0 - (x_unit * y_per_row).sum() / matrix_y.size(0)
+
+    if with_l2:
+        min_dist_1 = (
+            min_dist_1 + paired_distances_l2(matrix_x, matrix_y[row_arg]).mean()
+        )
+        min_dist_2 = (
+            min_dist_2 + paired_distances_l2(matrix_x[col_arg], matrix_y).mean()
+        )
+
+    return torch.max(min_dist_1, min_dist_2)
+
+
+def content_self_similarity(feat):
+    """
+    Compute the self-similarity matrix of resampled features
+    :params:
+        feat: torch.Tensor object (1 x C x locations x 1)
+    :return:
+        torch.Tensor object of pairwise cosine distances of the locations
+    """
+    distance = feat.size(1)
+
+    feat_transposed = (
+        feat.transpose(0, 1).contiguous().view(distance, -1).transpose(0, 1)
     )
+    feat_transposed = feat_transposed[:, :-2]
 
-    feat_content_transposed = feat_content_transposed[:, :-2]
-    feat_result_transposed = feat_result_transposed[:, :-2]
+    return distmat(feat_transposed, feat_transposed)
 
-    matrix_feat_res = distmat(feat_result_transposed, feat_result_transposed)
 
-    matrix_feat_cont = distmat(feat_content_transposed, feat_content_transposed)
+def content_loss(feat_result, feat_content=None, content_distmat=None):
+    """
+    Compute content loss between two torch.Tensor objects
+    :params:
+        feat_result: torch.Tensor object
+        feat_content: torch.Tensor object
+        content_distmat: precomputed self-similarity of feat_content
+    :return:
+        torch.Tensor object of content loss
+    """
+    # reductions stay in float32 when the extractor runs in lower precision
+    matrix_feat_res = content_self_similarity(feat_result.float())
+
+    if content_distmat is None:
+        content_distmat = content_self_similarity(feat_content.float())
 
-    distance = torch.abs(matrix_feat_res - matrix_feat_cont).mean()
+    distance = torch.abs(matrix_feat_res - content_distmat.float()).mean()
     return distance
 
 
-def style_loss(matrix_x, matrix_y):
+def style_loss(matrix_x, matrix_y, tile_size=None):
     """
     Compute style loss between two torch.Tensor objects
     :params:
         matrix_x: torch.Tensor object
         matrix_y: torch.Tensor object
+        tile_size: int, if set, compare against tiles of this many style
+            samples instead of the full distance matrix
     :return:
         torch.Tensor object of style loss
     """
@@ -284,6 +388,9 @@ def style_loss(matrix_x, matrix_y):
         yuv = torch.mm(color_space_transformation_matrix, rgb)
         return yuv
 
+    # reductions stay in float32 when the extractor runs in lower precision
+    matrix_x = matrix_x.float()
+    matrix_y = matrix_y.float()
     shape = matrix_x.shape[1]
 
     if shape == 3:
@@ -297,6 +404,9 @@ def style_loss(matrix_x, matrix_y):
         matrix_x = matrix_x.transpose(0, 1).contiguous().view(shape, -1).transpose(0, 1)
         matrix_y = matrix_y.transpose(0, 1).contiguous().view(shape, -1).transpose(0, 1)
 
+    if tile_size is not None:
+        return tiled_remd_loss(matrix_x, matrix_y, tile_size, with_l2=shape == 3)
+
     distance_matrix = distmat(matrix_x, matrix_y)
 
     if shape == 3:
@@ -318,8 +428,8 @@ def moment_loss(matrix_x, matrix_y):
         torch.Tensor object of moment loss
     """
     loss = 0.0
-    matrix_x = matrix_x.squeeze().t()
-    matrix_y = matrix_y.squeeze().t()
+    matrix_x = matrix_x.float().squeeze().t()
+    matrix_y = matrix_y.float().squeeze().t()
 
     mean_x = matrix_x.mean(0, keepdim=True)
     mean_y = matrix_y.mean(0, keepdim=True)
@@ -339,6 +449,53 @@ def moment_loss(matrix_x, matrix_y):
     return loss
 
 
+def sample_hypercolumns(features, samps, generator=None):
+    """
+    Sample hypercolumns at random locations of a feature pyramid. The
+    locations are drawn and mapped to every layer on the device of the
+    features, without a round trip to the host.
+    :params:
+        features: list of torch.Tensor objects, the first one has full resolution
+        samps: int, number of sampled locations
+        generator: optional torch.Generator on the device of the features
+    :return:
+        torch.Tensor object of sampled features (N x sum(C) x samps)
+    """
+    device = features[0].device
+    height, width = features[0].shape[2], features[0].shape[3]
+    samples = min(samps, height * width)
+    locations = torch.randperm(height * width, generator=generator, device=device)[
+        :samples
+    ]
+
+    # every layer with a lower resolution than its predecessor halves the
+    # coordinates, like the max pooling layers of the extractor
+    shifts, heights, widths = [], [], []
+    shift = 0
+    for i, layer_feat in enumerate(features):
+        if i > 0 and layer_feat.size(2) < features[i - 1].size(2):
+            shift += 1
+        shifts.append(shift)
+        heights.append(layer_feat.size(2))
+        widths.append(layer_feat.size(3))
+    shifts_t = torch.tensor(shifts, device=device).view(-1, 1)
+    heights_t = torch.tensor(heights, device=device).view(-1, 1)
+    widths_t = torch.tensor(widths, device=device).view(-1, 1)
+
+    # coordinates of all layers in one step (layers x samples)
+    x_coords = torch.minimum(
+        (locations // width).view(1, -1) >> shifts_t, heights_t - 1
+    )
+    y_coords = torch.minimum((locations % width).view(1, -1) >> shifts_t, widths_t - 1)
+    flat_indices = x_coords * widths_t + y_coords
+
+    feat_samples = [
+        layer_feat.flatten(2).index_select(2, flat_indices[i])
+        for i, layer_feat in enumerate(features)
+    ]
+    return torch.cat(feat_samples, 1).detach()
+
+
 def sample_indices(feat_content):
     """
     Sample indices from feature map
@@ -364,31 +521,25 @@ def sample_indices(feat_content):
     return channel_coords, spatial_coords
 
 
-def spatial_feature_extract(
-    feature_results, feature_contents, offset_x_meshgrid, offset_y_meshgrid
-):
+def spatial_feature_resample(features, offset_x_meshgrid, offset_y_meshgrid):
     """
-    Extract spatial features from feature maps
+    Bilinearly resample a list of feature maps at the given locations
     :params:
-        feature_results: list of torch.Tensor objects
-        feature_contents: list of torch.Tensor objects
+        features: list of torch.Tensor objects (N x C x H x W)
         offset_x_meshgrid: np.array object
         offset_y_meshgrid: np.array object
     :return:
-        resampled_feature_results: list of torch.Tensor objects
+        torch.Tensor object of the concatenated samples and their
+        coordinates (N x sum(C) + 2 x locations x 1)
     """
-    resampled_feature_results, resampled_feature_content = [], []
-    device = feature_results[0].device
+    resampled_features = []
+    device = features[0].device
+    batch = features[0].size(0)
 
     # for each extracted layer
-    for index, (feat_res, feat_cont) in enumerate(
-        zip(feature_results, feature_contents)
-    ):
-        feature_result = feat_res
-        feature_content = feat_cont
-
+    for index, feature in enumerate(features):
         # hack to detect reduced scale
-        if index > 0 and feature_results[index - 1].size(2) > feat_res.size(2):
+        if index > 0 and features[index - 1].size(2) > feature.size(2):
             offset_x_meshgrid = offset_x_meshgrid / 2.0
             offset_y_meshgrid = offset_y_meshgrid / 2.0
 
@@ -420,97 +571,100 @@ def spatial_feature_extract(
         ]
 
         offset_x_floor = np.clip(
-            offset_x_floor.astype(np.int32), 0, feature_result.size(2) - 1
+            offset_x_floor.astype(np.int32), 0, feature.size(2) - 1
         )
         offset_y_floor = np.clip(
-            offset_y_floor.astype(np.int32), 0, feature_result.size(3) - 1
+            offset_y_floor.astype(np.int32), 0, feature.size(3) - 1
         )
 
         resample_indices = [
-            offset_x_floor * feature_result.size(3) + offset_y_floor,
-            offset_x_floor * feature_result.size(3)
-            + np.clip(offset_y_floor + 1, 0, feature_result.size(3) - 1),
-            np.clip(offset_x_floor + 1, 0, feature_result.size(2) - 1)
-            * feature_result.size(3)
+            offset_x_floor * feature.size(3) + offset_y_floor,
+            offset_x_floor * feature.size(3)
+            + np.clip(offset_y_floor + 1, 0, feature.size(3) - 1),
+            np.clip(offset_x_floor + 1, 0, feature.size(2) - 1) * feature.size(3)
             + offset_y_floor,
-            np.clip(offset_x_floor + 1, 0, feature_result.size(2) - 1)
-            * feature_result.size(3)
-            + np.clip(offset_y_floor + 1, 0, feature_result.size(3) - 1),
+            np.clip(offset_x_floor + 1, 0, feature.size(2) - 1) * feature.size(3)
+            + np.clip(offset_y_floor + 1, 0, feature.size(3) - 1),
         ]
 
-        feature_result = feature_result.view(
-            1,
-            feature_result.size(1),
-            feature_result.size(2) * feature_result.size(3),
-            1,
-        )
-        feature_result = (
-            feature_result[:, :, resample_indices[0], :]
-            .mul_(resample_weights[0])
-            .add_(
-                feature_result[:, :, resample_indices[1], :].mul_(resample_weights[1])
-            )
-            .add_(
-                feature_result[:, :, resample_indices[2], :].mul_(resample_weights[2])
-            )
-            .add_(
-                feature_result[:, :, resample_indices[3], :].mul_(resample_weights[3])
-            )
-        )
-
-        feature_content = feature_content.view(
-            1,
-            feature_content.size(1),
-            feature_content.size(2) * feature_content.size(3),
-            1,
+        # reshape also accepts channels_last feature maps
+        feature = feature.reshape(
+            batch, feature.size(1), feature.size(2) * feature.size(3), 1
         )
-        feature_content = (
-            feature_content[:, :, resample_indices[0], :]
+        feature = (
+            feature[:, :, resample_indices[0], :]
             .mul_(resample_weights[0])
-            .add_(
-                feature_content[:, :, resample_indices[1], :].mul_(resample_weights[1])
-            )
-            .add_(
-                feature_content[:, :, resample_indices[2], :].mul_(resample_weights[2])
-            )
-            .add_(
-                feature_content[:, :, resample_indices[3], :].mul_(resample_weights[3])
-            )
+            .add_(feature[:, :, resample_indices[1], :].mul_(resample_weights[1]))
+            .add_(feature[:, :, resample_indices[2], :].mul_(resample_weights[2]))
+            .add_(feature[:, :, resample_indices[3], :].mul_(resample_weights[3]))
         )
+        resampled_features.append(feature)
 
-        resampled_feature_results.append(feature_result)
-        resampled_feature_content.append(feature_content)
+    concatenated_features = torch.cat([li.contiguous() for li in resampled_features], 1)
 
-    concatenated_feature_results = torch.cat(
-        [li.contiguous() for li in resampled_feature_results], 1
-    )
-    concatenated_feature_content = torch.cat(
-        [li.contiguous() for li in resampled_feature_content], 1
-    )
-
-    offset_x_meshgrid = (
-        torch.from_numpy(offset_x_meshgrid)
-        .view(1, 1, concatenated_feature_results.size(2), 1)
-        .float()
-        .to(device, non_blocking=True)
-    )
-    offset_y_meshgrid = (
-        torch.from_numpy(offset_y_meshgrid)
-        .view(1, 1, concatenated_feature_results.size(2), 1)
+    coords = [
+        torch.from_numpy(coord)
+        .view(1, 1, concatenated_features.size(2), 1)
         .float()
         .to(device, non_blocking=True)
-    )
+        .expand(batch, 1, -1, 1)
+        for coord in (offset_x_meshgrid, offset_y_meshgrid)
+    ]
+    return torch.cat([concatenated_features, *coords], 1)
 
-    concatenated_feature_results = torch.cat(
-        [concatenated_feature_results, offset_x_meshgrid, offset_y_meshgrid], 1
-    )
-    concatenated_feature_content = torch.cat(
-        [concatenated_feature_content, offset_x_meshgrid, offset_y_meshgrid], 1
+
+def spatial_feature_extract(
+    feature_results, feature_contents, offset_x_meshgrid, offset_y_meshgrid
+):
+    """
+    Extract spatial features from feature maps
+    :params:
+        feature_results: list of torch.Tensor objects
+        feature_contents: list of torch.Tensor objects
+        offset_x_meshgrid: np.array object
+        offset_y_meshgrid: np.array object
+    :return:
+        resampled_feature_results: list of torch.Tensor objects
+    """
+    return (
+        spatial_feature_resample(feature_results, offset_x_meshgrid, offset_y_meshgrid),
+        spatial_feature_resample(
+            feature_contents, offset_x_meshgrid, offset_y_meshgrid
+        ),
     )
-    return concatenated_feature_results, concatenated_feature_content
 
 
-def calculate_loss(feat_result, feat_content, feat_style, indices, content_weight):
+def precompute_content_distmats(feat_content, indices, num_locations=1024):
+    """
+    Resample the content features at the sampled locations and compute their
+    self-similarity once, so the optimization loop only works on the result
+    :params:
+        feat_content: list of torch.Tensor objects (N x C x H x W)
+        indices: the sampled locations
+        num_locations: number of locations used by the loss
+    :return:
+        list of self-similarity matrices, one per image of the batch
+    """
+    with torch.no_grad():
+        spatial_content = spatial_feature_resample(
+            feat_content, indices[0][:num_locations], indices[1][:num_locations]
+        )
+        return [
+            content_self_similarity(spatial_content[job : job + 1])
+            for job in range(spatial_content.size(0))
+        ]
+
+
+def calculate_loss(
+    feat_result,
+    feat_content,
+    feat_style,
+    indices,
+    content_weight,
+    tile_size=None,
+    content_distmat=None,
+    num_locations=1024,
+):
     """
     Calculate the loss between the result and the content and style images.
     :params:
@@ -519,18 +673,26 @@ def calculate_loss(feat_result, feat_content, feat_style, indices, content_weigh
         feat_style: the feature map of the style image
         indices: the indices of the style image
         content_weight: the weight of the content loss
+        tile_size: number of style samples per tile of the style loss, None
+            computes the full distance matrix
+        content_distmat: precomputed self-similarity of the content features
+            at the indices, skips resampling the content
+        num_locations: number of sampled locations
     :return:
         loss: the loss between the result and the content and style images
     """
     # spatial feature extract
-    num_locations = 1024
-    spatial_result, spatial_content = spatial_feature_extract(
-        feat_result,
-        feat_content,
-        indices[0][:num_locations],
-        indices[1][:num_locations],
+    spatial_result = spatial_feature_resample(
+        feat_result, indices[0][:num_locations], indices[1][:num_locations]
+    )
+    spatial_content = None
+    if content_distmat is None:
+        spatial_content = spatial_feature_resample(
+            feat_content, indices[0][:num_locations], indices[1][:num_locations]
+        )
+    loss_content = content_loss(
+        spatial_result, spatial_content, content_distmat=content_distmat
     )
-    loss_content = content_loss(spatial_result, spatial_content)
 
     shape = feat_style.shape[1]
     spatial_style = feat_style.view(1, shape, -1, 1)
@@ -539,14 +701,16 @@ def calculate_loss(feat_result, feat_content, feat_style, indices, content_weigh
     )  # (sum of all extracted channels)
 
     loss_remd = style_loss(
-        spatial_result[:, :feat_max, :, :], spatial_style[:, :feat_max, :, :]
+        spatial_result[:, :feat_max, :, :],
+        spatial_style[:, :feat_max, :, :],
+        tile_size=tile_size,
     )
 
     loss_moment = moment_loss(spatial_result[:, :-2, :, :], spatial_style)
     # palette matching
     content_weight_frac = 1.0 / max(content_weight, 1.0)
     loss_moment += content_weight_frac * style_loss(
-        spatial_result[:, :3, :, :], spatial_style[:, :3, :, :]
+        spatial_result[:, :3, :, :], spatial_style[:, :3, :, :], tile_size=tile_size
     )
 
     loss_style = loss_remd + 1.0 * loss_moment
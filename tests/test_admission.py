@@ -0,0 +1,19 @@
+"""
+Tests of the memory budget of the admission control
+"""
+from style_ai.admission import default_memory_budget
+
+
+def test_memory_budget_is_split_between_processes(monkeypatch):
+    monkeypatch.setenv("STYLE_AI_MEMORY_BUDGET_MB", "1000")
+    monkeypatch.setenv("STYLE_AI_PROCESSES", "4")
+
+    assert default_memory_budget("cpu") == 250 * 2**20
+    assert default_memory_budget("cpu", reserved=2**20) == 249 * 2**20
+
+
+def test_memory_budget_defaults_to_one_process(monkeypatch):
+    monkeypatch.setenv("STYLE_AI_MEMORY_BUDGET_MB", "1000")
+    monkeypatch.delenv("STYLE_AI_PROCESSES", raising=False)
+
+    assert default_memory_budget("cpu") == 1000 * 2**20
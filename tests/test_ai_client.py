@@ -0,0 +1,91 @@
+"""
+Tests of the uploads and retries of the webshop's AI client
+"""
+import io
+
+import pytest
+import requests
+from PIL import Image
+
+from sts.utils.ai_client import AIClient, encode_upload
+
+
+@pytest.mark.parametrize("mode", ["P", "1"])
+def test_graphics_are_resized_smoothly(mode):
+    # vertical stripes of 3 pixels in two colors
+    stripes = Image.new("L", (999, 999))
+    stripes.putdata([255 * (x // 3 % 2) for _ in range(999) for x in range(999)])
+    graphic = stripes.convert(mode)
+
+    _, data = encode_upload(graphic, resize_to=256)
+    upload = Image.open(io.BytesIO(data)).convert("L")
+
+    assert upload.size == (256, 256)
+    # NEAREST would only keep the two colors of the stripes
+    assert len(upload.getcolors()) > 2
+
+
+def connection_error(refused):
+    """
+    Returns the error requests raises for a refused or a reset connection.
+    """
+    if refused:
+        try:
+            # nothing listens on the discard port
+            requests.get("http://127.0.0.1:9", timeout=1)
+        except requests.exceptions.ConnectionError as error:
+            return error
+    return requests.exceptions.ConnectionError("Connection reset by peer")
+
+
+@pytest.fixture(name="client")
+def fixture_client():
+    return AIClient(["http://backend"], retries=2, retry_backoff=0)
+
+
+def failing_session(client, monkeypatch, error):
+    """
+    Lets every request of the client fail with error and returns the list
+    of the sent methods.
+    """
+    sent = []
+
+    def request(method, url, **kwargs):
+        sent.append(method)
+        raise error
+
+    monkeypatch.setattr(client.session, "request", request)
+    return sent
+
+
+@pytest.mark.parametrize("method", ["GET", "POST"])
+def test_refused_connections_are_retried(client, monkeypatch, method):
+    sent = failing_session(client, monkeypatch, connection_error(refused=True))
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client.request(method, "http://backend/jobs")
+    assert len(sent) == 3
+
+
+def test_reset_connections_are_retried_for_idempotent_methods(client, monkeypatch):
+    error = connection_error(refused=False)
+    sent = failing_session(client, monkeypatch, error)
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client.request("DELETE", "http://backend/jobs/1")
+    assert len(sent) == 3
+
+    sent.clear()
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client.request("POST", "http://backend/jobs")
+    assert sent == ["POST"]
+
+
+def test_submit_does_not_resend_a_job_after_a_reset(client, monkeypatch):
+    client.urls = ["http://a", "http://b"]
+    monkeypatch.setattr(client, "health", lambda url: {"jobs": {}})
+    sent = failing_session(client, monkeypatch, connection_error(refused=False))
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client.submit([], {})
+    assert sent == ["POST"]
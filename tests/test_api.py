@@ -0,0 +1,123 @@
+"""
+Tests of the uploads of the style transfer API
+"""
+import base64
+import io
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from style_ai import api
+from style_ai.jobs import JobQueue
+
+
+def image_file(mode, image_format="PNG", size=(40, 30)):
+    """
+    Returns the bytes of an image file in the given mode, small by default.
+    """
+    upload = io.BytesIO()
+    Image.new(mode, size).save(upload, format=image_format)
+    return upload.getvalue()
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA", "L", "P", "LA", "I;16"])
+def test_uploads_are_decoded_to_rgb(mode):
+    image = api.decode_image(image_file(mode))
+
+    assert image.mode == "RGB"
+    assert image.size == (40, 30)
+
+
+@pytest.mark.parametrize(
+    "mode, image_format",
+    [("P", "PNG"), ("1", "PNG"), ("I;16", "PNG"), ("P", "GIF"), ("RGBA", "PNG")],
+)
+def test_large_uploads_are_reduced_in_any_mode(mode, image_format):
+    data = image_file(mode, image_format, size=(3000, 2000))
+
+    image = api.decode_image(data, max_size=1024)
+
+    assert image.mode == "RGB"
+    assert image.size == (1500, 1000)
+
+
+def test_base64_uploads_and_downscaled_decode():
+    data = base64.b64encode(image_file("RGB", "JPEG"))
+
+    assert api.decode_image(data, "base64", max_size=20).size == (20, 15)
+
+
+@pytest.fixture(name="client")
+def fixture_client(monkeypatch):
+    # the workers are not started, the jobs stay queued
+    monkeypatch.setattr(api, "job_queue", JobQueue(api.run_job))
+    return TestClient(api.app)
+
+
+def post_job(client, content, style=None, **params):
+    """
+    Posts a content and style upload to /jobs.
+    """
+    files = [
+        ("content_img", ("content", content)),
+        ("style_img", ("style", style or image_file("RGB"))),
+    ]
+    return client.post("/jobs", files=files, params=params)
+
+
+def test_rgba_upload_is_accepted(client):
+    assert post_job(client, image_file("RGBA")).status_code == 202
+
+
+def test_non_image_upload_answers_415(client):
+    assert post_job(client, b"no image at all").status_code == 415
+
+
+def test_corrupt_uploads_answer_400(client):
+    truncated = image_file("RGB", "JPEG")[:200]
+
+    assert post_job(client, truncated).status_code == 400
+    assert post_job(client, b"abc", encoding="base64").status_code == 400
+
+
+@pytest.fixture(name="limited_client")
+def fixture_limited_client():
+    small_app = FastAPI()
+    small_app.add_middleware(api.RequestSizeLimit, max_bytes=1000)
+
+    @small_app.post("/upload")
+    async def upload(request: Request):
+        return {"size": len(await request.body())}
+
+    return TestClient(small_app)
+
+
+def test_request_size_limit_checks_content_length(limited_client):
+    assert limited_client.post("/upload", content=b"x" * 1000).json() == {"size": 1000}
+    assert limited_client.post("/upload", content=b"x" * 1001).status_code == 413
+
+
+def test_request_size_limit_cuts_off_chunked_bodies(limited_client):
+    # a generator is sent chunked, without Content-Length
+    small = limited_client.post("/upload", content=iter([b"x" * 400] * 2))
+    large = limited_client.post("/upload", content=iter([b"x" * 400] * 10))
+
+    assert small.json() == {"size": 800}
+    assert large.status_code == 413
+
+
+def test_jobs_are_polled_without_images(client):
+    job_id = post_job(client, image_file("RGB")).json()["job_id"]
+
+    assert client.get(f"/jobs/{job_id}/preview").status_code == 409
+    api.job_queue.get(job_id).preview = (0, 3, Image.new("RGB", (40, 30)))
+    body = client.get(f"/jobs/{job_id}", params={"images": "false"}).json()
+    preview = client.get(f"/jobs/{job_id}/preview")
+
+    assert body["preview"] == {"scale": 1, "num_scales": 3}
+    assert "result_image" not in body
+    assert preview.headers["content-type"] == "image/jpeg"
+    assert preview.headers["x-preview-scale"] == "1/3"
+    assert Image.open(io.BytesIO(preview.content)).size == (40, 30)
@@ -0,0 +1,87 @@
+"""
+Tests of the micro-batching of concurrent style transfer requests
+"""
+import threading
+
+import numpy as np
+import pytest
+
+from style_ai import batching
+from style_ai.batching import MicroBatcher, run_transfer_batch
+from style_ai.cancellation import CancellationToken, JobCancelled
+
+
+def test_requests_of_one_bucket_share_a_batch():
+    batches = []
+    release = threading.Event()
+
+    def run_batch(items):
+        release.wait(5)
+        batches.append(items)
+        return [item * 10 for item in items]
+
+    batcher = MicroBatcher(
+        run_batch, max_batch=3, max_wait=0.2, key=lambda item: item % 2
+    )
+    futures = [batcher.submit(item) for item in range(5)]
+    batcher.start()
+    release.set()
+    results = [future.result(5) for future in futures]
+    batcher.shutdown(timeout=5)
+
+    assert results == [0, 10, 20, 30, 40]
+    assert sorted(batches) == [[0, 2, 4], [1, 3]]
+    assert batcher.stats()["batches"] == 2
+
+
+def test_oldest_request_runs_after_max_wait():
+    batcher = MicroBatcher(lambda items: items, max_batch=4, max_wait=0.01)
+    batcher.start()
+
+    assert batcher.submit("alone").result(5) == "alone"
+    batcher.shutdown(timeout=5)
+    assert batcher.stats()["mean_batch_size"] == 1
+
+
+def test_errors_fail_only_their_requests():
+    def run_batch(items):
+        if "all" in items:
+            raise RuntimeError("batch failed")
+        return [ValueError(item) if item == "bad" else item for item in items]
+
+    batcher = MicroBatcher(run_batch, max_batch=2, max_wait=0.05)
+    good, bad = batcher.submit("good"), batcher.submit("bad")
+    batcher.start()
+
+    assert good.result(5) == "good"
+    with pytest.raises(ValueError):
+        bad.result(5)
+    with pytest.raises(RuntimeError):
+        batcher.submit("all").result(5)
+    batcher.shutdown(timeout=5)
+    with pytest.raises(RuntimeError):
+        batcher.submit("late")
+
+
+def test_cancelled_request_is_dropped_from_its_batch(monkeypatch):
+    def fake_strotss_batch(contents, styles, **kwargs):
+        kwargs["cancel_token"].raise_if_cancelled()
+        state = np.zeros((len(contents), 3, 4, 4), dtype=np.float32)
+        return list(contents), {"state": state}
+
+    monkeypatch.setattr(batching, "strotss_batch", fake_strotss_batch)
+    cancelled, running = CancellationToken(), CancellationToken()
+    cancelled.cancel("client disconnected")
+    items = [
+        {"content": "first", "style": "style", "cancel_token": cancelled},
+        {"content": "second", "style": "style", "cancel_token": running},
+    ]
+
+    results = run_transfer_batch(items)
+
+    assert isinstance(results[0], JobCancelled)
+    assert results[1] == "second"
+    assert items[1]["state"].shape == (1, 3, 4, 4)
+
+    running.cancel("shutdown")
+    assert all(isinstance(result, JobCancelled) for result in run_transfer_batch(items))
@@ -0,0 +1,58 @@
+"""
+Tests of the cancellation tokens of style transfer jobs
+"""
+import time
+
+import pytest
+
+from style_ai.cancellation import (
+    DEADLINE_EXCEEDED,
+    CancellationToken,
+    CombinedToken,
+    JobCancelled,
+)
+
+
+def test_token_keeps_the_first_reason():
+    token = CancellationToken()
+    assert not token.cancelled
+
+    token.cancel("client disconnected")
+    token.cancel("shutdown")
+
+    assert token.cancelled
+    with pytest.raises(JobCancelled) as error:
+        token.raise_if_cancelled()
+    assert error.value.reason == "client disconnected"
+
+
+def test_token_is_cancelled_past_its_deadline():
+    token = CancellationToken(timeout=0.01)
+    time.sleep(0.02)
+
+    assert token.cancelled
+    assert token.reason == DEADLINE_EXCEEDED
+
+
+def test_combined_token_needs_every_job_cancelled():
+    first, second = CancellationToken(), CancellationToken()
+    combined = CombinedToken([first, second])
+
+    first.cancel("client disconnected")
+    assert not combined.cancelled
+    combined.raise_if_cancelled()
+
+    second.cancel("shutdown")
+    assert combined.cancelled
+    with pytest.raises(JobCancelled) as error:
+        combined.raise_if_cancelled()
+    assert error.value.reason == "client disconnected"
+
+
+def test_combined_token_with_a_job_that_cannot_be_cancelled():
+    token = CancellationToken()
+    combined = CombinedToken([token, None])
+    token.cancel()
+
+    assert not combined.cancelled
+    assert not CombinedToken([None]).cancelled
@@ -0,0 +1,53 @@
+"""
+Tests of the cache for the sampled features of style images
+"""
+import numpy as np
+
+from style_ai.feature_cache import StyleFeatureCache
+
+
+def test_memory_tier_evicts_the_least_recently_used_entry():
+    cache = StyleFeatureCache(max_bytes=2 * 800)
+    first, second, third = (
+        np.full(100, value, dtype=np.float64) for value in (1, 2, 3)
+    )
+    cache.put("first", first)
+    cache.put("second", second)
+    cache.get("first")
+    cache.put("third", third)
+
+    assert cache.get("second") is None
+    assert cache.get("first") is first
+    assert cache.get("third") is third
+    assert cache.stats()["bytes"] == 2 * 800
+
+
+def test_entries_larger_than_the_memory_tier_are_not_kept():
+    cache = StyleFeatureCache(max_bytes=100)
+    cache.put("large", np.zeros(100))
+
+    assert cache.get("large") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_disk_tier_survives_a_new_cache(tmp_path):
+    array = np.arange(12, dtype=np.float32).reshape(3, 4)
+    StyleFeatureCache(directory=tmp_path).put("key", array)
+
+    cache = StyleFeatureCache(directory=tmp_path)
+    cached = cache.get("key")
+
+    np.testing.assert_array_equal(cached, array)
+    assert cache.stats()["disk_hits"] == 1
+    # the hit is promoted to the memory tier
+    assert cache.get("key") is cached
+    assert cache.stats()["hits"] == 1
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_keys_depend_on_every_part():
+    key = StyleFeatureCache.make_key("style", "hash", 512, "uniform", 0)
+
+    assert key == StyleFeatureCache.make_key("style", "hash", 512, "uniform", 0)
+    assert key != StyleFeatureCache.make_key("style", "hash", 256, "uniform", 0)
+    assert key != StyleFeatureCache.make_key("style", "hash", 512, "uniform", 1)
@@ -0,0 +1,80 @@
+"""
+Tests of the job queue behind the style transfer API
+"""
+import io
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from style_ai import api
+from style_ai.jobs import CANCELLED, DONE, JobQueue, QueueFull
+
+
+def run_queue(queue, jobs):
+    """
+    Starts the queue, waits for the jobs and stops it.
+    """
+    queue.start()
+    for job in jobs:
+        job.wait(5)
+    queue.shutdown(timeout=5)
+
+
+def test_jobs_are_dealt_out_round_robin_per_user():
+    order = []
+    queue = JobQueue(lambda job: order.append(job.inputs["name"]), workers=1)
+    jobs = [
+        queue.submit(user, {"name": f"{user}{index}"})
+        for user, index in [("a", 1), ("a", 2), ("a", 3), ("b", 1), ("b", 2)]
+    ]
+
+    assert queue.position(jobs[2]) == 4
+    run_queue(queue, jobs)
+
+    assert order == ["a1", "b1", "a2", "b2", "a3"]
+    assert all(job.state == DONE for job in jobs)
+
+
+def test_submit_raises_queue_full_at_the_limit():
+    queue = JobQueue(lambda job: None, max_queued=2)
+    queue.submit("a", {})
+    queue.submit("b", {})
+
+    with pytest.raises(QueueFull):
+        queue.submit("c", {})
+
+
+def test_on_finish_gets_jobs_that_never_ran():
+    finished = []
+    release = threading.Event()
+    queue = JobQueue(
+        lambda job: release.wait(5),
+        on_finish=lambda job, inputs: finished.append((inputs["name"], job.state)),
+    )
+    running = queue.submit("a", {"name": "running"})
+    waiting = queue.submit("a", {"name": "waiting"})
+    queue.cancel(waiting.id)
+    release.set()
+    run_queue(queue, [running])
+
+    assert finished == [("waiting", CANCELLED), ("running", DONE)]
+    assert waiting.inputs is None
+
+
+def test_api_answers_429_when_the_queue_is_full(monkeypatch):
+    # the workers are not started, so every job stays queued
+    monkeypatch.setattr(api, "job_queue", JobQueue(api.run_job, max_queued=1))
+    upload = io.BytesIO()
+    Image.new("RGB", (32, 32)).save(upload, format="JPEG")
+    files = [
+        ("content_img", ("content.jpg", upload.getvalue())),
+        ("style_img", ("style.jpg", upload.getvalue())),
+    ]
+    client = TestClient(api.app)
+
+    assert client.post("/jobs", files=files).status_code == 202
+    response = client.post("/jobs", files=files)
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "5"
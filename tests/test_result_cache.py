@@ -0,0 +1,124 @@
+"""
+Tests of the result cache of identical transfer requests
+"""
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+from style_ai.cancellation import CancellationToken, JobCancelled
+from style_ai.result_cache import ResultCache
+
+
+def solid(color):
+    """
+    Returns a small image of one color.
+    """
+    return Image.new("RGB", (8, 8), color)
+
+
+def test_key_depends_on_images_and_params():
+    key = ResultCache.make_key(solid("red"), solid("blue"), resize_to=256)
+
+    assert key == ResultCache.make_key(solid("red"), solid("blue"), resize_to=256)
+    assert key != ResultCache.make_key(solid("red"), solid("blue"), resize_to=512)
+    assert key != ResultCache.make_key(solid("blue"), solid("red"), resize_to=256)
+
+
+def test_identical_requests_share_one_run():
+    cache = ResultCache()
+    started = threading.Event()
+    release = threading.Event()
+    runs = []
+
+    def compute():
+        runs.append(1)
+        started.set()
+        release.wait(5)
+        return solid("green")
+
+    results = []
+    owner = threading.Thread(
+        target=lambda: results.append(cache.get_or_compute("key", compute))
+    )
+    owner.start()
+    started.wait(5)
+    waiter = threading.Thread(
+        target=lambda: results.append(cache.get_or_compute("key", compute))
+    )
+    waiter.start()
+    while cache.stats()["shared"] == 0:
+        time.sleep(0.01)
+    release.set()
+    owner.join(5)
+    waiter.join(5)
+
+    assert len(runs) == 1
+    assert [result.getpixel((0, 0)) for result in results] == [(0, 128, 0)] * 2
+    # a later request is served from the store
+    assert cache.get_or_compute("key", compute).getpixel((0, 0)) == (0, 128, 0)
+    assert len(runs) == 1
+
+
+def test_waiter_runs_itself_when_the_owner_is_cancelled():
+    cache = ResultCache()
+    started = threading.Event()
+    release = threading.Event()
+
+    def cancelled_compute():
+        started.set()
+        release.wait(5)
+        raise JobCancelled("client disconnected")
+
+    owner_errors = []
+
+    def owner():
+        try:
+            cache.get_or_compute("key", cancelled_compute)
+        except JobCancelled as error:
+            owner_errors.append(error)
+
+    thread = threading.Thread(target=owner)
+    thread.start()
+    started.wait(5)
+    results = []
+    waiter = threading.Thread(
+        target=lambda: results.append(
+            cache.get_or_compute(
+                "key", lambda: solid("blue"), cancel_token=CancellationToken()
+            )
+        )
+    )
+    waiter.start()
+    while cache.stats()["shared"] == 0:
+        time.sleep(0.01)
+    release.set()
+    thread.join(5)
+    waiter.join(5)
+
+    assert len(owner_errors) == 1
+    assert results[0].getpixel((0, 0)) == (0, 0, 255)
+    assert cache.stats()["in_flight"] == 0
+
+
+def test_cancelled_waiter_stops_waiting():
+    cache = ResultCache()
+    started = threading.Event()
+    release = threading.Event()
+
+    def compute():
+        started.set()
+        release.wait(5)
+        return solid("red")
+
+    thread = threading.Thread(target=lambda: cache.get_or_compute("key", compute))
+    thread.start()
+    started.wait(5)
+    token = CancellationToken()
+    token.cancel("client disconnected")
+
+    with pytest.raises(JobCancelled):
+        cache.get_or_compute("key", compute, cancel_token=token)
+    release.set()
+    thread.join(5)
@@ -0,0 +1,25 @@
+"""
+Tests of the tiled low-memory style loss
+"""
+import pytest
+import torch
+
+from style_ai.utils import style_loss
+
+
+@pytest.mark.parametrize("channels", [3, 64])
+@pytest.mark.parametrize("tile_size", [7, 64, 1000])
+def test_tiled_style_loss_matches_the_dense_loss(channels, tile_size):
+    generator = torch.Generator().manual_seed(0)
+    result = torch.rand(100, channels, 1, 1, generator=generator)
+    style = torch.rand(150, channels, 1, 1, generator=generator)
+
+    dense_input = result.clone().requires_grad_()
+    dense = style_loss(dense_input, style)
+    dense.backward()
+    tiled_input = result.clone().requires_grad_()
+    tiled = style_loss(tiled_input, style, tile_size=tile_size)
+    tiled.backward()
+
+    assert torch.allclose(tiled, dense, atol=1e-5)
+    assert torch.allclose(tiled_input.grad, dense_input.grad, atol=1e-6)